@@ -0,0 +1,180 @@
+import json
+import os
+import re
+import time
+from datetime import datetime
+
+import numpy as np
+
+import metrics
+from pipeline import categories
+
+# Tag analytics over the enriched sheet. Free-text values are dictionary
+# encoded once: every country, month and tag becomes an integer code into a
+# sorted label array, and the tags of all rows become two parallel arrays
+# (row index, tag code) - a sparse row x tag matrix. Counts, cross tables,
+# co-occurrence and trends are then bincounts and matrix products over those
+# arrays instead of loops over rows (see script-analytics.py).
+
+DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y', '%m/%d/%Y', '%Y/%m/%d', '%d.%m.%Y', '%Y-%m-%dT%H:%M:%S', '%d %B %Y',
+                '%B %d, %Y', '%Y-%m')
+UNKNOWN = ('', 'unknown', 'skipped', 'error', 'no tags', 'no suggested tags', 'n/a', 'none')
+COOCCURRENCE_TOP = 50  # Suggested tags kept for the co-occurrence matrix
+
+_category_names = {name.lower(): name for name in categories}
+
+
+def normalize_tag(tag):
+    tag = re.sub(r'\s+', ' ', tag.strip().strip('.#"\'').strip()).lower()
+    if tag in UNKNOWN:
+        return ''
+    # Predefined categories keep their spelling from pipeline.categories
+    return _category_names.get(tag, tag)
+
+
+# 'YYYY-MM-DD' of a date cell, or '' when it cannot be parsed
+def day_of(value):
+    value = value.strip()
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    return ''
+
+
+# 'YYYY-MM' of a date cell, or ''
+def month_of(value):
+    return day_of(value)[:7]
+
+
+# Dictionary-encode values: (sorted labels, code of every value). Parsing
+# functions run once per distinct value, not once per row
+def encode(values, parse=None):
+    labels, codes = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+    if parse is not None:
+        parsed = np.array([parse(label) for label in labels], dtype=str)
+        labels, remap = np.unique(parsed, return_inverse=True)
+        codes = remap[codes]
+    return labels, codes.astype(np.int32)
+
+
+# Split comma lists into the sparse (row index, tag code) form: (labels,
+# row indices, tag codes) with every tag at most once per row
+def encode_tags(tag_lists):
+    split = [tag_list.split(',') for tag_list in tag_lists]
+    rows = np.repeat(np.arange(len(split), dtype=np.int64), [len(tags) for tags in split])
+    labels, codes = encode([tag for tags in split for tag in tags], normalize_tag)
+    # Drop empty tags and repeats within a row
+    known = labels != ''
+    labels, remap = labels[known], np.cumsum(known) - 1
+    keep = known[codes]
+    pairs = np.unique(rows[keep] * max(len(labels), 1) + remap[codes[keep]])
+    return labels, (pairs // max(len(labels), 1)).astype(np.int32), (pairs % max(len(labels), 1)).astype(np.int32)
+
+
+class TagAnalytics:
+    def __init__(self, dates, countries, predefined_tags, suggested_tags):
+        with metrics.span('analytics.encode'):
+            self.size = len(dates)
+            self.months, self.month_codes = encode(dates, month_of)
+            self.countries, self.country_codes = encode(
+                [country.strip() if country.strip().lower() not in UNKNOWN else '' for country in countries])
+            self.tags = {
+                'categories': encode_tags(predefined_tags),
+                'suggested': encode_tags(suggested_tags),
+            }
+
+    def _group(self, by):
+        if by == 'country':
+            return self.countries, self.country_codes
+        if by == 'month':
+            return self.months, self.month_codes
+        raise ValueError(f"Unknown grouping {by!r}")
+
+    # {tag: rows} for a tag kind, most frequent first
+    def counts(self, kind='categories', top=None):
+        labels, _, codes = self.tags[kind]
+        totals = np.bincount(codes, minlength=len(labels))
+        order = np.argsort(-totals, kind='stable')[:top]
+        return {str(labels[i]): int(totals[i]) for i in order}
+
+    # Cross table of tag counts: (group labels, tag labels, groups x tags matrix)
+    def counts_by(self, kind='categories', by='country'):
+        group_labels, group_codes = self._group(by)
+        labels, rows, codes = self.tags[kind]
+        cells = np.bincount(group_codes[rows] * len(labels) + codes, minlength=len(group_labels) * len(labels))
+        return group_labels, labels, cells.reshape(len(group_labels), len(labels))
+
+    # Rows per country or month
+    def rows_by(self, by='country'):
+        group_labels, group_codes = self._group(by)
+        return dict(zip(map(str, group_labels), map(int, np.bincount(group_codes, minlength=len(group_labels)))))
+
+    # Dense row x tag indicator of the top most frequent tags of a kind
+    def indicator(self, kind='categories', top=None):
+        labels, rows, codes = self.tags[kind]
+        totals = np.bincount(codes, minlength=len(labels))
+        keep = np.argsort(-totals, kind='stable')[:top]
+        column = np.full(len(labels), -1)
+        column[keep] = np.arange(len(keep))
+        selected = column[codes] >= 0
+        matrix = np.zeros((self.size, len(keep)), dtype=np.float32)
+        matrix[rows[selected], column[codes[selected]]] = 1
+        return labels[keep], matrix
+
+    # How many rows carry both tags: (labels, tags x tags matrix)
+    def cooccurrence(self, kind='categories', top=None):
+        labels, matrix = self.indicator(kind, top)
+        return labels, (matrix.T @ matrix).astype(np.int64)
+
+    # Growth of every tag: rows in the last `window` months against the
+    # `window` months before, and the least-squares slope over all months
+    def trends(self, kind='categories', window=3):
+        month_labels, tag_labels, cells = self.counts_by(kind, 'month')
+        dated = month_labels != ''
+        month_labels, cells = month_labels[dated], cells[dated].astype(np.float64)
+        if len(month_labels) == 0:
+            return []
+        # Months without rows still count as zero in the series
+        first, last = np.datetime64(month_labels[0], 'M'), np.datetime64(month_labels[-1], 'M')
+        positions = (month_labels.astype('datetime64[M]') - first).astype(int)
+        series = np.zeros((int((last - first).astype(int)) + 1, len(tag_labels)))
+        series[positions] = cells
+
+        recent = series[-window:].sum(axis=0)
+        previous = series[-2 * window:-window].sum(axis=0) if len(series) > window else np.zeros(len(tag_labels))
+        x = np.arange(len(series)) - (len(series) - 1) / 2
+        slope = (x @ series) / max((x ** 2).sum(), 1)
+        return sorted((
+            {'tag': str(tag), 'recent': int(r), 'previous': int(p),
+             'growth': round(float((r - p) / max(p, 1)), 3), 'slope': round(float(s), 3)}
+            for tag, r, p, s in zip(tag_labels, recent, previous, slope)
+        ), key=lambda trend: -trend['growth'])
+
+    # Everything the website needs in one JSON-ready dict
+    def export(self, top=COOCCURRENCE_TOP):
+        with metrics.span('analytics.export'):
+            result = {'generated_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), 'rows': self.size}
+            result['rows_by_country'] = self.rows_by('country')
+            result['rows_by_month'] = self.rows_by('month')
+            for kind in self.tags:
+                section = {'counts': self.counts(kind, None if kind == 'categories' else top * 4)}
+                for by in ('country', 'month'):
+                    group_labels, tag_labels, cells = self.counts_by(kind, by)
+                    section[f'by_{by}'] = {
+                        str(group): {str(tag_labels[i]): int(n) for i, n in enumerate(row) if n}
+                        for group, row in zip(group_labels, cells) if group
+                    }
+                labels, matrix = self.cooccurrence(kind, None if kind == 'categories' else top)
+                section['cooccurrence'] = {'labels': labels.tolist(), 'matrix': matrix.tolist()}
+                section['trends'] = self.trends(kind)[:top]
+                result[kind] = section
+        return result
+
+
+def write_export(analytics, path):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(analytics.export(), f, ensure_ascii=False)
+    os.replace(tmp_path, path)
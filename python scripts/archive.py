@@ -0,0 +1,241 @@
+import atexit
+import gzip
+import logging
+import mmap
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+import metrics
+from pages import Page
+
+# Archive of raw page bodies, so extraction can be changed and re-run
+# without downloading every page again. Set PAGE_ARCHIVE to a directory and
+# every page fetched by pipeline.fetch_page is appended to it:
+#
+#   PAGE_ARCHIVE=page-archive python script-1-batch.py
+#   python script-reextract.py --archive page-archive --no-write
+#
+# Pages are stored as WARC-style response records in append-only segment
+# files, each record compressed on its own (zstd when the zstandard package
+# is installed, gzip otherwise) so any record can be read on its own. An
+# SQLite index (index.db) keeps the segment, offset and length of every
+# record; readers memory-map the segments and decompress records in place.
+#
+# The writer commits the index every ARCHIVE_COMMIT_RECORDS records or
+# ARCHIVE_COMMIT_SECONDS, and when it is closed (at exit for store()). A
+# crash loses the index entries of the last uncommitted records; their
+# bytes stay in the segment unreferenced and the pages are fetched again.
+
+ARCHIVE_DIR = os.getenv('PAGE_ARCHIVE')
+SEGMENT_BYTES = int(os.getenv('PAGE_ARCHIVE_SEGMENT_BYTES', 1024 * 1024 * 1024))
+COMMIT_RECORDS = int(os.getenv('ARCHIVE_COMMIT_RECORDS', 100))
+COMMIT_SECONDS = float(os.getenv('ARCHIVE_COMMIT_SECONDS', 5))
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CODECS = {'zstd': '.warc.zst', 'gzip': '.warc.gz'}
+
+
+def _compress(codec, data):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def _decompress(codec, data):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("Install the zstandard package to read .warc.zst segments")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+# One WARC-style response record holding the capped body of a page
+def _record(page, fetched_at):
+    headers = [
+        'WARC/1.1',
+        'WARC-Type: response',
+        f'WARC-Target-URI: {page.url}',
+        f"WARC-Date: {datetime.fromtimestamp(fetched_at, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')}",
+        f'Content-Type: {page.content_type}',
+        f'WARC-X-Encoding: {page.encoding or ""}',
+        f'Content-Length: {len(page.data)}',
+    ]
+    return '\r\n'.join(headers).encode('utf-8') + b'\r\n\r\n' + page.data + b'\r\n\r\n'
+
+
+def _parse_record(record):
+    head, _, rest = record.partition(b'\r\n\r\n')
+    headers = {}
+    for line in head.decode('utf-8').split('\r\n')[1:]:
+        name, _, value = line.partition(': ')
+        headers[name] = value
+    length = int(headers['Content-Length'])
+    return Page(headers['WARC-Target-URI'], headers['Content-Type'], headers['WARC-X-Encoding'] or None,
+                rest[:length])
+
+
+def _open_index(path):
+    os.makedirs(path, exist_ok=True)
+    db = sqlite3.connect(os.path.join(path, 'index.db'), timeout=60, check_same_thread=False)
+    db.executescript('''
+        CREATE TABLE IF NOT EXISTS records (
+            id INTEGER PRIMARY KEY,
+            url TEXT NOT NULL,
+            segment TEXT NOT NULL,
+            offset INTEGER NOT NULL,
+            length INTEGER NOT NULL,
+            codec TEXT NOT NULL,
+            content_type TEXT NOT NULL,
+            fetched_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS records_url ON records (url);
+    ''')
+    return db
+
+
+# Appends pages to the segments of one process. Segment names carry the pid,
+# so several scrapers can write to the same archive directory
+class ArchiveWriter:
+    def __init__(self, path, segment_bytes=SEGMENT_BYTES, commit_records=COMMIT_RECORDS,
+                 commit_seconds=COMMIT_SECONDS):
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.commit_records = commit_records
+        self.commit_seconds = commit_seconds
+        self.codec = 'zstd' if zstandard is not None else 'gzip'
+        self.db = _open_index(path)
+        self.lock = threading.Lock()
+        self.segment = None
+        self.file = None
+        self.sequence = 0
+        self.uncommitted = 0
+        self.last_commit = time.monotonic()
+
+    # Commit the index rows written since the last commit; the segment is
+    # flushed first, so no committed row points past the end of its segment
+    def _commit(self):
+        if not self.uncommitted:
+            return
+        self.file.flush()
+        with metrics.span('archive.commit'):
+            self.db.commit()
+        self.uncommitted = 0
+        self.last_commit = time.monotonic()
+
+    def _rotate(self):
+        if self.file is not None:
+            self._commit()
+            self.file.close()
+        self.sequence += 1
+        self.segment = (f"segment-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self.sequence:04d}"
+                        f"{CODECS[self.codec]}")
+        self.file = open(os.path.join(self.path, self.segment), 'ab')
+
+    def append(self, page):
+        fetched_at = time.time()
+        with metrics.span('archive.write'):
+            data = _compress(self.codec, _record(page, fetched_at))
+            with self.lock:
+                if self.file is None or self.file.tell() >= self.segment_bytes:
+                    self._rotate()
+                offset = self.file.tell()
+                self.file.write(data)
+                self.db.execute(
+                    'INSERT INTO records (url, segment, offset, length, codec, content_type, fetched_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (page.url, self.segment, offset, len(data), self.codec, page.content_type, fetched_at))
+                self.uncommitted += 1
+                if (self.uncommitted >= self.commit_records
+                        or time.monotonic() - self.last_commit >= self.commit_seconds):
+                    self._commit()
+        metrics.count('bytes_archived', len(data))
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self._commit()
+                self.file.close()
+                self.file = None
+            self.db.close()
+
+
+# Reads archived pages from memory-mapped segments
+class ArchiveReader:
+    def __init__(self, path):
+        self.path = path
+        self.db = _open_index(path)
+        self.maps = {}
+
+    # Map of a segment holding at least end bytes. A segment still being
+    # written grows after it is mapped, so it is mapped again when a record
+    # lies past the end of the current map
+    def _map(self, segment, end):
+        segment_map = self.maps.get(segment)
+        if segment_map is None or len(segment_map) < end:
+            with open(os.path.join(self.path, segment), 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                # mmap cannot map an empty file, and a short one has lost records
+                if size < end:
+                    raise ValueError(f"Segment {segment} has {size} bytes, the index expects {end}")
+                if segment_map is not None:
+                    segment_map.close()
+                segment_map = self.maps[segment] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return segment_map
+
+    def _read(self, segment, offset, length, codec):
+        with metrics.span('archive.read'):
+            return _parse_record(_decompress(codec, self._map(segment, offset + length)[offset:offset + length]))
+
+    # Latest archived page of a URL, or None
+    def get(self, url):
+        row = self.db.execute(
+            'SELECT segment, offset, length, codec FROM records WHERE url = ? ORDER BY id DESC LIMIT 1',
+            (url,)).fetchone()
+        return self._read(*row) if row else None
+
+    # Latest page of every URL, in segment order so the disk is read sequentially
+    def pages(self):
+        rows = self.db.execute(
+            '''SELECT segment, offset, length, codec FROM records
+               WHERE id IN (SELECT MAX(id) FROM records GROUP BY url)
+               ORDER BY segment, offset''').fetchall()
+        for row in rows:
+            yield self._read(*row)
+
+    def urls(self):
+        return [url for url, in self.db.execute('SELECT DISTINCT url FROM records')]
+
+    def close(self):
+        for segment_map in self.maps.values():
+            segment_map.close()
+        self.maps.clear()
+        self.db.close()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+# Archive a fetched page when PAGE_ARCHIVE is set (called by pipeline.fetch_page)
+def store(page):
+    global _writer
+    if not ARCHIVE_DIR:
+        return
+    try:
+        with _writer_lock:
+            if _writer is None:
+                _writer = ArchiveWriter(ARCHIVE_DIR)
+                # Commit the last records of the run
+                atexit.register(_writer.close)
+        _writer.append(page)
+    except Exception as e:
+        # A full disk should not stop the scrape itself
+        logging.warning(f"Could not archive {page.url}: {e}")
+        metrics.count_error('archive', e)
@@ -0,0 +1,225 @@
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+import argparse
+import json
+import re
+import sys
+import time
+from datetime import datetime
+
+import fakes
+import metrics
+import pipeline
+from main_content import MainContentParser
+from routing import DEFAULT_ROUTES, count_tokens
+
+# Benchmark of the text extractors of pipeline.extract_page on a saved
+# corpus: 'full' (all visible text, pipeline.PageParser) against 'main' (title
+# and article body, main_content.py). For each it reports the extraction
+# speed, the characters and tokens kept per page and the prompt tokens the
+# enrichment tasks would send per row. With --summaries it also summarizes
+# a sample of pages from both texts and scores the 'main' summaries against
+# the 'full' ones (the current output) with ROUGE-1 and ROUGE-L:
+#
+#   python benchmark-extraction.py --corpus corpus/
+#   python benchmark-extraction.py --corpus page-archive/ --summaries 20 --show
+#   python benchmark-extraction.py --check    # regression checks of the main extractor only
+#
+# Results are written as JSON to benchmark-results/ so runs can be compared.
+
+# Set your OpenAI API key
+OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+
+EXTRACTORS = {'full': pipeline.PageParser, 'main': MainContentParser}
+MAX_TEXT_LENGTH = 25000  # As in script-1-batch.py
+
+PROSE = ('The installation grows mycelium on discarded textiles, and visitors watch the material change, '
+         'week by week, as the fungus binds the fibres into a new surface. ') * 3
+
+
+def check_page(block):
+    return (f'<html><head><title>Mycelium textiles</title></head><body>'
+            f'<nav class="menu"><a href="/">Home</a> <a href="/news">News</a></nav>'
+            f'<article>{block}<p>{PROSE}</p><p>{PROSE}</p></article>'
+            f'<footer>Cookies and privacy policy</footer></body></html>').encode('utf-8')
+
+
+# Pages the main extractor has got wrong before: (name, page, texts that
+# must be kept, texts that must be dropped)
+CHECKS = [
+    ('lead class', check_page('<div class="lead-paragraph"><p>LEAD: a living wall of fungus.</p></div>'),
+     ['LEAD: a living wall of fungus.'], ['Cookies and privacy policy']),
+    ('head- class', check_page('<div class="head-intro"><p>INTRO: grown, not woven.</p></div>'),
+     ['INTRO: grown, not woven.'], ['Cookies and privacy policy']),
+    ('thread- class', check_page('<div class="thread-summary"><p>THREAD: the artist answers.</p></div>'),
+     ['THREAD: the artist answers.'], []),
+    ('comment class', check_page('<div class="comments"><p>COMMENT: great work, where can I buy it?</p></div>'),
+     [PROSE.strip()[:60]], ['COMMENT: great work']),
+    ('ad class', check_page('<div class="ad-slot"><p>AD: buy one get one free today only.</p></div>'),
+     [PROSE.strip()[:60]], ['AD: buy one get one free']),
+]
+
+
+# Extract every page with one parser; returns (texts, seconds)
+def extract_all(pages, parser_class, max_text_length):
+    texts = []
+    started = time.perf_counter()
+    for data in pages:
+        texts.append(pipeline.parse_html(data, None, max_text_length, parser_class).text())
+    return texts, time.perf_counter() - started
+
+
+# Run CHECKS against the main extractor; returns the failures
+def run_checks():
+    failures = []
+    for name, page, kept, dropped in CHECKS:
+        text = pipeline.parse_html(page, None, MAX_TEXT_LENGTH, MainContentParser).text()
+        failures += [f"{name}: lost {expected!r}" for expected in kept if expected not in text]
+        failures += [f"{name}: kept {unwanted!r}" for unwanted in dropped if unwanted in text]
+    return failures
+
+
+# Prompt tokens of one row: the text once in every task routed to a model
+def prompt_tokens(text):
+    return sum(count_tokens(pipeline.prompt(task, text), model)
+               for task, model in DEFAULT_ROUTES.items() if model not in ('local', 'skip'))
+
+
+def words(text):
+    return re.findall(r'\w+', text.lower())
+
+
+def f1(overlap, candidate_length, reference_length):
+    if not overlap:
+        return 0.0
+    precision, recall = overlap / candidate_length, overlap / reference_length
+    return 2 * precision * recall / (precision + recall)
+
+
+# ROUGE-1 F1: shared words, counted with their multiplicity
+def rouge_1(candidate, reference):
+    candidate, reference = words(candidate), words(reference)
+    counts = {}
+    for word in reference:
+        counts[word] = counts.get(word, 0) + 1
+    overlap = 0
+    for word in candidate:
+        if counts.get(word):
+            counts[word] -= 1
+            overlap += 1
+    return f1(overlap, len(candidate), len(reference))
+
+
+# ROUGE-L F1: longest common subsequence of words
+def rouge_l(candidate, reference):
+    candidate, reference = words(candidate), words(reference)
+    previous = [0] * (len(reference) + 1)
+    for word in candidate:
+        current = [0]
+        for index, other in enumerate(reference):
+            current.append(previous[index] + 1 if word == other else max(previous[index + 1], current[index]))
+        previous = current
+    return f1(previous[-1], len(candidate), len(reference))
+
+
+# Summarize the same pages from both texts and score 'main' against 'full'
+def compare_summaries(chat, full_texts, main_texts, sample, show):
+    scores = []
+    for index, (full, main) in enumerate(zip(full_texts[:sample], main_texts[:sample])):
+        if not full.strip() or not main.strip():
+            continue
+        reference = pipeline.ask(chat, pipeline.prompt('summary', full), pipeline.MAX_ANSWER_TOKENS['summary'], 0.5,
+                                 task='summary')
+        candidate = pipeline.ask(chat, pipeline.prompt('summary', main), pipeline.MAX_ANSWER_TOKENS['summary'], 0.5,
+                                 task='summary')
+        scores.append((rouge_1(candidate, reference), rouge_l(candidate, reference)))
+        if show:
+            print(f"\nPage {index}\n  full: {reference}\n  main: {candidate}")
+    if not scores:
+        return {'pages': 0}
+    return {
+        'pages': len(scores),
+        'rouge_1': round(sum(score[0] for score in scores) / len(scores), 3),
+        'rouge_l': round(sum(score[1] for score in scores) / len(scores), 3),
+    }
+
+
+def main():
+    # Command line options
+    parser = argparse.ArgumentParser(description='Compare the full-text and main-content extractors.')
+    parser.add_argument('--corpus', help='Directory of recorded HTML pages or a page archive (synthetic pages if missing)')
+    parser.add_argument('--size', type=int, default=200, help='Synthetic pages to generate when there is no corpus')
+    parser.add_argument('--max-text-length', type=int, default=MAX_TEXT_LENGTH, help='Characters kept per page')
+    parser.add_argument('--summaries', type=int, default=0,
+                        help='Summarize this many pages from both texts and compare the summaries (uses the API)')
+    parser.add_argument('--show', action='store_true', help='Print the summary pairs')
+    parser.add_argument('--output', help='Where to save the JSON results')
+    parser.add_argument('--check', action='store_true',
+                        help='Only run the regression checks of the main extractor (exit status 1 on a failure)')
+    parser.add_argument('--dry-run', action='store_true', help='Only start up and report how long it took')
+    args = parser.parse_args()
+
+    if args.dry_run:
+        metrics.report()
+        print(f"Dry run: cold start took {metrics.uptime():.2f}s; no pages were extracted.")
+        return
+
+    if args.check:
+        failures = run_checks()
+        for failure in failures:
+            print(f"Failed: {failure}")
+        print(f"{len(CHECKS) - len({failure.split(':')[0] for failure in failures})} of {len(CHECKS)} checks passed.")
+        sys.exit(1 if failures else 0)
+
+    pages = fakes.load_corpus(args.corpus, args.size)
+    print(f"{len(pages)} pages, {sum(map(len, pages)) / 1e6:.1f} MB")
+
+    texts, results = {}, {}
+    for name, parser_class in EXTRACTORS.items():
+        texts[name], seconds = extract_all(pages, parser_class, args.max_text_length)
+        chars = sum(map(len, texts[name]))
+        tokens = sum(count_tokens(text) for text in texts[name])
+        results[name] = {
+            'seconds': round(seconds, 3),
+            'pages_per_second': round(len(pages) / seconds, 1) if seconds else None,
+            'chars_per_page': round(chars / len(pages), 1),
+            'tokens_per_page': round(tokens / len(pages), 1),
+            'prompt_tokens_per_row': round(sum(map(prompt_tokens, texts[name])) / len(pages), 1),
+        }
+
+    full, main_ = results['full'], results['main']
+    for key in ('chars_per_page', 'tokens_per_page', 'prompt_tokens_per_row'):
+        main_[f'{key}_reduction'] = round(1 - main_[key] / full[key], 3) if full[key] else 0.0
+    main_['pages_changed'] = sum(a != b for a, b in zip(texts['full'], texts['main']))
+
+    for name, result in results.items():
+        print(f"{name:<5} {result['pages_per_second']:>8} pages/s  {result['chars_per_page']:>9} chars/page  "
+              f"{result['tokens_per_page']:>8} tokens/page  {result['prompt_tokens_per_row']:>8} prompt tokens/row")
+    print(f"main keeps {1 - main_['chars_per_page_reduction']:.0%} of the characters and sends "
+          f"{main_['prompt_tokens_per_row_reduction']:.0%} fewer prompt tokens; "
+          f"{main_['pages_changed']} of {len(pages)} pages differ")
+
+    if args.summaries:
+        import openai
+        openai.api_key = OPENAI_API_KEY
+        results['summaries'] = compare_summaries(openai.ChatCompletion.create, texts['full'], texts['main'],
+                                                 args.summaries, args.show)
+        summaries = results['summaries']
+        if summaries['pages']:
+            print(f"Summaries of {summaries['pages']} pages: ROUGE-1 {summaries['rouge_1']}, "
+                  f"ROUGE-L {summaries['rouge_l']} (main against full)")
+
+    config = {'corpus': args.corpus, 'pages': len(pages), 'max_text_length': args.max_text_length,
+              'summaries': args.summaries}
+    output = args.output or os.path.join('benchmark-results',
+                                         'extraction-' + datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({'timestamp': datetime.now().isoformat(), 'config': config, 'results': results}, f, indent=2)
+    print(f"Results saved to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+
+import fakes
+import hosts
+import metrics
+import pipeline
+from benchmark import ENRICH_BATCH_SIZE, SCRAPE_BATCH_SIZE, START_ROW, build_sheet
+from scrape_pool import EXTRACT_WORKERS, FETCH_WORKERS, ScrapeStage
+
+# Fault-injection harness: runs the scrape, double-check and enrichment
+# stages against the stand-ins of fakes.py while they inject the partial
+# failures of production nights (slow and hanging hosts, bodies cut off
+# mid-transfer, 5xx, OpenAI and Sheets 429s, chat timeouts), one scenario at
+# a time. For every scenario and stage it measures:
+#
+# - throughput (rows/s) and the slowdown against the clean baseline;
+# - requests per row to every upstream and the faults injected;
+# - errors and rate-limit errors as counted by the pipeline (metrics);
+# - completeness: the share of rows with a usable value after the stage
+#   (text in J after scraping and the double-check re-run, a summary in M
+#   after enrichment), and the rows lost with batches that failed whole.
+#
+#   python benchmark-faults.py                                # all scenarios, 200 rows
+#   python benchmark-faults.py --scenarios baseline,chat-rate-limits --rows 1000
+#   python benchmark-faults.py --compare benchmark-results/faults-old.json
+#
+# With --compare the run fails (exit status 1) when a scenario lost more
+# than --tolerance of its throughput or more than --completeness-tolerance
+# of its completeness against the earlier results, so regressions under
+# failure are caught before a release. Results are written as JSON to
+# benchmark-results/.
+
+CHAT_TIMEOUT = 2  # Seconds the harness's chat client waits for an answer
+HANG_SECONDS = 3  # Longer than CHAT_TIMEOUT and hosts.MIN_TIMEOUT, so hangs end in timeouts
+MIN_COMPARED_SECONDS = 0.5  # Throughput of quicker stages is too noisy to compare
+
+# Faults of every upstream per scenario, as fakes.Faults arguments
+SCENARIOS = {
+    'baseline': {},
+    'slow-hosts': {'web': {'latency': 0.02, 'jitter': 0.2}},
+    'hanging-hosts': {'web': {'hang_rate': 0.05}},
+    'truncated-bodies': {'web': {'truncate_rate': 0.1}},
+    'web-errors': {'web': {'error_rate': 0.1}},
+    'web-rate-limits': {'web': {'rate_limit_rate': 0.1}},
+    'chat-errors': {'chat': {'error_rate': 0.05}},
+    'chat-rate-limits': {'chat': {'rate_limit_rate': 0.1}},
+    'chat-timeouts': {'chat': {'hang_rate': 0.02}},
+    'sheets-rate-limits': {'sheets': {'rate_limit_rate': 0.05}},
+    'everything': {
+        'web': {'latency': 0.01, 'jitter': 0.05, 'error_rate': 0.03, 'rate_limit_rate': 0.03,
+                'truncate_rate': 0.03, 'hang_rate': 0.01},
+        'chat': {'error_rate': 0.01, 'rate_limit_rate': 0.03, 'hang_rate': 0.005},
+        'sheets': {'rate_limit_rate': 0.02},
+    },
+}
+
+# Column index of the value that tells whether a stage finished a row
+DONE_COLUMNS = {'scrape': 9, 'double-check': 9, 'enrich': 12}  # J, J, M
+FAILED_VALUES = ('', 'Error', 'No Summary')
+
+
+def faults(scenario, upstream, args):
+    options = {'latency': args.latency_ms / 1000, 'hang_seconds': HANG_SECONDS, 'seed': args.seed,
+               **SCENARIOS[scenario].get(upstream, {})}
+    return fakes.Faults(**options)
+
+
+# Share of the rows with a usable value in the column of a stage
+def completeness(service, stage, rows):
+    column = DONE_COLUMNS[stage]
+    done = 0
+    for cells in service.sheets['Sheet1'].values():
+        value = cells[column] if column < len(cells) else ''
+        done += value not in FAILED_VALUES
+    return round(done / rows, 4) if rows else 0.0
+
+
+# Run one stage over the whole sheet; a batch that fails whole (e.g. a
+# Sheets 429 on its read) is counted and its rows are lost, as in the scripts
+def run_stage(name, run_batch, service, rows, batch_size, servers):
+    calls_before = {'sheets': sum(service.calls.values())}
+    calls_before.update({key: sum(server.calls.values()) for key, server in servers.items()})
+    injected_before = {'sheets': sum(service.faults.injected.values())}
+    injected_before.update({key: sum(server.faults.injected.values()) for key, server in servers.items()})
+    metrics.reset()
+    failed_batches = lost_rows = processed = 0
+    total_rows = START_ROW + rows - 1
+
+    start = time.perf_counter()
+    for batch_start in range(START_ROW, total_rows + 1, batch_size):
+        batch_end = min(batch_start + batch_size - 1, total_rows)
+        try:
+            processed += run_batch(batch_start, batch_end)
+        except Exception as e:
+            failed_batches += 1
+            lost_rows += batch_end - batch_start + 1
+            metrics.count_error(f'{name}.batch', e)
+    elapsed = time.perf_counter() - start
+
+    counters = metrics.snapshot()['counters']
+    errors = {}
+    for counter in counters:
+        if counter['name'] == 'errors':
+            key = f"{counter['labels']['stage']}:{counter['labels']['error']}"
+            errors[key] = errors.get(key, 0) + counter['value']
+    requests_per_row = {'sheets': sum(service.calls.values()) - calls_before['sheets']}
+    for key, server in servers.items():
+        requests_per_row[key] = sum(server.calls.values()) - calls_before[key]
+    injected = {'sheets': sum(service.faults.injected.values()) - injected_before['sheets']}
+    for key, server in servers.items():
+        injected[key] = sum(server.faults.injected.values()) - injected_before[key]
+
+    return {
+        'rows': rows,
+        'rows_processed': processed,
+        'seconds': round(elapsed, 3),
+        'rows_per_second': round(rows / elapsed, 2) if elapsed else 0.0,
+        'requests_per_row': {key: round(count / rows, 3) for key, count in requests_per_row.items()},
+        'faults_injected': injected,
+        'errors': errors,
+        'rate_limited': sum(counter['value'] for counter in counters if counter['name'] == 'rate_limited'),
+        'failed_batches': failed_batches,
+        'lost_rows': lost_rows,
+        'completeness': completeness(service, name, rows),
+    }
+
+
+def run_scenario(scenario, args, pages):
+    # Every scenario starts without the host statistics and breakers of the one before
+    hosts.reset()
+    web_server = fakes.start_server(pages, faults=faults(scenario, 'web', args))
+    chat_server = fakes.start_server(faults=faults(scenario, 'chat', args))
+    chat = fakes.http_chat(chat_server.base_url, timeout=CHAT_TIMEOUT)
+    servers = {'web': web_server, 'chat': chat_server}
+    stage = ScrapeStage(args.fetch_workers, args.extract_workers)
+    try:
+        service = build_sheet(web_server, args.rows, 0)
+        service.faults = faults(scenario, 'sheets', args)
+        results = {}
+        if 'scrape' in args.stages:
+            results['scrape'] = run_stage(
+                'scrape', lambda start, end: pipeline.scrape_batch(service, 'benchmark', start, end, stage=stage),
+                service, args.rows, SCRAPE_BATCH_SIZE, servers)
+        if 'double-check' in args.stages:
+            # The re-run that recovers rows the scrape left with 'Error'
+            results['double-check'] = run_stage(
+                'double-check',
+                lambda start, end: pipeline.double_check_batch(service, 'benchmark', start, end, stage=stage),
+                service, args.rows, SCRAPE_BATCH_SIZE, servers)
+        if 'enrich' in args.stages:
+            results['enrich'] = run_stage(
+                'enrich',
+                lambda start, end: pipeline.enrich_batch(service, chat, 'benchmark', start, end, call_delay=0),
+                service, args.rows, ENRICH_BATCH_SIZE, servers)
+        return results
+    finally:
+        stage.close()
+        web_server.shutdown()
+        chat_server.shutdown()
+
+
+# Add the slowdown against the baseline scenario of the same run
+def add_slowdowns(results):
+    baseline = results.get('baseline', {})
+    for stages in results.values():
+        for stage_name, result in stages.items():
+            before = baseline.get(stage_name)
+            if before and before['rows_processed'] and result['rows_per_second']:
+                result['slowdown'] = round(before['rows_per_second'] / result['rows_per_second'], 2)
+
+
+def print_results(results):
+    print(f"{'scenario':<20} {'stage':<13} {'rows/s':>9} {'slowdown':>9} {'done':>5} {'complete':>9} {'errors':>7} "
+          f"{'429s':>5} {'lost':>5}  requests/row")
+    for scenario, stages in results.items():
+        for stage_name, result in stages.items():
+            requests = ', '.join(f'{key} {value}' for key, value in result['requests_per_row'].items() if value)
+            slowdown = f"{result['slowdown']:.2f}x" if 'slowdown' in result else '-'
+            print(f"{scenario:<20} {stage_name:<13} {result['rows_per_second']:>9.1f} {slowdown:>9} "
+                  f"{result['rows_processed']:>5} {result['completeness']:>9.1%} {sum(result['errors'].values()):>7g} "
+                  f"{result['rate_limited']:>5g} {result['lost_rows']:>5}  {requests}")
+
+
+# Regressions against earlier results: lists of messages, empty when none
+def regressions(previous_path, results, tolerance, completeness_tolerance):
+    with open(previous_path) as f:
+        previous = json.load(f)['results']
+    found = []
+    for scenario, stages in results.items():
+        for stage_name, result in stages.items():
+            before = previous.get(scenario, {}).get(stage_name)
+            if not before:
+                continue
+            compared = before['seconds'] >= MIN_COMPARED_SECONDS and before['rows_per_second']
+            if compared and result['rows_per_second'] < before['rows_per_second'] * (1 - tolerance):
+                found.append(f"{scenario} {stage_name}: {before['rows_per_second']:.1f} -> "
+                             f"{result['rows_per_second']:.1f} rows/s")
+            if result['completeness'] < before['completeness'] - completeness_tolerance:
+                found.append(f"{scenario} {stage_name}: completeness {before['completeness']:.1%} -> "
+                             f"{result['completeness']:.1%}")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the pipeline under injected upstream failures.')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f"Comma-separated scenarios (default: all of {', '.join(SCENARIOS)})")
+    parser.add_argument('--stages', default='scrape,double-check,enrich', help='Comma-separated stages to run')
+    parser.add_argument('--rows', type=int, default=200, help='Rows in the fake sheet')
+    parser.add_argument('--corpus', help='Directory of recorded HTML pages or a page archive (synthetic pages if missing)')
+    parser.add_argument('--latency-ms', type=float, default=0, help='Latency of every upstream call in all scenarios')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the fault draws, so runs are repeatable')
+    parser.add_argument('--fetch-workers', type=int, default=FETCH_WORKERS, help='Concurrent downloads')
+    parser.add_argument('--extract-workers', type=int, default=EXTRACT_WORKERS,
+                        help='Worker processes for parsing (0 parses in the download threads)')
+    parser.add_argument('--output', help='Where to save the JSON results')
+    parser.add_argument('--compare', help='Earlier JSON results; exit with status 1 on a regression')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Share of throughput a scenario may lose against --compare')
+    parser.add_argument('--completeness-tolerance', type=float, default=0.02,
+                        help='Completeness a scenario may lose against --compare')
+    parser.add_argument('--verbose', action='store_true', help='Show the pipeline logs')
+    args = parser.parse_args()
+    args.stages = args.stages.split(',')
+    scenarios = args.scenarios.split(',')
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL)
+    # Statistics of the stand-ins say nothing about real hosts
+    hosts.HOST_STATS_FILE = ''
+
+    pages = fakes.load_corpus(args.corpus)
+    results = {}
+    for scenario in scenarios:
+        print(f"Running {scenario}...")
+        results[scenario] = run_scenario(scenario, args, pages)
+    add_slowdowns(results)
+    print_results(results)
+
+    output = args.output or os.path.join('benchmark-results',
+                                         'faults-' + datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    config = {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'verbose')}
+    config['scenarios'] = {scenario: SCENARIOS[scenario] for scenario in scenarios}
+    with open(output, 'w') as f:
+        json.dump({'timestamp': datetime.now().isoformat(), 'config': config, 'results': results}, f, indent=2)
+    print(f"Results saved to {output}")
+
+    if args.compare:
+        found = regressions(args.compare, results, args.tolerance, args.completeness_tolerance)
+        for message in found:
+            print(f"Regression: {message}")
+        if found:
+            sys.exit(1)
+        print(f"No regressions against {args.compare}.")
+
+
+# Worker processes import this file again, so only run from the command line
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+import argparse
+import json
+import logging
+import os
+import time
+from datetime import datetime
+
+import fakes
+import hosts
+import metrics
+import pipeline
+import profiling
+from scrape_pool import EXTRACT_WORKERS, FETCH_WORKERS, ScrapeStage
+
+# End-to-end benchmark of the scrape, double-check and enrichment stages.
+# Every upstream is replaced by a local stand-in from fakes.py, so runs are
+# repeatable and cost nothing:
+#
+#   python benchmark.py --sizes 1000,10000 --latency-ms 20 --error-rate 0.05
+#   python benchmark.py --record urls.txt --corpus corpus/   # save real pages once
+#   python benchmark.py --corpus corpus/ --compare benchmark-results/old.json
+#   python benchmark.py --corpus page-archive/ --stages scrape  # pages of real runs
+#
+# Results are written as JSON to benchmark-results/ so runs can be compared.
+
+START_ROW = 2
+SCRAPE_BATCH_SIZE = 50
+ENRICH_BATCH_SIZE = 10
+
+
+# Nearest-rank percentiles of a list of durations, in milliseconds
+def percentiles(durations):
+    if not durations:
+        return {'p50': 0.0, 'p95': 0.0, 'p99': 0.0}
+    ordered = sorted(durations)
+    result = {}
+    for name, q in (('p50', 0.50), ('p95', 0.95), ('p99', 0.99)):
+        index = min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))
+        result[name] = round(ordered[index] * 1000, 3)
+    return result
+
+
+# Spans timed once per row, whose percentiles are reported per stage next to
+# the batch latencies: a slow tail of pages or chat calls is hidden in the
+# batch wall time, which only moves with the slowest row of each batch
+ROW_SPANS = ('download', 'parse', 'pdf', 'get_text', 'langdetect', 'country')
+ROW_SPAN_PREFIXES = ('openai.', 'local.')
+
+
+# p50/p95/p99 of the row-level spans of a metrics snapshot, in milliseconds
+def row_latencies(spans):
+    return {name: {'p50': span['p50_ms'], 'p95': span['p95_ms'], 'p99': span['p99_ms']}
+            for name, span in spans.items()
+            if name in ROW_SPANS or name.startswith(ROW_SPAN_PREFIXES)}
+
+
+# Build a fake sheet whose column B points every row at the corpus server
+def build_sheet(web_server, rows, sheets_latency):
+    sheet = {}
+    for row_number in range(START_ROW, START_ROW + rows):
+        sheet[row_number] = ['', f'{web_server.base_url}/page/{row_number}']
+    return fakes.FakeSheetsService({'Sheet1': sheet}, latency=sheets_latency)
+
+
+# Run one stage over the whole fake sheet, batch by batch, and collect its numbers
+def run_stage(name, run_batch, service, total_rows, batch_size, servers):
+    sheets_before = sum(service.calls.values())
+    calls_before = {key: sum(server.calls.values()) for key, server in servers.items()}
+    errors_before = {key: server.errors for key, server in servers.items()}
+    latencies = []
+    processed = 0
+    metrics.reset()
+
+    start = time.perf_counter()
+    for batch_start in range(START_ROW, total_rows + 1, batch_size):
+        batch_end = min(batch_start + batch_size - 1, total_rows)
+        batch_timer = time.perf_counter()
+        processed += run_batch(batch_start, batch_end)
+        latencies.append(time.perf_counter() - batch_timer)
+    elapsed = time.perf_counter() - start
+
+    rows = total_rows - START_ROW + 1
+    spans = metrics.snapshot()['spans']
+    api_calls = {'sheets': sum(service.calls.values()) - sheets_before}
+    # Requests answered with an injected error are counted once in
+    # server.calls, like any other request, and also in server.errors
+    injected_errors = {}
+    for key, server in servers.items():
+        api_calls[key] = sum(server.calls.values()) - calls_before[key]
+        injected_errors[key] = server.errors - errors_before[key]
+
+    result = {
+        'rows': rows,
+        'rows_processed': processed,
+        'seconds': round(elapsed, 3),
+        'rows_per_second': round(rows / elapsed, 2) if elapsed else 0.0,
+        'batch_latency_ms': percentiles(latencies),
+        'api_calls': api_calls,
+        'injected_errors': injected_errors,
+        'row_latency_ms': row_latencies(spans),
+        'spans': spans,
+    }
+    print(f"  {name:<13} {result['rows_per_second']:>10.1f} rows/s  "
+          f"p50 {result['batch_latency_ms']['p50']:.1f} ms  p99 {result['batch_latency_ms']['p99']:.1f} ms  "
+          f"calls {api_calls}")
+    for span_name, latency in result['row_latency_ms'].items():
+        print(f"    {span_name:<24} p50 {latency['p50']:.1f} ms  p95 {latency['p95']:.1f} ms  p99 {latency['p99']:.1f} ms")
+    return result
+
+
+def run_size(rows, args, pages):
+    web_server = fakes.start_server(pages, args.latency_ms / 1000, args.jitter_ms / 1000, args.error_rate)
+    chat_server = fakes.start_server(latency=args.chat_latency_ms / 1000, error_rate=args.chat_error_rate)
+    chat = fakes.http_chat(chat_server.base_url)
+    servers = {'web': web_server, 'chat': chat_server}
+    # Profiled runs extract in this process so the sampler can see the stacks
+    stage = None if args.profile else ScrapeStage(args.fetch_workers, args.extract_workers)
+    try:
+        service = build_sheet(web_server, rows, args.sheets_latency_ms / 1000)
+        total_rows = pipeline.get_total_rows(service, 'benchmark', 'Sheet1', START_ROW)
+
+        print(f"{rows} rows")
+        results = {}
+        if 'scrape' in args.stages:
+            results['scrape'] = run_stage(
+                'scrape',
+                lambda start, end: pipeline.scrape_batch(service, 'benchmark', start, end, stage=stage),
+                service, total_rows, SCRAPE_BATCH_SIZE, servers)
+        if 'double-check' in args.stages:
+            results['double-check'] = run_stage(
+                'double-check',
+                lambda start, end: pipeline.double_check_batch(service, 'benchmark', start, end, stage=stage),
+                service, total_rows, SCRAPE_BATCH_SIZE, servers)
+        if 'enrich' in args.stages:
+            results['enrich'] = run_stage(
+                'enrich',
+                lambda start, end: pipeline.enrich_batch(service, chat, 'benchmark', start, end, call_delay=0),
+                service, total_rows, ENRICH_BATCH_SIZE, servers)
+        return results
+    finally:
+        if stage is not None:
+            stage.close()
+        web_server.shutdown()
+        chat_server.shutdown()
+
+
+# Print the rows/s ratio against an earlier run for every matching size and stage
+def compare(previous_path, results):
+    with open(previous_path) as f:
+        previous = json.load(f)['results']
+    print(f"Compared with {previous_path}:")
+    for size, stages in results.items():
+        for stage, result in stages.items():
+            before = previous.get(size, {}).get(stage)
+            if not before or not before['rows_per_second']:
+                continue
+            ratio = result['rows_per_second'] / before['rows_per_second']
+            print(f"  {size:>7} {stage:<13} {before['rows_per_second']:>10.1f} -> {result['rows_per_second']:>10.1f} rows/s ({ratio:.2f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline stages against local stand-ins.')
+    parser.add_argument('--sizes', default='1000,10000,100000', help='Comma-separated row counts')
+    parser.add_argument('--stages', default='scrape,double-check,enrich', help='Comma-separated stages to run')
+    parser.add_argument('--corpus', help='Directory of recorded HTML pages or a page archive (synthetic pages if missing)')
+    parser.add_argument('--record', help='File with one URL per line to save into --corpus, then exit')
+    parser.add_argument('--latency-ms', type=float, default=0, help='Web server latency per page')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='Extra random web latency per page')
+    parser.add_argument('--error-rate', type=float, default=0, help='Share of pages answered with HTTP 500')
+    parser.add_argument('--chat-latency-ms', type=float, default=0, help='Chat endpoint latency per call')
+    parser.add_argument('--chat-error-rate', type=float, default=0, help='Share of chat calls answered with HTTP 500')
+    parser.add_argument('--sheets-latency-ms', type=float, default=0, help='Sheets API latency per call')
+    parser.add_argument('--fetch-workers', type=int, default=FETCH_WORKERS, help='Concurrent downloads')
+    parser.add_argument('--extract-workers', type=int, default=EXTRACT_WORKERS,
+                        help='Worker processes for parsing (0 parses in the download threads)')
+    parser.add_argument('--output', help='Where to save the JSON results')
+    parser.add_argument('--compare', help='Earlier JSON results to compare against')
+    parser.add_argument('--profile', metavar='FILE', help='Write collapsed stacks of the extraction hot path to FILE')
+    parser.add_argument('--verbose', action='store_true', help='Show the pipeline logs')
+    args = parser.parse_args()
+    args.stages = args.stages.split(',')
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL)
+    # Timings of the local stand-in say nothing about real hosts
+    hosts.HOST_STATS_FILE = ''
+
+    if args.record:
+        with open(args.record) as f:
+            urls = [line.strip() for line in f if line.strip()]
+        fakes.record_corpus(urls, args.corpus or 'corpus')
+        return
+
+    pages = fakes.load_corpus(args.corpus)
+    if args.profile:
+        profiling.start()
+    results = {}
+    for size in args.sizes.split(','):
+        results[size] = run_size(int(size), args, pages)
+    if args.profile:
+        profiling.stop(args.profile)
+
+    output = args.output or os.path.join('benchmark-results', datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    config = {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'record', 'profile')}
+    with open(output, 'w') as f:
+        json.dump({'timestamp': datetime.now().isoformat(), 'config': config, 'results': results}, f, indent=2)
+    print(f"Results saved to {output}")
+
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+import json
+import os
+from collections import namedtuple
+
+# Collections: topic sheets run through the same pipeline, e.g. BioArt next
+# to biomaterials (see script-collections.py). They are declared in
+# COLLECTIONS_FILE:
+#
+#   {"collections": [
+#       {"name": "bioart", "sheet": "Sheet1"},
+#       {"name": "biomaterials", "spreadsheet_id": "1XyZ...", "sheet": "Sheet1", "start_row": 2}
+#   ]}
+#
+# Every collection is read from and written to its own sheet (spreadsheet_id
+# defaults to SPREADSHEET_ID, sheet to 'Sheet1', start_row to 2) and has its
+# own enrichment results log. Without the file there is one collection,
+# 'default': the sheet the scripts have always used.
+
+COLLECTIONS_FILE = os.getenv('COLLECTIONS_FILE', 'collections.json')
+
+Collection = namedtuple('Collection', 'name spreadsheet_id sheet start_row results_log')
+
+
+def _collection(entry, spreadsheet_id):
+    name = entry['name']
+    return Collection(
+        name=name,
+        spreadsheet_id=entry.get('spreadsheet_id') or spreadsheet_id,
+        sheet=entry.get('sheet', 'Sheet1'),
+        start_row=int(entry.get('start_row', 2)),
+        results_log=entry.get('results_log', f'enrich-results-{name}.jsonl'),
+    )
+
+
+# Collections of COLLECTIONS_FILE; spreadsheet_id is used for those that do
+# not name their own spreadsheet
+def load_collections(path=COLLECTIONS_FILE, spreadsheet_id=None):
+    spreadsheet_id = spreadsheet_id or os.getenv('SPREADSHEET_ID')
+    try:
+        with open(path) as f:
+            entries = json.load(f)['collections']
+    except FileNotFoundError:
+        entries = [{'name': 'default', 'results_log': 'enrich-results.jsonl'}]
+
+    collections = [_collection(entry, spreadsheet_id) for entry in entries]
+    names, targets = set(), set()
+    for collection in collections:
+        target = (collection.spreadsheet_id, collection.sheet)
+        if collection.name in names:
+            raise ValueError(f"Collection {collection.name!r} is declared twice in {path}")
+        if target in targets:
+            raise ValueError(f"Collection {collection.name!r} writes to the same sheet as another collection")
+        if not collection.spreadsheet_id:
+            raise ValueError(f"Collection {collection.name!r} has no spreadsheet_id and SPREADSHEET_ID is not set")
+        names.add(collection.name)
+        targets.add(target)
+    return collections
@@ -0,0 +1,168 @@
+import json
+import os
+import re
+import zlib
+
+import numpy as np
+
+import metrics
+
+# Embedding index over the summaries (column M) or texts (column J) for
+# related-project search and theme clustering (see script-embed.py).
+#
+# The model is pluggable through EMBED_MODEL:
+#   hashing                          hashed word and bigram counts, no extra
+#                                    dependencies (default)
+#   sentence-transformers:<name>     any sentence-transformers model, e.g.
+#                                    sentence-transformers:all-MiniLM-L6-v2
+#
+# Vectors are L2-normalised float32 rows of a memory-mapped file, so a dot
+# product is the cosine similarity and 100k x 512 vectors take 200 MB of
+# page cache instead of process memory.
+
+EMBED_MODEL = os.getenv('EMBED_MODEL', 'hashing')
+EMBED_INDEX = os.getenv('EMBED_INDEX', 'embeddings')
+HASHING_DIM = 512
+CHUNK_ROWS = 65536  # Vectors scored per matrix product, bounds temporary memory
+
+WORD = re.compile(r'\w+')
+
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return (vectors / norms).astype(np.float32)
+
+
+# Feature hashing of words and word pairs with sublinear term frequency.
+# crc32 is used instead of hash() so vectors are the same in every process
+class HashingEmbedder:
+    name = 'hashing'
+
+    def __init__(self, dim=HASHING_DIM):
+        self.dim = dim
+
+    def encode(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for index, text in enumerate(texts):
+            words = WORD.findall(text.lower())
+            features = words + [f'{a} {b}' for a, b in zip(words, words[1:])]
+            counts = {}
+            for feature in features:
+                code = zlib.crc32(feature.encode('utf-8'))
+                slot = code % self.dim
+                sign = 1.0 if code & 0x80000000 else -1.0
+                counts[slot] = counts.get(slot, 0.0) + sign
+            for slot, value in counts.items():
+                vectors[index, slot] = np.sign(value) * np.log1p(abs(value))
+        return normalize(vectors)
+
+
+class SentenceTransformerEmbedder:
+    def __init__(self, model_name):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise RuntimeError('Install sentence-transformers to use EMBED_MODEL=sentence-transformers:<name>')
+        self.name = f'sentence-transformers:{model_name}'
+        self.model = SentenceTransformer(model_name)
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts):
+        return normalize(np.asarray(self.model.encode(list(texts), batch_size=64), dtype=np.float32))
+
+
+def get_embedder(name=None):
+    name = name or EMBED_MODEL
+    if name == 'hashing':
+        return HashingEmbedder()
+    if name.startswith('sentence-transformers:'):
+        return SentenceTransformerEmbedder(name.split(':', 1)[1])
+    raise ValueError(f"Unknown embedding model {name!r}")
+
+
+# Write the vectors of the given rows as a new index (replacing an old one)
+def write_index(path, model_name, row_numbers, vectors):
+    os.makedirs(path, exist_ok=True)
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    tmp_vectors = os.path.join(path, 'vectors.f32.tmp')
+    vectors.tofile(tmp_vectors)
+    np.save(os.path.join(path, 'rows.npy'), np.asarray(row_numbers, dtype=np.int64))
+    os.replace(tmp_vectors, os.path.join(path, 'vectors.f32'))
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump({'model': model_name, 'dim': vectors.shape[1], 'count': vectors.shape[0]}, f)
+
+
+class EmbeddingIndex:
+    def __init__(self, path=EMBED_INDEX):
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.rows = np.load(os.path.join(path, 'rows.npy'))
+        self.vectors = np.memmap(os.path.join(path, 'vectors.f32'), dtype=np.float32, mode='r',
+                                 shape=(self.meta['count'], self.meta['dim']))
+        self.position = {int(row): index for index, row in enumerate(self.rows)}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def vector(self, row_number):
+        return np.asarray(self.vectors[self.position[row_number]])
+
+    # Top-k rows for each query vector: (row numbers, scores), both shaped
+    # (queries, k) and sorted by decreasing cosine similarity
+    def search(self, queries, k=10):
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        k = min(k, len(self))
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_index = np.zeros((len(queries), 0), dtype=np.int64)
+        with metrics.span('embeddings.search'):
+            for start in range(0, len(self), CHUNK_ROWS):
+                scores = queries @ self.vectors[start:start + CHUNK_ROWS].T
+                top = np.argpartition(-scores, min(k, scores.shape[1]) - 1, axis=1)[:, :k]
+                best_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+                best_index = np.concatenate([best_index, top + start], axis=1)
+                keep = np.argpartition(-best_scores, min(k, best_scores.shape[1]) - 1, axis=1)[:, :k]
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                best_index = np.take_along_axis(best_index, keep, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_index = np.take_along_axis(best_index, order, axis=1)
+        return self.rows[best_index], best_scores
+
+
+# Spherical k-means (cosine distance): k-means++ seeding and Lloyd
+# iterations on a sample of the vectors, then one pass assigning every
+# vector to its nearest centroid. Returns (labels per vector, centroids)
+def kmeans(vectors, k, iterations=20, sample_size=20000, seed=0):
+    rng = np.random.default_rng(seed)
+    count = len(vectors)
+    sample = np.asarray(vectors[np.sort(rng.choice(count, min(sample_size, count), replace=False))])
+
+    with metrics.span('embeddings.kmeans'):
+        # k-means++ seeding: spread the first centroids over the sample
+        centroids = [sample[rng.integers(len(sample))]]
+        closest = 1 - sample @ centroids[0]
+        for _ in range(1, k):
+            weights = np.clip(closest, 0, None) ** 2
+            total = weights.sum()
+            pick = rng.choice(len(sample), p=weights / total) if total > 0 else rng.integers(len(sample))
+            centroids.append(sample[pick])
+            closest = np.minimum(closest, 1 - sample @ sample[pick])
+        centroids = np.array(centroids, dtype=np.float32)
+
+        one_hot = np.eye(k, dtype=np.float32)
+        for _ in range(iterations):
+            sample_labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = one_hot[sample_labels].T @ sample
+            # Empty clusters keep their old centroid
+            sizes = np.bincount(sample_labels, minlength=k)
+            moved = normalize(np.where(sizes[:, None] > 0, sums, centroids))
+            if np.allclose(moved, centroids, atol=1e-5):
+                break
+            centroids = moved
+
+        labels = np.empty(count, dtype=np.int32)
+        for start in range(0, count, CHUNK_ROWS):
+            labels[start:start + CHUNK_ROWS] = np.argmax(np.asarray(vectors[start:start + CHUNK_ROWS]) @ centroids.T,
+                                                         axis=1)
+    return labels, centroids
@@ -0,0 +1,424 @@
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import requests
+
+# Local stand-ins for the services the pipeline talks to: an in-memory
+# Google Sheets values API, an HTTP server replaying a recorded HTML corpus
+# and a chat-completions endpoint. Used by benchmark.py and
+# benchmark-faults.py.
+#
+# Every stand-in can inject the partial failures of production (see
+# Faults): latency, server errors, 429 rate-limit answers, bodies cut off
+# mid-transfer and requests that hang half-way.
+
+
+# Faults injected into the requests of one stand-in; the rates are the
+# share of requests that get each fault, drawn independently per request
+class Faults:
+    KINDS = ('error', 'rate_limit', 'truncate', 'hang')
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit_rate=0.0, truncate_rate=0.0,
+                 hang_rate=0.0, hang_seconds=5.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.rates = dict(zip(self.KINDS, (error_rate, rate_limit_rate, truncate_rate, hang_rate)))
+        self.hang_seconds = hang_seconds
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.injected = Counter()
+
+    # Sleep the latency of one request and pick its fault (None for a clean answer)
+    def draw(self):
+        with self.lock:
+            delay = self.latency + self.random.random() * self.jitter
+            roll = self.random.random()
+        if delay:
+            time.sleep(delay)
+        for kind in self.KINDS:
+            if roll < self.rates[kind]:
+                with self.lock:
+                    self.injected[kind] += 1
+                return kind
+            roll -= self.rates[kind]
+        return None
+
+
+# Stand-in for googleapiclient.errors.HttpError, with the status where
+# metrics.is_rate_limited looks for it
+class HttpError(Exception):
+    def __init__(self, status, reason):
+        super().__init__(f'<HttpError {status} "{reason}">')
+        self.resp = SimpleNamespace(status=status)
+
+
+# Convert a column letter (A, B, ..., AA) to a zero-based index
+def column_index(letters):
+    index = 0
+    for letter in letters.upper():
+        index = index * 26 + (ord(letter) - ord('A') + 1)
+    return index - 1
+
+
+# Split an A1 range such as 'Sheet1!H2:J51' or 'Sheet1!A2:Z' into its parts
+def parse_range(a1_range):
+    sheet_name, _, cells = a1_range.rpartition('!')
+    start, _, end = cells.partition(':')
+    start_match = re.fullmatch(r'([A-Z]+)(\d*)', start)
+    end_match = re.fullmatch(r'([A-Z]+)(\d*)', end or start)
+    first_col = column_index(start_match.group(1))
+    first_row = int(start_match.group(2) or 1)
+    last_col = column_index(end_match.group(1))
+    last_row = int(end_match.group(2)) if end_match.group(2) else None
+    if not end:
+        last_row = first_row
+    return sheet_name or 'Sheet1', first_col, first_row, last_col, last_row
+
+
+# Request object returned by every fake API method, mirroring googleapiclient
+class FakeRequest:
+    def __init__(self, fn):
+        self.fn = fn
+
+    def execute(self):
+        return self.fn()
+
+
+class FakeValues:
+    def __init__(self, service):
+        self.service = service
+
+    def get(self, spreadsheetId, range):
+        return self.service.request('values.get', lambda: self.service.read(range))
+
+    def batchGet(self, spreadsheetId, ranges):
+        return self.service.request('values.batchGet',
+                                    lambda: {'valueRanges': [self.service.read(item) for item in ranges]})
+
+    def update(self, spreadsheetId, range, valueInputOption, body):
+        return self.service.request('values.update', lambda: self.service.write(range, body.get('values', [])))
+
+    def batchUpdate(self, spreadsheetId, body):
+        def run():
+            for item in body.get('data', []):
+                self.service.write(item['range'], item['values'])
+            return {'totalUpdatedRows': len(body.get('data', []))}
+        return self.service.request('values.batchUpdate', run)
+
+    def clear(self, spreadsheetId, range, body):
+        return self.service.request('values.clear', lambda: self.service.clear(range))
+
+    def append(self, spreadsheetId, range, valueInputOption, body, insertDataOption='OVERWRITE'):
+        return self.service.request('values.append', lambda: self.service.append(range, body.get('values', [])))
+
+
+class FakeSpreadsheets:
+    def __init__(self, service):
+        self.service = service
+
+    def get(self, spreadsheetId):
+        return self.service.request('spreadsheets.get', self.service.metadata)
+
+    def values(self):
+        return FakeValues(self.service)
+
+
+# In-memory replacement for build('sheets', 'v4', ...) with call counters.
+# With faults, calls fail with a 500 or 429 HttpError, or hang (truncated
+# answers do not apply to the client library and are not injected)
+class FakeSheetsService:
+    def __init__(self, sheets=None, latency=0.0, faults=None):
+        # {sheet_name: {row_number: [cell values]}}
+        self.sheets = sheets or {'Sheet1': {}}
+        self.latency = latency
+        self.faults = faults
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    def spreadsheets(self):
+        return FakeSpreadsheets(self)
+
+    def request(self, method, fn):
+        def run():
+            with self.lock:
+                self.calls[method] += 1
+            if self.latency:
+                time.sleep(self.latency)
+            fault = self.faults.draw() if self.faults is not None else None
+            if fault == 'error':
+                raise HttpError(500, 'Internal error encountered.')
+            if fault == 'rate_limit':
+                raise HttpError(429, 'Quota exceeded for quota metric \'Read requests\'')
+            if fault == 'hang':
+                time.sleep(self.faults.hang_seconds)
+            with self.lock:
+                return fn()
+        return FakeRequest(run)
+
+    def metadata(self):
+        return {'sheets': [
+            {'properties': {'title': name, 'gridProperties': {'rowCount': max(rows, default=1)}}}
+            for name, rows in self.sheets.items()
+        ]}
+
+    def read(self, a1_range):
+        sheet_name, first_col, first_row, last_col, last_row = parse_range(a1_range)
+        rows = self.sheets.get(sheet_name, {})
+        if last_row is None:
+            last_row = max(rows, default=first_row)
+        values = []
+        for row_number in range(first_row, last_row + 1):
+            cells = rows.get(row_number, [])[first_col:last_col + 1]
+            # Sheets trims trailing empty cells and rows
+            while cells and cells[-1] == '':
+                cells.pop()
+            values.append(cells)
+        while values and not values[-1]:
+            values.pop()
+        return {'range': a1_range, 'values': values}
+
+    def write(self, a1_range, values):
+        sheet_name, first_col, first_row, _, _ = parse_range(a1_range)
+        rows = self.sheets.setdefault(sheet_name, {})
+        for offset, row_values in enumerate(values):
+            cells = rows.setdefault(first_row + offset, [])
+            needed = first_col + len(row_values)
+            if len(cells) < needed:
+                cells.extend([''] * (needed - len(cells)))
+            cells[first_col:needed] = [str(value) for value in row_values]
+        return {'updatedRange': a1_range, 'updatedRows': len(values)}
+
+    def clear(self, a1_range):
+        sheet_name, first_col, first_row, last_col, last_row = parse_range(a1_range)
+        rows = self.sheets.get(sheet_name, {})
+        for row_number in list(rows):
+            if row_number >= first_row and (last_row is None or row_number <= last_row):
+                cells = rows[row_number]
+                for col in range(first_col, min(last_col + 1, len(cells))):
+                    cells[col] = ''
+        return {'clearedRange': a1_range}
+
+    # Write values below the last row of the sheet, like values.append
+    def append(self, a1_range, values):
+        sheet_name, _, first_row, _, _ = parse_range(a1_range)
+        rows = self.sheets.setdefault(sheet_name, {})
+        start = max([first_row - 1] + [number for number, cells in rows.items() if any(cells)]) + 1
+        first_letters, last_letters = re.findall(r'([A-Z]+)\d*', a1_range.rpartition('!')[2])
+        updated_range = f'{sheet_name}!{first_letters}{start}:{last_letters}{start + len(values) - 1}'
+        return {'updates': self.write(updated_range, values)}
+
+
+# Words used to build synthetic pages when no recorded corpus is available
+WORDS = ('bioart biodesign mycelium bacteria living material installation artist laboratory '
+         'synthetic biology tissue culture fermentation exhibition biofabrication cells growth '
+         'sustainable design architecture algae textile dye microbial sculpture research').split()
+
+
+# Build a synthetic HTML page with navigation, article body and footer
+def synthetic_page(seed, paragraphs=20):
+    rng = random.Random(seed)
+    body = '\n'.join(
+        '<p>' + ' '.join(rng.choice(WORDS) for _ in range(rng.randint(40, 120))) + '.</p>'
+        for _ in range(rng.randint(1, paragraphs))
+    )
+    country = rng.choice(['', '<meta name="geo.country" content="Brazil">', '<meta name="country" content="Germany">'])
+    return (f'<html><head><title>Page {seed}</title>{country}</head><body>'
+            f'<nav><a href="/">Home</a> <a href="/about">About</a></nav>'
+            f'<article><h1>Project {seed}</h1>{body}</article>'
+            f'<footer>Cookies and privacy policy</footer></body></html>').encode('utf-8')
+
+
+# Load every file of a recorded corpus directory or page archive, or generate
+# pages if there is none
+def load_corpus(corpus_dir=None, size=200):
+    # A page archive (see archive.py) replays the web pages saved by real runs
+    if corpus_dir and os.path.exists(os.path.join(corpus_dir, 'index.db')):
+        from archive import ArchiveReader
+        from pipeline import PDF_TYPES
+
+        reader = ArchiveReader(corpus_dir)
+        pages = [page.data for page in reader.pages() if page.content_type not in PDF_TYPES]
+        reader.close()
+        if pages:
+            return pages
+    if corpus_dir and os.path.isdir(corpus_dir):
+        pages = []
+        for name in sorted(os.listdir(corpus_dir)):
+            with open(os.path.join(corpus_dir, name), 'rb') as f:
+                pages.append(f.read())
+        if pages:
+            return pages
+    return [synthetic_page(seed) for seed in range(size)]
+
+
+# Save the pages behind a list of URLs so they can be replayed later
+def record_corpus(urls, corpus_dir, timeout=10):
+    from pipeline import HEADERS, normalize_url
+
+    os.makedirs(corpus_dir, exist_ok=True)
+    for index, url in enumerate(urls):
+        try:
+            response = requests.get(normalize_url(url), headers=HEADERS, timeout=timeout)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            print(f"Skipping {url}: {e}")
+            continue
+        with open(os.path.join(corpus_dir, f'{index:06d}.html'), 'wb') as f:
+            f.write(response.content)
+
+
+# Canned chat replies keyed on the end of each prompt used in pipeline.enrich_row
+def fake_completion(prompt):
+    if prompt.endswith('Language:'):
+        return 'en'
+    if prompt.endswith('Country:'):
+        return 'Unknown'
+    if prompt.endswith('Summary:'):
+        return 'A project combining living organisms with art and design.'
+    if prompt.endswith('Categories and Justifications:'):
+        return 'Category: Bioart\nJustification: Uses living material.\nCategory: Biodesign\nJustification: Designed objects.'
+    return 'bioart, biodesign, mycelium'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Keep the default HTTP server from printing every request
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Send a body with one of the injected faults; returns False for a clean answer
+    def send_fault(self, fault, body, content_type, error_body):
+        if fault == 'error':
+            self.send_body(500, error_body, content_type)
+        elif fault == 'rate_limit':
+            self.send_body(429, error_body, content_type, {'Retry-After': '1'})
+        elif fault in ('truncate', 'hang'):
+            # Announce the whole body, send half of it, then close the
+            # connection ('truncate') or stall before the rest ('hang')
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            if fault == 'truncate':
+                self.close_connection = True
+                return True
+            time.sleep(self.server.faults.hang_seconds)
+            try:
+                self.wfile.write(body[len(body) // 2:])
+            except OSError:
+                # The client gave up waiting
+                self.close_connection = True
+        else:
+            return False
+        return True
+
+    def do_GET(self):
+        server = self.server
+        server.count('GET ' + self.path.split('/')[1])
+        match = re.fullmatch(r'/page/(\d+)', self.path)
+        if not match:
+            self.send_body(404, b'Not found', 'text/plain')
+            return
+        fault = server.faults.draw()
+        page = server.pages[int(match.group(1)) % len(server.pages)]
+        if fault is not None:
+            server.count_error()
+        if not self.send_fault(fault, page, 'text/html; charset=utf-8', b'<html>Server error</html>'):
+            self.send_body(200, page, 'text/html; charset=utf-8')
+
+    def do_POST(self):
+        server = self.server
+        server.count('POST ' + self.path)
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if self.path != '/v1/chat/completions':
+            self.send_body(404, b'{}', 'application/json')
+            return
+        fault = server.faults.draw()
+        if fault in ('error', 'rate_limit'):
+            server.count_error()
+            message = 'Rate limit reached for requests' if fault == 'rate_limit' else 'injected error'
+            self.send_fault(fault, b'', 'application/json',
+                            json.dumps({'error': {'message': message}}).encode('utf-8'))
+            return
+        prompt = payload['messages'][-1]['content']
+        content = fake_completion(prompt)
+        reply = {
+            'choices': [{'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': {
+                'prompt_tokens': len(prompt) // 4,
+                'completion_tokens': len(content) // 4,
+                'total_tokens': (len(prompt) + len(content)) // 4,
+            },
+            'model': payload.get('model', ''),
+        }
+        body = json.dumps(reply).encode('utf-8')
+        if fault is not None:
+            server.count_error()
+        if not self.send_fault(fault, body, 'application/json', b''):
+            self.send_body(200, body, 'application/json')
+
+
+# calls counts every request once by method and path; errors counts the
+# requests answered with an injected fault, which are in calls as well
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, pages=None, latency=0.0, jitter=0.0, error_rate=0.0, faults=None):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.pages = pages or [b'<html></html>']
+        self.faults = faults or Faults(latency, jitter, error_rate)
+        self.calls = Counter()
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def count(self, key):
+        with self.lock:
+            self.calls[key] += 1
+
+    def count_error(self):
+        with self.lock:
+            self.errors += 1
+
+
+# Start a stub server in a background thread; call .shutdown() when done
+def start_server(pages=None, latency=0.0, jitter=0.0, error_rate=0.0, faults=None):
+    server = StubServer(pages, latency, jitter, error_rate, faults)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# Chat client with the same call signature as openai.ChatCompletion.create
+def http_chat(base_url, timeout=30):
+    session = requests.Session()
+
+    def create(model, messages, max_tokens, temperature, **kwargs):
+        response = session.post(
+            f'{base_url}/v1/chat/completions',
+            json={'model': model, 'messages': messages, 'max_tokens': max_tokens, 'temperature': temperature},
+            timeout=timeout,
+        )
+        response.raise_for_status()
+        return response.json()
+
+    return create
@@ -0,0 +1,265 @@
+import logging
+import os
+import sqlite3
+import time
+import zlib
+from collections import namedtuple
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+from xml.etree.ElementTree import ParseError, XMLPullParser
+
+import hosts
+import metrics
+from fingerprints import STATE_DB
+from pipeline import CHUNK_SIZE, HEADERS, PageParser, detect_language
+
+# Feed harvesting: RSS 2.0, Atom and sitemap (including sitemap index and
+# .xml.gz) sources listed in FEEDS_FILE, one URL per line, '#' for comments.
+# Feeds are requested with If-None-Match / If-Modified-Since from the last
+# successful harvest, so an unchanged feed costs one 304. Bodies are parsed
+# with a pull parser as the chunks arrive and every finished <item>, <entry>
+# or <url> element is dropped right away, so a 50 MB sitemap never sits in
+# memory as a tree (see script-harvest-feeds.py).
+
+FEEDS_FILE = os.getenv('FEEDS_FILE', 'feeds.txt')
+FEED_TIMEOUT = 30  # seconds
+MAX_FEED_BYTES = int(os.getenv('MAX_FEED_BYTES', 100 * 1024 * 1024))  # Decompressed sitemaps may be large
+MAX_SITEMAP_DEPTH = 2  # Sitemap index -> sitemap -> urls
+MAX_DESCRIPTION_LENGTH = 25000
+
+# One link found in a feed; date is 'YYYY-MM-DD' or ''
+Item = namedtuple('Item', 'url date title description')
+
+# Elements holding one link: RSS <item>, Atom <entry>, sitemap <url>
+ITEM_TAGS = {'item', 'entry', 'url'}
+
+
+def read_feed_list(path=FEEDS_FILE):
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+
+
+# URL form used to recognise the same link: no www., fragment, tracking
+# parameters or trailing slash, lower-case scheme and host
+def canonical_url(url):
+    parsed = urlparse(url.strip())
+    host = (parsed.hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    if parsed.port:
+        host = f'{host}:{parsed.port}'
+    query = urlencode([(key, value) for key, value in parse_qsl(parsed.query, keep_blank_values=True)
+                       if not key.lower().startswith('utm_') and key.lower() not in ('fbclid', 'gclid')])
+    scheme = 'https' if parsed.scheme.lower() in ('http', 'https', '') else parsed.scheme.lower()
+    return urlunparse((scheme, host, parsed.path.rstrip('/'), '', query, ''))
+
+
+# 'YYYY-MM-DD' of an RFC 822 (RSS) or ISO 8601 (Atom, sitemaps) date
+def parse_date(text):
+    text = (text or '').strip()
+    if not text:
+        return ''
+    try:
+        return datetime.fromisoformat(text.replace('Z', '+00:00')).strftime('%Y-%m-%d')
+    except ValueError:
+        pass
+    try:
+        return parsedate_to_datetime(text).strftime('%Y-%m-%d')
+    except (TypeError, ValueError):
+        return ''
+
+
+# Visible text of an HTML description
+def html_text(html):
+    parser = PageParser(MAX_DESCRIPTION_LENGTH)
+    parser.feed(html)
+    parser.close()
+    return parser.text()
+
+
+def _name(element):
+    return element.tag.rsplit('}', 1)[-1]
+
+
+def _child_text(element, *names):
+    for name in names:
+        for child in element:
+            if _name(child) == name and (child.text or '').strip():
+                return child.text.strip()
+    return ''
+
+
+def _link(element):
+    # Atom: <link rel="alternate" href="..."/>; RSS: <link>...</link>
+    links = [child for child in element if _name(child) == 'link']
+    for link in links:
+        if link.get('href') and link.get('rel', 'alternate') == 'alternate':
+            return link.get('href').strip()
+    for link in links:
+        if (link.text or '').strip():
+            return link.text.strip()
+    for child in element:
+        if _name(child) == 'guid' and child.get('isPermaLink', 'true') == 'true' and (child.text or '').startswith('http'):
+            return child.text.strip()
+    return _child_text(element, 'loc')
+
+
+# Incremental parser for one feed body: feed() takes raw chunks and returns
+# the items finished so far; sitemaps collects the <sitemap><loc> of an index
+class FeedParser:
+    def __init__(self):
+        self.parser = XMLPullParser(events=('start', 'end'))
+        self.sitemaps = []
+        self.started = []  # Elements started but not finished
+
+    def feed(self, data):
+        self.parser.feed(data)
+        return self._items()
+
+    def close(self):
+        self.parser.close()
+        return self._items()
+
+    def _items(self):
+        items = []
+        for event, element in self.parser.read_events():
+            if event == 'start':
+                self.started.append(element)
+                continue
+            self.started.pop()
+            name = _name(element)
+            if name in ITEM_TAGS:
+                url = _link(element)
+                if url:
+                    date = parse_date(_child_text(element, 'pubDate', 'published', 'date', 'updated', 'lastmod'))
+                    description = _child_text(element, 'encoded', 'content', 'description', 'summary')
+                    items.append(Item(url, date, html_text(_child_text(element, 'title')), html_text(description)))
+            elif name == 'sitemap':
+                loc = _child_text(element, 'loc')
+                if loc:
+                    self.sitemaps.append(loc)
+            else:
+                continue
+            # Finished elements are not needed any more
+            if self.started:
+                self.started[-1].remove(element)
+        return items
+
+
+# Last validators of every feed, in the same SQLite file as the fingerprints.
+# The sitemaps of an index are kept too: an index that has not changed
+# answers 304, but the sitemaps it lists may still have new links
+class FeedStore:
+    def __init__(self, path=STATE_DB):
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS feeds (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                sitemaps TEXT NOT NULL DEFAULT '',
+                checked_at REAL NOT NULL,
+                items INTEGER NOT NULL DEFAULT 0
+            );
+        ''')
+
+    def close(self):
+        self.db.close()
+
+    # {url: (etag, last_modified, sitemaps)}
+    def load(self):
+        return {url: (etag, last_modified, sitemaps.split())
+                for url, etag, last_modified, sitemaps in self.db.execute(
+                    'SELECT url, etag, last_modified, sitemaps FROM feeds')}
+
+    # Save the validators of harvested feeds: {url: (etag, last_modified, sitemaps, items)}
+    def save(self, states):
+        now = time.time()
+        with self.db:
+            self.db.executemany(
+                '''INSERT INTO feeds (url, etag, last_modified, sitemaps, checked_at, items) VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (url) DO UPDATE SET etag = excluded.etag, last_modified = excluded.last_modified,
+                       sitemaps = excluded.sitemaps, checked_at = excluded.checked_at, items = excluded.items''',
+                [(url, etag, last_modified, '\n'.join(sitemaps), now, items)
+                 for url, (etag, last_modified, sitemaps, items) in states.items()])
+
+
+# Download and parse one feed body; returns (items, sitemaps, complete)
+def _read_feed(url, response):
+    parser = FeedParser()
+    # Sitemaps are often served gzipped as files, not with Content-Encoding
+    gzipped = url.endswith('.gz') or 'gzip' in response.headers.get('Content-Type', '')
+    decompressor = zlib.decompressobj(wbits=47) if gzipped else None
+    items = []
+    size = 0
+    complete = True
+    with metrics.span('feeds.parse'):
+        for chunk in response.iter_content(CHUNK_SIZE):
+            if decompressor is not None:
+                chunk = decompressor.decompress(chunk)
+            size += len(chunk)
+            if size > MAX_FEED_BYTES:
+                logging.warning(f"Feed {url} is larger than {MAX_FEED_BYTES} bytes; keeping the first items.")
+                complete = False
+                break
+            items += parser.feed(chunk)
+        else:
+            items += parser.close()
+    metrics.count('bytes_fetched', size)
+    return items, parser.sitemaps, complete
+
+
+# Harvest one feed or sitemap (and the sitemaps an index points to).
+# validators is {url: (etag, last_modified, sitemaps)} from the FeedStore;
+# returns (items, {url: (etag, last_modified, sitemaps, items)} of the feeds
+# read in full)
+def harvest(url, validators, depth=0):
+    headers = dict(HEADERS)
+    etag, last_modified, sitemaps = validators.get(url, (None, None, []))
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+
+    with metrics.span('feeds.fetch'):
+        response = hosts.get(url, headers, FEED_TIMEOUT)
+    state = {}
+    try:
+        if response.status_code == 304:
+            metrics.count('feeds_not_modified')
+            items = []
+        else:
+            response.raise_for_status()
+            items, sitemaps, complete = _read_feed(url, response)
+            metrics.count('feeds_harvested')
+            metrics.count('feed_items', len(items))
+            # A cut feed is read in full again next time rather than answering 304
+            if complete:
+                state[url] = (response.headers.get('ETag'), response.headers.get('Last-Modified'), sitemaps,
+                              len(items))
+    finally:
+        response.close()
+
+    for sitemap in sitemaps:
+        if depth >= MAX_SITEMAP_DEPTH:
+            logging.warning(f"Sitemap {sitemap} nested too deep in {url}; skipped.")
+            continue
+        try:
+            sitemap_items, sitemap_state = harvest(sitemap, validators, depth + 1)
+        except (ParseError, OSError, hosts.HostUnavailable) as e:
+            logging.error(f"Error harvesting sitemap {sitemap}: {e}")
+            metrics.count_error('feeds', e)
+            continue
+        items += sitemap_items
+        state.update(sitemap_state)
+    return items, state
+
+
+# Language, country and text of an item for columns H to J, from its feed
+# description; None when the description is too short to stand in for the page
+def scraped_values(item, min_length):
+    text = ' '.join(filter(None, (item.title, item.description)))
+    if len(item.description) < min_length:
+        return None
+    return [detect_language(text), 'Unknown', text[:MAX_DESCRIPTION_LENGTH]]
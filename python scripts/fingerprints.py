@@ -0,0 +1,120 @@
+import hashlib
+import os
+import sqlite3
+import time
+
+# Local fingerprint table of the sheet: for every row, the hash of its URL
+# (column B) and the run (revision) in which it was last scraped and
+# enriched. Comparing a fresh read of column B against it tells which rows
+# are new or edited, so a run only has to process those.
+#
+# The table only describes the sheet once script-ingest-changes.py has set
+# a baseline (with --adopt or --full). Other scripts that add rows
+# (script-harvest-feeds.py) leave the table alone until then, and
+# script-monitor-links.py only requeues rows it already holds: a partly
+# filled table would make every row without a fingerprint look new.
+
+STATE_DB = os.getenv('STATE_DB', 'bio-terms-state.db')
+
+
+def url_hash(url):
+    return hashlib.sha1(url.strip().encode('utf-8')).hexdigest()
+
+
+class FingerprintStore:
+    def __init__(self, path=STATE_DB):
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS runs (
+                revision INTEGER PRIMARY KEY,
+                started_at REAL NOT NULL,
+                changed_rows INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                row INTEGER PRIMARY KEY,
+                url_hash TEXT NOT NULL,
+                scraped_revision INTEGER,
+                enriched_revision INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS fingerprints_url_hash ON fingerprints (url_hash);
+            CREATE TABLE IF NOT EXISTS baseline (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                mode TEXT NOT NULL,
+                recorded_at REAL NOT NULL
+            );
+        ''')
+
+    def close(self):
+        self.db.close()
+
+    # How the baseline of the table was set ('adopt' or 'full'), or None
+    def baseline(self):
+        row = self.db.execute('SELECT mode FROM baseline WHERE id = 1').fetchone()
+        return row[0] if row else None
+
+    # Record that the table now describes the sheet
+    def set_baseline(self, mode):
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO baseline (id, mode, recorded_at) VALUES (1, ?, ?)',
+                            (mode, time.time()))
+
+    # Open a new run and return its revision number
+    def start_run(self):
+        with self.db:
+            cursor = self.db.execute('INSERT INTO runs (started_at) VALUES (?)', (time.time(),))
+        return cursor.lastrowid
+
+    def finish_run(self, revision, changed_rows):
+        with self.db:
+            self.db.execute('UPDATE runs SET changed_rows = ? WHERE revision = ?', (changed_rows, revision))
+
+    # {row: (url_hash, scraped_revision, enriched_revision)}
+    def load(self):
+        return {
+            row: (hash_, scraped, enriched)
+            for row, hash_, scraped, enriched in self.db.execute(
+                'SELECT row, url_hash, scraped_revision, enriched_revision FROM fingerprints')
+        }
+
+    # Highest row number seen so far (the high-water mark of the sheet)
+    def high_water_mark(self):
+        return self.db.execute('SELECT COALESCE(MAX(row), 0) FROM fingerprints').fetchone()[0]
+
+    # Store the URL hash of rows; the stage revisions are reset where the URL changed
+    def update_hashes(self, hashes):
+        with self.db:
+            self.db.executemany(
+                '''INSERT INTO fingerprints (row, url_hash) VALUES (?, ?)
+                   ON CONFLICT (row) DO UPDATE SET
+                       scraped_revision = CASE WHEN url_hash = excluded.url_hash THEN scraped_revision END,
+                       enriched_revision = CASE WHEN url_hash = excluded.url_hash THEN enriched_revision END,
+                       url_hash = excluded.url_hash''',
+                list(hashes.items()))
+
+    # Copy the stage revisions of rows that only moved (e.g. after script-0.py
+    # removed duplicates above them); their results moved along in the sheet
+    def copy_revisions(self, moves):
+        with self.db:
+            self.db.executemany(
+                'UPDATE fingerprints SET scraped_revision = ?, enriched_revision = ? WHERE row = ?',
+                [(scraped, enriched, row) for row, (scraped, enriched) in moves.items()])
+
+    # Record that rows went through a stage ('scraped' or 'enriched') in a revision
+    def mark(self, rows, stage, revision):
+        column = {'scraped': 'scraped_revision', 'enriched': 'enriched_revision'}[stage]
+        with self.db:
+            self.db.executemany(f'UPDATE fingerprints SET {column} = ? WHERE row = ?',
+                                [(revision, row) for row in rows])
+
+    # Clear the stage revisions of rows whose page changed (see liveness.py),
+    # so the next script-ingest-changes.py run scrapes and enriches them again
+    def requeue(self, rows):
+        with self.db:
+            self.db.executemany(
+                'UPDATE fingerprints SET scraped_revision = NULL, enriched_revision = NULL WHERE row = ?',
+                [(row,) for row in rows])
+
+    # Forget rows below the end of the sheet (rows deleted from the bottom)
+    def truncate(self, last_row):
+        with self.db:
+            self.db.execute('DELETE FROM fingerprints WHERE row > ?', (last_row,))
@@ -0,0 +1,212 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+from urllib.parse import urlparse, urlunparse
+
+import metrics
+
+# Per-host request policy for the scrape stages, used by pipeline.fetch_page:
+#
+# - adaptive timeouts: the time to response headers of recent requests to a
+#   host sets its connect and read timeouts (a multiple of the p50 and p95,
+#   within MIN_TIMEOUT and the caller's timeout), so fast hosts fail fast;
+# - circuit breaker: after BREAKER_FAILURES timeouts or connection errors in
+#   a row a host is skipped for BREAKER_SECONDS instead of costing a full
+#   timeout per link;
+# - hedged requests (HEDGE_REQUESTS=1): when a host is slower than its usual
+#   p90, the www. or scheme variant of the URL is tried too and the first
+#   answer wins.
+#
+# The latencies are kept in HOST_STATS_FILE between runs, so the
+# double-check run starts with the timeouts the scrape run learned. Breaker
+# state is not: the double-check exists to retry the hosts that failed, so
+# it starts with every breaker closed.
+
+HOST_STATS_FILE = os.getenv('HOST_STATS_FILE', 'host-stats.json')
+MIN_TIMEOUT = float(os.getenv('MIN_TIMEOUT', 2))  # seconds
+TIMEOUT_FACTOR = 3  # Timeouts are this many times the p50 (connect) or p95 (read) of a host
+MIN_SAMPLES = 5  # Requests to a host before its own timeouts are used
+SAMPLES_PER_HOST = 50
+BREAKER_FAILURES = int(os.getenv('BREAKER_FAILURES', 3))
+BREAKER_SECONDS = int(os.getenv('BREAKER_SECONDS', 300))
+HEDGE_REQUESTS = bool(int(os.getenv('HEDGE_REQUESTS', 0)))
+HEDGE_AFTER = 2.0  # Seconds before hedging a host without enough samples
+
+
+# Raised instead of requesting a host whose circuit breaker is open
+class HostUnavailable(Exception):
+    pass
+
+
+class HostStats:
+    def __init__(self, latencies=(), failures=0, open_until=0.0):
+        self.latencies = deque(latencies, maxlen=SAMPLES_PER_HOST)
+        self.failures = failures
+        self.open_until = open_until
+
+    def percentile(self, q):
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    # (connect, read) timeouts for the next request
+    def timeouts(self, max_timeout):
+        if len(self.latencies) < MIN_SAMPLES:
+            return max_timeout, max_timeout
+        # Connecting takes part of the usual answer time, waiting for data up to the slow tail
+        connect = min(max_timeout, max(MIN_TIMEOUT, TIMEOUT_FACTOR * self.percentile(0.5)))
+        read = min(max_timeout, max(MIN_TIMEOUT, TIMEOUT_FACTOR * self.percentile(0.95)))
+        return connect, read
+
+    def hedge_delay(self):
+        if len(self.latencies) < MIN_SAMPLES:
+            return HEDGE_AFTER
+        return self.percentile(0.9)
+
+
+_lock = threading.Lock()
+_hosts = None
+_hedge_pool = None
+
+
+# Latencies saved by earlier runs; an empty HOST_STATS_FILE keeps them in memory only
+def load(path=None):
+    path = HOST_STATS_FILE if path is None else path
+    if not path:
+        return {}
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    # Files of earlier versions also hold breaker state, which is ignored
+    return {host: HostStats(stats['latencies']) for host, stats in data.items()}
+
+
+# Save the latencies of every host (called when a ScrapeStage closes)
+def save(path=None):
+    path = HOST_STATS_FILE if path is None else path
+    with _lock:
+        if _hosts is None or not path:
+            return
+        data = {host: {'latencies': list(stats.latencies)} for host, stats in _hosts.items()}
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+# Forget the statistics of every host (benchmark-faults.py starts every
+# scenario from scratch)
+def reset():
+    global _hosts
+    with _lock:
+        _hosts = {}
+
+
+def _stats(host):
+    global _hosts
+    with _lock:
+        if _hosts is None:
+            _hosts = load()
+        if host not in _hosts:
+            _hosts[host] = HostStats()
+        return _hosts[host]
+
+
+# The same page under the other www. name, or under the other scheme
+def alternate_url(url):
+    parsed = urlparse(url)
+    host = parsed.hostname or ''
+    if host.startswith('www.'):
+        return urlunparse(parsed._replace(netloc=parsed.netloc.replace('www.', '', 1)))
+    if host.count('.') == 1:
+        return urlunparse(parsed._replace(netloc='www.' + parsed.netloc))
+    return urlunparse(parsed._replace(scheme='http' if parsed.scheme == 'https' else 'https'))
+
+
+def _get(url, headers, timeout, method='GET'):
+    import requests
+    return requests.request(method, url, headers=headers, timeout=timeout, stream=True, allow_redirects=True)
+
+
+def _close(future):
+    try:
+        future.result().close()
+    except Exception:
+        pass
+
+
+# Start the request; if it has not answered after delay, start the
+# alternate URL too and return whichever response arrives first
+def _hedged(url, headers, timeout, delay, method='GET'):
+    global _hedge_pool
+    with _lock:
+        if _hedge_pool is None:
+            _hedge_pool = ThreadPoolExecutor(64, thread_name_prefix='hedge')
+    primary = _hedge_pool.submit(_get, url, headers, timeout, method)
+    try:
+        return primary.result(timeout=delay)
+    except FutureTimeout:
+        pass
+
+    metrics.count('hedged_requests')
+    backup = _hedge_pool.submit(_get, alternate_url(url), headers, timeout, method)
+    pending = {primary, backup}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                response = future.result()
+            except Exception as e:
+                error = error or e
+                continue
+            for other in pending:
+                other.add_done_callback(_close)
+            if future is backup:
+                metrics.count('hedge_wins')
+            return response
+    raise error
+
+
+# GET a URL (streamed), or send another method such as HEAD, under the
+# timeouts, breaker and hedging of its host
+def get(url, headers, max_timeout=10, method='GET'):
+    import requests
+
+    host = urlparse(url).hostname or ''
+    stats = _stats(host)
+    now = time.time()
+    with _lock:
+        if stats.open_until > now:
+            metrics.count('breaker_skips')
+            raise HostUnavailable(f"{host} timed out {stats.failures} times; skipped until the breaker closes")
+        timeout = stats.timeouts(max_timeout)
+        delay = stats.hedge_delay()
+
+    start = time.perf_counter()
+    try:
+        if HEDGE_REQUESTS:
+            response = _hedged(url, headers, timeout, delay, method)
+        else:
+            response = _get(url, headers, timeout, method)
+    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+        with _lock:
+            stats.failures += 1
+            if stats.failures >= BREAKER_FAILURES:
+                # Also re-opens at once when the first request after a break fails
+                stats.open_until = time.time() + BREAKER_SECONDS
+                logging.warning(f"Circuit breaker opened for {host} after {stats.failures} failures.")
+                metrics.count('breaker_opened')
+        raise
+
+    with _lock:
+        stats.latencies.append(time.perf_counter() - start)
+        stats.failures = 0
+        stats.open_until = 0.0
+    return response
@@ -0,0 +1,216 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from collections import namedtuple
+
+import hosts
+import metrics
+from feeds import canonical_url
+from fingerprints import STATE_DB
+from main_content import MainContentParser
+from pipeline import CHUNK_SIZE, HEADERS, HTML_TYPES, parse_html
+
+# Liveness monitor for the links already in the sheet (see
+# script-monitor-links.py). Each link costs one small request instead of a
+# full download: a ranged GET of its first RANGE_BYTES, or a HEAD with
+# MONITOR_METHOD=head, sent with If-None-Match / If-Modified-Since from the
+# last check so unchanged pages can answer 304. The status, redirect
+# target, validators and a digest of the main content (main_content.py) in
+# the range are kept in the links table of STATE_DB. A link has changed when
+#
+# - it answers again after being dead ('revived'),
+# - it redirects somewhere else than before ('redirect'),
+# - the digest of its text differs, or with HEAD (no body) its ETag,
+#   Last-Modified or length ('content').
+#
+# Only the first RANGE_BYTES of a page are seen, so an edit further down a
+# long page goes unnoticed; raise MONITOR_RANGE_BYTES (--range-bytes) for
+# sites with heavy headers. A digest records its extractor and range, and
+# digests taken with another range or by an older version are not
+# compared; the validators decide until the link has been checked again.
+#
+# Links that went dead (4xx) are recorded as 'dead' but keep their text in
+# the sheet. Timeouts, 429s and 5xx keep the last known state, and the
+# first check of a link only records it.
+
+MONITOR_METHOD = os.getenv('MONITOR_METHOD', 'range')  # 'range' or 'head'
+RANGE_BYTES = int(os.getenv('MONITOR_RANGE_BYTES', 32 * 1024))
+MONITOR_TIMEOUT = 10  # seconds
+
+# Changes after which a row is scraped and enriched again
+REQUEUE_REASONS = ('revived', 'redirect', 'content')
+
+# State of a link after a check; status 0 means it never answered
+Check = namedtuple('Check', 'url status final_url etag last_modified length digest error')
+
+
+def alive(status):
+    return 200 <= status < 400
+
+
+# Answers that say nothing about the page itself
+def transient(status):
+    return status == 429 or status >= 500
+
+
+class LinkStore:
+    def __init__(self, path=STATE_DB):
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS links (
+                url TEXT PRIMARY KEY,
+                status INTEGER NOT NULL,
+                final_url TEXT NOT NULL DEFAULT '',
+                etag TEXT,
+                last_modified TEXT,
+                length INTEGER,
+                digest TEXT,
+                error TEXT NOT NULL DEFAULT '',
+                checked_at REAL NOT NULL,
+                changed_at REAL,
+                change TEXT NOT NULL DEFAULT ''
+            );
+        ''')
+
+    def close(self):
+        self.db.close()
+
+    # {url: Check} of the last check of every link
+    def load(self):
+        return {row[0]: Check(*row) for row in self.db.execute(
+            'SELECT url, status, final_url, etag, last_modified, length, digest, error FROM links')}
+
+    # Links checked less than max_age seconds ago
+    def checked_since(self, max_age):
+        return {url for url, in self.db.execute('SELECT url FROM links WHERE checked_at > ?',
+                                                (time.time() - max_age,))}
+
+    # Save checks with the changes found in them: [(Check, reasons)]
+    def save(self, checks):
+        now = time.time()
+        with self.db:
+            self.db.executemany(
+                '''INSERT INTO links (url, status, final_url, etag, last_modified, length, digest, error, checked_at,
+                                      changed_at, change)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (url) DO UPDATE SET status = excluded.status, final_url = excluded.final_url,
+                       etag = excluded.etag, last_modified = excluded.last_modified, length = excluded.length,
+                       digest = excluded.digest, error = excluded.error, checked_at = excluded.checked_at,
+                       changed_at = COALESCE(excluded.changed_at, changed_at),
+                       change = CASE WHEN excluded.change != '' THEN excluded.change ELSE change END''',
+                [(*check, now, now if reasons else None, ','.join(reasons)) for check, reasons in checks])
+
+    # [(url, status, error, checked_at)] of the links that are dead now
+    def dead(self):
+        return self.db.execute(
+            'SELECT url, status, error, checked_at FROM links WHERE status >= 400 ORDER BY url').fetchall()
+
+
+# Total size of the page from Content-Range (ranged answers) or Content-Length
+def _length(response):
+    total = response.headers.get('Content-Range', '').rpartition('/')[2]
+    if total.isdigit():
+        return int(total)
+    length = response.headers.get('Content-Length', '')
+    return int(length) if length.isdigit() and response.status_code == 200 else None
+
+
+# Read at most range_bytes of the body, whether or not the server honoured the range
+def _read_range(response, range_bytes):
+    body = bytearray()
+    for chunk in response.iter_content(CHUNK_SIZE):
+        body += chunk
+        if len(body) >= range_bytes:
+            break
+    metrics.count('bytes_fetched', min(len(body), range_bytes))
+    return bytes(body[:range_bytes])
+
+
+# Digest of the main content of a web page (menus, footers, markup, scripts
+# and tokens in attributes change on every request) or of the raw bytes of
+# anything else, as '<kind>-<range_bytes>:<sha1>'
+def _digest(response, data, range_bytes):
+    content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+    kind = 'raw'
+    if content_type in HTML_TYPES:
+        has_charset = 'charset=' in response.headers.get('Content-Type', '').lower()
+        data = parse_html(data, response.encoding if has_charset else None, range_bytes,
+                          MainContentParser).text().encode('utf-8')
+        kind = 'main'
+    return f'{kind}-{range_bytes}:{hashlib.sha1(data).hexdigest()}'
+
+
+# Extractor and range a digest was taken with ('' for older digests)
+def _digest_kind(digest):
+    return digest.rpartition(':')[0]
+
+
+# Check one link against its previous state and return its new state
+def check_link(url, previous=None, method=MONITOR_METHOD, range_bytes=RANGE_BYTES):
+    headers = dict(HEADERS)
+    if previous is not None and alive(previous.status):
+        if previous.etag:
+            headers['If-None-Match'] = previous.etag
+        if previous.last_modified:
+            headers['If-Modified-Since'] = previous.last_modified
+    if method == 'range':
+        headers['Range'] = f'bytes=0-{range_bytes - 1}'
+        # A range of a compressed body cannot be decoded on its own
+        headers['Accept-Encoding'] = 'identity'
+
+    unknown = previous or Check(url, 0, '', None, None, None, None, '')
+    try:
+        with metrics.span('monitor.fetch'):
+            response = hosts.get(url, headers, MONITOR_TIMEOUT, 'HEAD' if method == 'head' else 'GET')
+    except Exception as e:
+        metrics.count_error('monitor', e)
+        return unknown._replace(error=f'{type(e).__name__}: {e}'[:200])
+    if response.status_code == 405 and method == 'head':
+        # Servers that refuse HEAD get the ranged GET instead
+        response.close()
+        return check_link(url, previous, 'range', range_bytes)
+
+    try:
+        status = response.status_code
+        if status == 304 and previous is not None:
+            metrics.count('links_not_modified')
+            return previous._replace(error='')
+        if transient(status):
+            metrics.count('links_unreachable')
+            return unknown._replace(error=f'HTTP {status}')
+        final_url = response.url if canonical_url(response.url) != canonical_url(url) else ''
+        if not alive(status):
+            return Check(url, status, final_url, None, None, None, None, f'HTTP {status}')
+        digest = _digest(response, _read_range(response, range_bytes), range_bytes) if method == 'range' else None
+        return Check(url, status, final_url, response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                     _length(response), digest, '')
+    finally:
+        response.close()
+
+
+# Why a link counts as changed since its previous check (empty when it did not)
+def changes(previous, check):
+    if previous is None or previous.status == 0 or check.status == 0:
+        return []
+    reasons = []
+    if alive(previous.status) != alive(check.status):
+        reasons.append('revived' if alive(check.status) else 'dead')
+    elif alive(check.status):
+        if check.final_url != previous.final_url:
+            reasons.append('redirect')
+        if previous.digest and check.digest and _digest_kind(previous.digest) == _digest_kind(check.digest):
+            changed = previous.digest != check.digest
+        else:
+            # Without a body the first validator both checks have decides
+            pairs = ((previous.etag, check.etag), (previous.last_modified, check.last_modified),
+                     (previous.length, check.length))
+            changed = next((old != new for old, new in pairs if old and new), False)
+        if changed:
+            reasons.append('content')
+    for reason in reasons:
+        metrics.count('links_changed', reason=reason)
+    if reasons:
+        logging.info(f"{check.url} changed ({', '.join(reasons)}).")
+    return reasons
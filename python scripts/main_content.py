@@ -0,0 +1,245 @@
+import re
+from html.parser import HTMLParser
+
+# Main-content extraction in the style of Readability: instead of all the
+# visible text of a page (menus, cookie banners, footers, related-article
+# lists and all), keep the title and the block that holds the article.
+#
+# The parser builds a light tree of the block elements of the page. Every
+# paragraph-like block with some text gives its parent a score (more for
+# long text and commas, as prose has them) and half of it to its
+# grandparent. Class and id names such as 'article' or 'content' add to a
+# block's score, names such as 'nav', 'cookie' or 'related' subtract from
+# it, and the score is scaled down by the share of the block's text that is
+# link text. The best block and its siblings that score nearly as well are
+# kept; nav, footer, aside and form elements and blocks with negative names
+# never are, unless they hold most of the page's text (like the <form> some
+# sites wrap around everything). Pages without a clear main block (too
+# little text in it) fall back to the full text, so nothing is lost on
+# index pages or unusual layouts.
+#
+# MainContentParser has the interface of pipeline.PageParser (feed(),
+# text(), meta), so pipeline.parse_html can use either.
+
+MIN_PARAGRAPH_LENGTH = 25  # Blocks with less own text do not score their parents
+MIN_MAIN_LENGTH = 250  # Less main text than this falls back to the full text
+SIBLING_THRESHOLD = 0.2  # Siblings scoring this share of the best block are kept too
+
+SKIP_TAGS = {'script', 'style', 'noscript', 'template', 'svg'}
+BLOCK_TAGS = {
+    'address', 'article', 'aside', 'blockquote', 'body', 'dd', 'details', 'dialog', 'div', 'dl', 'dt',
+    'fieldset', 'figcaption', 'figure', 'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header',
+    'li', 'main', 'menu', 'nav', 'ol', 'p', 'pre', 'section', 'table', 'td', 'th', 'tr', 'ul',
+}
+# Never part of the main content, whatever their score
+BOILERPLATE_TAGS = {'nav', 'footer', 'aside', 'form', 'dialog', 'menu'}
+# Tags closed by the next one of the same kind when their end tag is omitted
+AUTO_CLOSE_TAGS = {'p', 'li', 'dt', 'dd', 'td', 'th', 'tr'}
+PARAGRAPH_TAGS = {'p', 'pre', 'td', 'blockquote', 'li', 'dd', 'div', 'section', 'article'}
+
+TAG_SCORES = {
+    'article': 10, 'main': 10, 'div': 5, 'section': 3, 'pre': 3, 'td': 3, 'blockquote': 3,
+    'address': -3, 'ol': -3, 'ul': -3, 'dl': -3, 'dd': -3, 'dt': -3, 'li': -3,
+    'h1': -5, 'h2': -5, 'h3': -5, 'h4': -5, 'h5': -5, 'h6': -5, 'th': -5, 'header': -5,
+}
+POSITIVE = re.compile(r'article|body|content|entry|hentry|main|page|post|text|blog|story|prose', re.IGNORECASE)
+NEGATIVE = re.compile(
+    r'banner|breadcrumb|combx|comment|community|consent|cookie|disqus|extra|foot|gdpr|header|legends|menu|modal|'
+    r'nav|newsletter|outbrain|pagination|pager|popup|promo|related|remark|rss|share|shoutbox|sidebar|skyscraper|'
+    r'social|sponsor|subscribe|taboola|tags|tool|widget|advert|\bad-|-ad\b',
+    re.IGNORECASE)
+
+
+class Node:
+    __slots__ = ('tag', 'parent', 'weight', 'boilerplate', 'own_length', 'own_link_length', 'commas',
+                 'text_length', 'link_length', 'score')
+
+    def __init__(self, tag, parent, weight=0):
+        self.tag = tag
+        self.parent = parent
+        self.weight = weight
+        self.boilerplate = False
+        self.own_length = 0
+        self.own_link_length = 0
+        self.commas = 0
+        self.text_length = 0
+        self.link_length = 0
+        self.score = None
+
+    @property
+    def link_density(self):
+        return self.link_length / self.text_length if self.text_length else 0.0
+
+
+# Score of the class and id names of an element
+def class_weight(attrs):
+    names = ' '.join(value or '' for name, value in attrs if name in ('class', 'id'))
+    if not names:
+        return 0
+    weight = 0
+    if NEGATIVE.search(names):
+        weight -= 25
+    if POSITIVE.search(names):
+        weight += 25
+    return weight
+
+
+class MainContentParser(HTMLParser):
+    def __init__(self, max_text_length):
+        super().__init__(convert_charrefs=True)
+        self.max_text_length = max_text_length
+        self.root = Node('body', None)
+        self.nodes = [self.root]
+        self.stack = [self.root]
+        self.pieces = []  # (node, text, is_link) in document order
+        self.pending = []
+        self.skip_depth = 0
+        self.link_depth = 0
+        self.in_title = False
+        self.title = []
+        self.meta = []
+        self.kept = None
+        self.scored = False
+
+    # The whole page is needed to find its main block
+    @property
+    def full(self):
+        return False
+
+    def flush(self):
+        if not self.pending:
+            return
+        text = ' '.join(''.join(self.pending).split())
+        self.pending = []
+        if not text:
+            return
+        node = self.stack[-1]
+        self.pieces.append((node, text, self.link_depth > 0))
+        node.own_length += len(text)
+        node.commas += text.count(',')
+        if self.link_depth:
+            node.own_link_length += len(text)
+
+    def handle_starttag(self, tag, attrs):
+        self.flush()
+        if tag in SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag == 'meta':
+            self.meta.append(dict(attrs))
+        elif tag == 'title':
+            self.in_title = True
+        elif tag == 'a':
+            self.link_depth += 1
+        elif tag in BLOCK_TAGS:
+            if tag in AUTO_CLOSE_TAGS and self.stack[-1].tag == tag:
+                self.stack.pop()
+            node = Node(tag, self.stack[-1], class_weight(attrs))
+            self.nodes.append(node)
+            self.stack.append(node)
+
+    def handle_startendtag(self, tag, attrs):
+        self.flush()
+        if tag == 'meta':
+            self.meta.append(dict(attrs))
+
+    def handle_endtag(self, tag):
+        self.flush()
+        if tag in SKIP_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag == 'title':
+            self.in_title = False
+        elif tag == 'a':
+            self.link_depth = max(0, self.link_depth - 1)
+        elif tag in BLOCK_TAGS:
+            # Close up to the matching element; stray end tags are ignored
+            for index in range(len(self.stack) - 1, 0, -1):
+                if self.stack[index].tag == tag:
+                    del self.stack[index:]
+                    break
+
+    def handle_data(self, data):
+        if self.skip_depth:
+            return
+        if self.in_title:
+            self.title.append(data)
+        else:
+            self.pending.append(data)
+
+    def handle_comment(self, data):
+        self.flush()
+
+    def page_title(self):
+        for attrs in self.meta:
+            if attrs.get('property') == 'og:title' and (attrs.get('content') or '').strip():
+                return ' '.join(attrs['content'].split())
+        return ' '.join(''.join(self.title).split())
+
+    # The block holding the article and the siblings kept with it, or None
+    def main_blocks(self):
+        if self.scored:
+            return self.kept
+        self.scored = True
+        # Text and link totals of every subtree (children come after their parents)
+        for node in reversed(self.nodes):
+            node.text_length += node.own_length
+            node.link_length += node.own_link_length
+            if node.parent is not None:
+                node.parent.text_length += node.text_length
+                node.parent.link_length += node.link_length
+        total = self.root.text_length
+        for node in self.nodes[1:]:
+            node.boilerplate = node.parent.boilerplate or (
+                (node.tag in BOILERPLATE_TAGS or node.weight < 0) and node.text_length < total / 2)
+
+        candidates = []
+        for node in self.nodes:
+            if node.boilerplate or node.tag not in PARAGRAPH_TAGS or node.own_length < MIN_PARAGRAPH_LENGTH:
+                continue
+            score = 1 + node.commas + min(node.own_length // 100, 3)
+            for ancestor, share in ((node.parent, 1.0), (node.parent and node.parent.parent, 0.5)):
+                if ancestor is None or ancestor.boilerplate:
+                    continue
+                if ancestor.score is None:
+                    ancestor.score = TAG_SCORES.get(ancestor.tag, 0) + ancestor.weight
+                    candidates.append(ancestor)
+                ancestor.score += score * share
+        if not candidates:
+            return None
+
+        def final_score(node):
+            return node.score * (1 - node.link_density)
+
+        top = max(candidates, key=final_score)
+        self.kept = {top}
+        threshold = max(10, final_score(top) * SIBLING_THRESHOLD)
+        if top.parent is not None:
+            for node in candidates:
+                if node.parent is top.parent and final_score(node) >= threshold:
+                    self.kept.add(node)
+            # Loose paragraphs next to the main block
+            for node in self.nodes:
+                if node.parent is top.parent and node.tag == 'p' and not node.boilerplate \
+                        and node.text_length > 80 and node.link_density < 0.25:
+                    self.kept.add(node)
+        return self.kept
+
+    # Title and article text, or the full text when the page has no clear main block
+    def text(self):
+        self.flush()
+        kept = self.main_blocks()
+        title = self.page_title()
+        if kept is not None:
+            # Nodes inside a kept block (parents come before their children)
+            inside = set()
+            for node in self.nodes:
+                if not node.boilerplate and (node in kept or node.parent in inside):
+                    inside.add(node)
+            texts = [text for node, text, is_link in self.pieces
+                     if node in inside and not (is_link and node.link_density > 0.5)]
+            main = ' '.join(texts)
+            if len(main) >= MIN_MAIN_LENGTH:
+                if title and not main.startswith(title):
+                    main = f'{title} {main}'
+                return main[:self.max_text_length]
+        full = ' '.join(text for _, text, _ in self.pieces)
+        return (f'{title} {full}' if title else full)[:self.max_text_length]
@@ -0,0 +1,248 @@
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Lightweight run instrumentation shared by all stages: span timers,
+# labelled counters, an end-of-run summary and optional exports.
+#
+#   with metrics.span('download'):
+#       response = requests.get(url)
+#   metrics.count('bytes_fetched', len(response.content))
+#   metrics.count('errors', stage='scrape', error='Timeout')
+#   metrics.report()
+#
+# Set METRICS_PROM_FILE to write a Prometheus text file (for the node
+# exporter textfile collector) and METRICS_TRACE_FILE to append one JSON
+# line per finished span.
+
+PROM_FILE = os.getenv('METRICS_PROM_FILE')
+TRACE_FILE = os.getenv('METRICS_TRACE_FILE')
+
+# Number of durations kept per span for the percentiles (reservoir sample)
+SAMPLE_SIZE = 10000
+
+# metrics is imported near the top of every script, so uptime() covers
+# almost the whole start-up of the process
+STARTED = time.perf_counter()
+
+_lock = threading.Lock()
+_spans = {}
+_counters = defaultdict(float)
+_trace = None
+
+
+class SpanStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = []
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+        if len(self.samples) < SAMPLE_SIZE:
+            self.samples.append(duration)
+        else:
+            slot = random.randrange(self.count)
+            if slot < SAMPLE_SIZE:
+                self.samples[slot] = duration
+
+    def percentile(self, q):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+# Start appending span events to a JSONL file
+def enable_trace(path):
+    global _trace
+    with _lock:
+        if _trace:
+            _trace.close()
+        _trace = open(path, 'a', buffering=1)
+
+
+# Stop writing span events (worker processes leave the trace to the parent)
+def disable_trace():
+    global _trace
+    with _lock:
+        _trace = None
+
+
+# Clear all recorded spans and counters
+def reset():
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+
+
+def record(name, duration, **labels):
+    with _lock:
+        stats = _spans.get(name)
+        if stats is None:
+            stats = _spans[name] = SpanStats()
+        stats.add(duration)
+        if _trace:
+            event = {'ts': round(time.time(), 6), 'span': name, 'duration': round(duration, 6)}
+            event.update(labels)
+            _trace.write(json.dumps(event) + '\n')
+
+
+# Time the enclosed block under the given span name
+@contextmanager
+def span(name, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start, **labels)
+
+
+# Add to a counter; keyword arguments become labels (e.g. stage, error)
+def count(name, value=1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] += value
+
+
+# True for errors that mean "too many requests": HTTP 429 from requests or
+# the Google API client, or the OpenAI client's RateLimitError
+def is_rate_limited(error):
+    if type(error).__name__ == 'RateLimitError':
+        return True
+    # A requests Response with an error status is falsy, so test for None
+    response = getattr(error, 'response', None)
+    if response is None:
+        response = getattr(error, 'resp', None)
+    status = getattr(response, 'status_code', None) or getattr(response, 'status', None)
+    return str(status) == '429'
+
+
+# Count an exception under errors{stage, error class}, and rate-limit errors
+# also under rate_limited{stage} (see tuning.py)
+def count_error(stage, error):
+    count('errors', stage=stage, error=type(error).__name__)
+    if is_rate_limited(error):
+        count('rate_limited', stage=stage)
+
+
+# Wrap socket.getaddrinfo so DNS resolution shows up as its own span
+def time_dns():
+    if getattr(socket.getaddrinfo, 'timed', False):
+        return
+    getaddrinfo = socket.getaddrinfo
+
+    def timed_getaddrinfo(*args, **kwargs):
+        with span('dns'):
+            return getaddrinfo(*args, **kwargs)
+
+    timed_getaddrinfo.timed = True
+    socket.getaddrinfo = timed_getaddrinfo
+
+
+# Raw spans and counters recorded since the last reset, to be merged into
+# the parent process with merge()
+def export():
+    with _lock:
+        spans = {name: list(stats.samples) for name, stats in _spans.items()}
+        counters = [(name, dict(labels), value) for (name, labels), value in _counters.items()]
+    return {'spans': spans, 'counters': counters}
+
+
+def merge(data):
+    for name, durations in data['spans'].items():
+        for duration in durations:
+            record(name, duration)
+    for name, labels, value in data['counters']:
+        count(name, value, **labels)
+
+
+# Current spans and counters as plain data (used by benchmark.py)
+def snapshot():
+    with _lock:
+        spans = {
+            name: {
+                'count': stats.count,
+                'total_seconds': round(stats.total, 6),
+                'p50_ms': round(stats.percentile(0.50) * 1000, 3),
+                'p95_ms': round(stats.percentile(0.95) * 1000, 3),
+                'p99_ms': round(stats.percentile(0.99) * 1000, 3),
+                'max_ms': round(stats.max * 1000, 3),
+            }
+            for name, stats in _spans.items()
+        }
+        counters = [
+            {'name': name, 'labels': dict(labels), 'value': value}
+            for (name, labels), value in sorted(_counters.items())
+        ]
+    return {'spans': spans, 'counters': counters}
+
+
+# Human-readable end-of-run summary, slowest stages first
+def summary():
+    data = snapshot()
+    lines = ['Run summary:', f"  {'span':<24}{'count':>8}{'total s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"]
+    for name, stats in sorted(data['spans'].items(), key=lambda item: -item[1]['total_seconds']):
+        lines.append(f"  {name:<24}{stats['count']:>8}{stats['total_seconds']:>10.2f}"
+                     f"{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}")
+    for counter in data['counters']:
+        labels = ', '.join(f'{key}={value}' for key, value in counter['labels'].items())
+        name = f"{counter['name']}{{{labels}}}" if labels else counter['name']
+        lines.append(f"  {name}: {counter['value']:g}")
+    return '\n'.join(lines)
+
+
+def _prometheus_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{str(value)}"' for key, value in labels.items()) + '}'
+
+
+# Write all spans and counters in the Prometheus text exposition format
+def write_prometheus(path):
+    data = snapshot()
+    lines = ['# TYPE bioterms_span_seconds summary']
+    for name, stats in sorted(data['spans'].items()):
+        for quantile, key in (('0.5', 'p50_ms'), ('0.95', 'p95_ms'), ('0.99', 'p99_ms')):
+            lines.append(f'bioterms_span_seconds{{span="{name}",quantile="{quantile}"}} {stats[key] / 1000}')
+        lines.append(f'bioterms_span_seconds_sum{{span="{name}"}} {stats["total_seconds"]}')
+        lines.append(f'bioterms_span_seconds_count{{span="{name}"}} {stats["count"]}')
+    seen = set()
+    for counter in data['counters']:
+        metric = f"bioterms_{counter['name']}_total"
+        if metric not in seen:
+            lines.append(f'# TYPE {metric} counter')
+            seen.add(metric)
+        lines.append(f"{metric}{_prometheus_labels(counter['labels'])} {counter['value']:g}")
+
+    # Write atomically so the textfile collector never reads a partial file
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(tmp_path, path)
+
+
+# Seconds since this module was imported
+def uptime():
+    return time.perf_counter() - STARTED
+
+
+# Log the summary and write the configured exports; call at the end of a run
+def report():
+    logging.info(summary())
+    if PROM_FILE:
+        write_prometheus(PROM_FILE)
+        logging.info(f"Metrics written to {PROM_FILE}")
+
+
+if TRACE_FILE:
+    enable_trace(TRACE_FILE)
@@ -0,0 +1,8 @@
+from collections import namedtuple
+
+# Page model shared by the download (pipeline.fetch_page), the extraction
+# workers and the page archive (archive.py). It has no imports of its own,
+# so any of them can use it without importing the others.
+
+# Raw (capped) response body handed from the fetch to the extraction step
+Page = namedtuple('Page', 'url content_type encoding data')
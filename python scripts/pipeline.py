@@ -0,0 +1,641 @@
+import codecs
+import importlib
+import io
+import logging
+import os
+import re
+import time
+from html.parser import HTMLParser
+from urllib.parse import urlparse
+
+import archive
+import hosts
+import metrics
+import profiling
+from main_content import MainContentParser
+from pages import Page
+from routing import DEFAULT_MODEL, BudgetExceeded, default_router
+from rows import ENRICHED, SCRAPED, needs_recheck, read_rows, write_rows
+from shared_cache import enrich_key
+
+# Shared stage logic for the scrape (script-1-batch.py), double-check
+# (script-1-double-check.py) and enrichment (script-2-batch.py) scripts.
+# The scripts only handle authentication and the batch loop, so the same
+# code can be driven against local stand-ins by benchmark.py.
+#
+# requests, langdetect and pypdf are imported inside the functions that use
+# them, so a run only pays for the libraries of the stages it executes.
+
+# Define headers to mimic a browser
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko)'
+                  ' Chrome/98.0.4758.102 Safari/537.36'
+}
+
+# Pages are streamed and parsed chunk by chunk, so memory per worker is
+# bounded by these caps whatever the size of the linked file
+MAX_DOWNLOAD_BYTES = int(os.getenv('MAX_DOWNLOAD_BYTES', 5 * 1024 * 1024))
+MAX_PDF_BYTES = int(os.getenv('MAX_PDF_BYTES', 20 * 1024 * 1024))
+# Extraction runs after the download (in a worker process), so the parser
+# cannot stop the download once it has enough text. Instead a page is read
+# up to this many bytes per character of max_text_length (1 MB for 25000
+# characters): plenty for ordinary pages, whose visible text is a few
+# percent of the HTML, while pages whose first megabyte is mostly inline
+# scripts or SVG can lose text after the cap. 0 reads up to
+# MAX_DOWNLOAD_BYTES whatever max_text_length is
+BYTES_PER_TEXT_CHAR = int(os.getenv('BYTES_PER_TEXT_CHAR', 40))
+CHUNK_SIZE = 64 * 1024
+
+# Content types parsed as web pages; PDFs go to extract_pdf_text and
+# anything else (images, video, archives) is skipped without downloading
+HTML_TYPES = ('text/html', 'application/xhtml+xml', 'text/plain', '')
+PDF_TYPES = ('application/pdf', 'application/x-pdf')
+
+# Placeholder written to columns H to J for links that are not web pages
+UNSUPPORTED = 'Unsupported'
+
+# Text kept from web pages: 'main' keeps the title and article body (see
+# main_content.py), 'full' all visible text including menus and footers
+EXTRACTOR = os.getenv('EXTRACTOR', 'main')
+
+# Predefined categories (your tags)
+categories = [
+    'Bioart',
+    'Biodesign',
+    'Bioarchitecture',
+    'Biomimecry',
+    'Synthetic Biology',
+    'Bio 3D Printing',
+    'Parametric Design',
+    'Open Science Hardware',
+    'Biomanufacturing',
+    'Biohacking',
+    'Biomaterial'
+]
+
+# Libraries each stage needs, imported up front only by preload()
+STAGE_MODULES = {
+    'scrape': ['requests', 'langdetect'],
+    'double-check': ['requests', 'langdetect'],
+    'harvest': ['requests', 'langdetect'],
+    'monitor': ['requests'],
+    'enrich': ['openai'],
+}
+
+
+# Import the libraries of the given stages now (the --dry-run of the scripts
+# uses this to measure the full cold start without processing any rows)
+def preload(*stages):
+    for stage in stages:
+        for module in STAGE_MODULES[stage]:
+            with metrics.span('startup.import', module=module):
+                importlib.import_module(module)
+
+
+# Read total number of rows in the sheet
+def get_total_rows(service, spreadsheet_id, sheet_name, start_row):
+    with metrics.span('sheets.read'):
+        sheet_metadata = service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
+    sheets = sheet_metadata.get('sheets', '')
+    for s in sheets:
+        if s.get("properties", {}).get("title", "") == sheet_name:
+            return s.get("properties", {}).get("gridProperties", {}).get("rowCount", 0)
+    logging.error(f"Sheet '{sheet_name}' not found.")
+    return start_row - 1  # Set total_rows to avoid processing if sheet not found
+
+
+# Raised for links whose content type cannot be turned into text
+class UnsupportedContent(Exception):
+    pass
+
+
+# Incremental HTML parser: fed decoded chunks as they arrive, it keeps the
+# visible text (like BeautifulSoup's get_text(separator=' ', strip=True))
+# up to max_text_length characters plus the attributes of every meta tag
+class PageParser(HTMLParser):
+    SKIP_TAGS = {'script', 'style', 'noscript', 'template'}
+
+    def __init__(self, max_text_length):
+        super().__init__(convert_charrefs=True)
+        self.max_text_length = max_text_length
+        self.pieces = []
+        self.pending = []
+        self.length = 0
+        self.skip_depth = 0
+        self.meta = []
+
+    # True once enough text has been collected; the rest of the page is not needed
+    @property
+    def full(self):
+        return self.length >= self.max_text_length
+
+    # A text node ends at every tag, so strings split across chunks are joined first
+    def flush(self):
+        if not self.pending:
+            return
+        text = ''.join(self.pending).strip()
+        self.pending = []
+        if text and not self.full:
+            self.pieces.append(text)
+            self.length += len(text) + 1
+
+    def handle_starttag(self, tag, attrs):
+        self.flush()
+        if tag in self.SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag == 'meta':
+            self.meta.append(dict(attrs))
+
+    def handle_startendtag(self, tag, attrs):
+        self.flush()
+        if tag == 'meta':
+            self.meta.append(dict(attrs))
+
+    def handle_endtag(self, tag):
+        self.flush()
+        if tag in self.SKIP_TAGS and self.skip_depth:
+            self.skip_depth -= 1
+
+    def handle_data(self, data):
+        if not self.skip_depth and not self.full:
+            self.pending.append(data)
+
+    def handle_comment(self, data):
+        self.flush()
+
+    def text(self):
+        self.flush()
+        return ' '.join(self.pieces)[:self.max_text_length]
+
+
+# Function to identify country from webpage metadata
+def get_country_from_metadata(meta_attrs):
+    # Attempt to find country in meta tags
+    country = 'Unknown'  # Default value
+    # List of possible meta tag attributes that might contain country information
+    meta_tags = [
+        {'name': 'geo.country'},
+        {'property': 'og:country-name'},
+        {'name': 'country'},
+        {'name': 'dcterms.coverage'},
+        {'name': 'ICBM'},
+        {'name': 'geo.position'},
+        {'name': 'geo.placename'},
+    ]
+    for tag_attrs in meta_tags:
+        (key, value), = tag_attrs.items()
+        meta = next((attrs for attrs in meta_attrs if attrs.get(key) == value), None)
+        if meta and 'content' in meta:
+            country = (meta['content'] or '').strip()
+            break
+    return country
+
+
+# Detect language using langdetect
+def detect_language(text):
+    if not text.strip():
+        return 'unknown'
+    from langdetect import detect
+    from langdetect.lang_detect_exception import LangDetectException
+    try:
+        return detect(text)
+    except LangDetectException:
+        return 'unknown'
+
+
+# Ensure the URL has a scheme
+def normalize_url(url):
+    parsed_url = urlparse(url)
+    if not parsed_url.scheme:
+        url = 'http://' + url
+    return url
+
+
+# Character set of a page body: a <meta charset> near the top, or UTF-8
+def sniff_encoding(data):
+    match = re.search(rb'<meta[^>]+charset=["\']?([\w.:-]+)', data[:4096], re.IGNORECASE)
+    encoding = match.group(1).decode('ascii') if match else 'utf-8'
+    try:
+        return codecs.lookup(encoding).name
+    except LookupError:
+        return 'utf-8'
+
+
+# Read a response body chunk by chunk, up to max_bytes. Web pages are cut at
+# the cap (the text is truncated anyway); files that must be complete to be
+# parsed, like PDFs, are rejected instead
+def read_body(response, max_bytes, truncate=True):
+    if not truncate and int(response.headers.get('Content-Length') or 0) > max_bytes:
+        raise UnsupportedContent(f"file larger than {max_bytes} bytes")
+    body = bytearray()
+    with metrics.span('download.body'):
+        for chunk in response.iter_content(CHUNK_SIZE):
+            body += chunk
+            if len(body) >= max_bytes:
+                if not truncate:
+                    raise UnsupportedContent(f"file larger than {max_bytes} bytes")
+                metrics.count('truncated_pages')
+                del body[max_bytes:]
+                break
+    metrics.count('bytes_fetched', len(body))
+    return bytes(body)
+
+
+# Bytes of a web page worth downloading for max_text_length characters
+def html_byte_cap(max_text_length=None):
+    if not max_text_length or not BYTES_PER_TEXT_CHAR:
+        return MAX_DOWNLOAD_BYTES
+    return min(MAX_DOWNLOAD_BYTES, max_text_length * BYTES_PER_TEXT_CHAR)
+
+
+# Download a link and return its raw body; the content type is checked
+# before the body is read, so binary files are never downloaded. With
+# max_text_length web pages are cut at html_byte_cap
+def fetch_page(url, timeout=10, max_text_length=None):
+    # Fetch the webpage headers first; the body is streamed below. timeout
+    # is the upper bound, hosts.get lowers it for hosts known to be fast
+    with metrics.span('download'):
+        response = hosts.get(url, HEADERS, timeout)
+
+    try:
+        response.raise_for_status()
+        content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_type in PDF_TYPES:
+            data = read_body(response, MAX_PDF_BYTES, truncate=False)
+        elif content_type in HTML_TYPES:
+            data = read_body(response, html_byte_cap(max_text_length))
+        else:
+            raise UnsupportedContent(content_type)
+        has_charset = 'charset=' in response.headers.get('Content-Type', '').lower()
+        encoding = response.encoding if has_charset else None
+    finally:
+        response.close()
+
+    page = Page(url, content_type, encoding, data)
+    archive.store(page)
+    return page
+
+
+# Feed a page body to the incremental parser chunk by chunk, stopping as soon
+# as enough text has been collected
+def parse_html(data, encoding, max_text_length, parser_class=PageParser):
+    try:
+        encoding = codecs.lookup(encoding).name if encoding else sniff_encoding(data)
+    except LookupError:
+        encoding = sniff_encoding(data)
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    parser = parser_class(max_text_length)
+    view = memoryview(data)
+    for offset in range(0, len(data), CHUNK_SIZE):
+        parser.feed(decoder.decode(view[offset:offset + CHUNK_SIZE]))
+        if parser.full:
+            break
+    else:
+        parser.feed(decoder.decode(b'', final=True))
+    parser.close()
+    return parser
+
+
+# Extract the text of a PDF with pypdf (optional dependency)
+def extract_pdf_text(data, max_text_length):
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise UnsupportedContent('application/pdf (install pypdf to extract PDF text)')
+    pieces = []
+    length = 0
+    for page in PdfReader(io.BytesIO(data)).pages:
+        text = ' '.join((page.extract_text() or '').split())
+        if text:
+            pieces.append(text)
+            length += len(text) + 1
+        if length >= max_text_length:
+            break
+    return ' '.join(pieces)[:max_text_length]
+
+
+# Turn a fetched page into [language, country, text] for columns H to J.
+# CPU-bound, so scrape_pool.ScrapeStage runs it in worker processes
+def extract_page(page, max_text_length=25000, extractor=None):
+    page_size = len(page.data)
+    if page.content_type in PDF_TYPES:
+        with metrics.span('pdf'), profiling.stage('pdf', page_size):
+            text_to_store = extract_pdf_text(page.data, max_text_length)
+        country = 'Unknown'
+    else:
+        with metrics.span('parse'), profiling.stage('parse', page_size):
+            parser_class = MainContentParser if (extractor or EXTRACTOR) == 'main' else PageParser
+            parser = parse_html(page.data, page.encoding, max_text_length, parser_class)
+        with metrics.span('get_text'), profiling.stage('get_text', page_size):
+            text_to_store = parser.text()
+        # Identify country from metadata
+        with metrics.span('country'), profiling.stage('country', page_size):
+            country = get_country_from_metadata(parser.meta)
+
+    with metrics.span('langdetect'), profiling.stage('langdetect', page_size):
+        language = detect_language(text_to_store)
+
+    return [language, country, text_to_store]
+
+
+# Fetch a webpage and return [language, country, text] for columns H to J
+def scrape_url(url, max_text_length=25000, timeout=10):
+    return extract_page(fetch_page(url, timeout, max_text_length), max_text_length)
+
+
+# Scrape a list of URLs in order, through a ScrapeStage when one is given or
+# one by one in this process. With a shared_cache.SharedCache only the URLs
+# it does not hold are fetched. Failed URLs get their exception as result
+def scrape_urls(urls, max_text_length, stage=None, cache=None):
+    if cache is not None:
+        return cache.scrape(urls, max_text_length, lambda missing: scrape_urls(missing, max_text_length, stage))
+    if stage is not None:
+        return stage.scrape(urls, max_text_length)
+    results = []
+    for url in urls:
+        try:
+            results.append(scrape_url(url, max_text_length))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+# Turn a scrape result into the values for columns H to J, logging failures
+def scraped_values(stage_name, actual_row, url, result):
+    if not isinstance(result, Exception):
+        metrics.count('rows', stage=stage_name)
+        return result
+    metrics.count_error(stage_name, result)
+    if isinstance(result, UnsupportedContent):
+        logging.info(f"Skipping unsupported content for URL {url}: {result}")
+        return [UNSUPPORTED, UNSUPPORTED, UNSUPPORTED]
+    import requests
+    if isinstance(result, requests.exceptions.RequestException):
+        logging.error(f"HTTP error for URL {url}: {result}")
+    else:
+        logging.error(f"Error processing row {actual_row}: {result}")
+    return ['Error', 'Error', 'Error']
+
+
+# Scrape one batch of URLs from column B and write columns H to J, or queue
+# them on a sheets.WriteBackBuffer under key when one is given
+def scrape_batch(service, spreadsheet_id, batch_start, batch_end, sheet_name='Sheet1', max_text_length=25000,
+                 stage=None, buffer=None, key=None, cache=None):
+    # Read data for the current batch (only column B, the URLs)
+    rows = read_rows(service, spreadsheet_id, sheet_name, ('link',), batch_start, batch_end)
+
+    if not rows:
+        logging.info(f"No data found in rows {batch_start} to {batch_end}.")
+        return 0
+
+    linked = [row for row in rows if row.link]
+    urls = [normalize_url(row.link) for row in linked]
+    for row in rows:
+        if not row.link:
+            row.update(SCRAPED, ('No Language', 'No Country', 'No Text'))
+    for row, url, result in zip(linked, urls, scrape_urls(urls, max_text_length, stage, cache)):
+        logging.info(f"Processing row {row.number}")
+        row.update(SCRAPED, scraped_values('scrape', row.number, url, result))
+
+    # Write data back for the current batch
+    if buffer is not None:
+        write_rows(service, spreadsheet_id, sheet_name, rows, SCRAPED, buffer, key)
+        return len(rows)
+
+    try:
+        write_rows(service, spreadsheet_id, sheet_name, rows, SCRAPED)
+        logging.info(f"Batch {batch_start}-{batch_end} processed successfully.")
+    except Exception as e:
+        logging.error(f"Error writing data to spreadsheet for batch {batch_start}-{batch_end}: {e}")
+        metrics.count_error('sheets.write', e)
+
+    return len(rows)
+
+
+# Re-scrape rows of one batch whose text in column J is missing or invalid
+def double_check_batch(service, spreadsheet_id, batch_start, batch_end, sheet_name='Sheet1', max_text_length=10000,
+                       stage=None, buffer=None, key=None):
+    # Read data for the current batch (columns B to J)
+    rows = read_rows(service, spreadsheet_id, sheet_name, ('link', 'text'), batch_start, batch_end)
+
+    if not rows:
+        logging.info(f"No data found in rows {batch_start} to {batch_end}.")
+        return 0
+
+    # Keep track of which rows need to be updated
+    rows_to_update = []
+    for row in rows:
+        if not needs_recheck(row.text):
+            # No action needed for this row
+            continue
+
+        logging.info(f"Reprocessing row {row.number} due to missing or invalid text.")
+        if not row.link:
+            logging.warning(f"No URL found in row {row.number}. Skipping.")
+            continue
+
+        rows_to_update.append(row)
+
+    urls = [normalize_url(row.link) for row in rows_to_update]
+    # These rows are retried because their text was bad, so they are always
+    # fetched again rather than read from a shared cache
+    for row, url, result in zip(rows_to_update, urls, scrape_urls(urls, max_text_length, stage)):
+        row.update(SCRAPED, scraped_values('double-check', row.number, url, result))
+
+    if buffer is not None:
+        write_rows(service, spreadsheet_id, sheet_name, rows_to_update, SCRAPED, buffer, key)
+        return len(rows_to_update)
+
+    # Write updated data back to the spreadsheet for the affected rows
+    row_numbers = [row.number for row in rows_to_update]
+    try:
+        write_rows(service, spreadsheet_id, sheet_name, rows_to_update, SCRAPED)
+        if rows_to_update:
+            logging.info(f"Rows {row_numbers} updated successfully.")
+    except Exception as e:
+        logging.error(f"Error writing data to spreadsheet for rows {row_numbers}: {e}")
+        metrics.count_error('sheets.write', e)
+
+    return len(rows_to_update)
+
+
+# Send a single prompt through the chat completions API and return the reply
+def ask(chat, prompt, max_tokens, temperature, model=DEFAULT_MODEL, task='chat', router=None):
+    with metrics.span(f'openai.{task}'):
+        response = chat(
+            model=model,
+            messages=[
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=max_tokens,
+            temperature=temperature,
+        )
+    usage = response.get('usage') or {}
+    metrics.count('tokens_sent', usage.get('prompt_tokens', 0), task=task)
+    metrics.count('tokens_received', usage.get('completion_tokens', 0), task=task)
+    if router is not None:
+        router.charge(task, model, usage)
+    return response['choices'][0]['message']['content'].strip()
+
+
+# Prompt of every enrichment task; {text} is the scraped text
+PROMPTS = {
+    'language': "Detect the language of the following text:\n\n{text}\n\nLanguage:",
+    'country': "Based on the following text, identify the country of origin of the news or the main country it refers to. If it cannot be determined, respond 'Unknown'. Text:\n\n{text}\n\nCountry:",
+    'summary': "Provide a concise summary, always in English, of the following text:\n\n{text}\n\nSummary:",
+    'tags': "From the following text, assign one or more of these categories: {categories}. For each assigned category, provide a brief justification. Respond in the format:\nCategory: [category1]\nJustification: [reason]\n...\nText:\n\n{text}\n\nCategories and Justifications:",
+    'suggested_tags': "Based on the following text, suggest relevant tags or keywords, always in English, that describe the main topics. Respond with a list of tags separated by commas.\n\nText:\n\n{text}\n\nTags:",
+}
+
+# Most tokens the answer of each task may use
+MAX_ANSWER_TOKENS = {'language': 10, 'country': 20, 'summary': 150, 'tags': 300, 'suggested_tags': 50}
+
+
+def prompt(task, text):
+    return PROMPTS[task].format(text=text, categories=', '.join(categories))
+
+
+# Placeholders written for tasks routed to 'skip'
+SKIPPED_TASKS = {
+    'language': 'unknown',
+    'country': 'Unknown',
+    'summary': 'No Summary',
+    'tags': '',
+    'suggested_tags': 'No Suggested Tags',
+}
+
+# Tasks that can be answered without a model (routing.LOCAL_TASKS lists them)
+LOCAL_TASKS = {
+    'language': detect_language,
+}
+
+
+# Run one enrichment task where the router sends it
+def run_task(chat, router, task, prompt, text, max_tokens, temperature, call_delay):
+    route = router.route(task)
+    if route == 'skip':
+        return SKIPPED_TASKS[task]
+    if route == 'local':
+        with metrics.span(f'local.{task}'):
+            return LOCAL_TASKS[task](text)
+    answer = ask(chat, prompt, max_tokens, temperature, model=route, task=task, router=router)
+    # Add a short delay to avoid rate limits
+    time.sleep(call_delay)
+    return answer
+
+
+# Parse the response for predefined tags and justifications
+def parse_predefined_tags(predefined_tags_justification):
+    predefined_tags = []
+    predefined_justifications = []
+    lines = predefined_tags_justification.split('\n')
+    current_category = ''
+    current_justification = ''
+    for line in lines:
+        if line.startswith('Category:'):
+            current_category = line.replace('Category:', '').strip()
+            predefined_tags.append(current_category)
+        elif line.startswith('Justification:'):
+            current_justification = line.replace('Justification:', '').strip()
+            predefined_justifications.append(f"{current_category}: {current_justification}")
+
+    return ', '.join(predefined_tags), '; '.join(predefined_justifications)
+
+
+# Enrich one row and return the values for columns K to P. Each task goes
+# to the model or local function chosen by the router (see routing.py)
+def enrich_row(chat, language, country, text, call_delay=1, router=None):
+    router = router or default_router()
+
+    # Correct 'unknown' language if necessary
+    if language.lower() == 'unknown' or not language.strip():
+        language = run_task(chat, router, 'language', prompt('language', text), text, MAX_ANSWER_TOKENS['language'], 0,
+                            call_delay)
+
+    # Correct 'unknown' country if necessary
+    if country.lower() == 'unknown' or not country.strip():
+        country = run_task(chat, router, 'country', prompt('country', text), text, MAX_ANSWER_TOKENS['country'], 0,
+                           call_delay)
+
+    # Generate a summary
+    summary = run_task(chat, router, 'summary', prompt('summary', text), text, MAX_ANSWER_TOKENS['summary'], 0.5,
+                       call_delay)
+
+    # Assign predefined tags with justifications
+    predefined_tags_justification = run_task(chat, router, 'tags', prompt('tags', text), text,
+                                             MAX_ANSWER_TOKENS['tags'], 0.5, call_delay)
+
+    predefined_tags_str, predefined_justifications_str = parse_predefined_tags(predefined_tags_justification)
+
+    # Get the model's own suggested tags (without justifications)
+    suggested_tags = run_task(chat, router, 'suggested_tags', prompt('suggested_tags', text), text,
+                              MAX_ANSWER_TOKENS['suggested_tags'], 0.5, call_delay)
+
+    return [language, country, summary, predefined_tags_str, predefined_justifications_str, suggested_tags]
+
+
+# Enrich one row through a shared_cache.SharedCache: rows with the same
+# input are sent to the model once. Answers given under the degraded routes
+# are not cached
+def enrich_cached(cache, chat, language, country, text, call_delay=1, router=None):
+    router = router or default_router()
+    return cache.enrich(enrich_key(language, country, text, router.routes),
+                        lambda: enrich_row(chat, language, country, text, call_delay, router),
+                        store=lambda values: not router.degraded)
+
+
+# Enrich one batch of rows (columns H to J) and write columns K to P. With a
+# results_log.ResultsLog every row is appended to it as soon as it is done
+# and a Flusher writes the sheet; with a sheets.WriteBackBuffer the rows are
+# queued on it under key. With a shared_cache.SharedCache rows enriched
+# before (in any collection) are not sent to the model again
+def enrich_batch(service, chat, spreadsheet_id, batch_start, batch_end, sheet_name='Sheet1', call_delay=1,
+                 buffer=None, key=None, router=None, results=None, cache=None):
+    # Read data for the current batch (columns H to J)
+    rows = read_rows(service, spreadsheet_id, sheet_name, SCRAPED, batch_start, batch_end)
+
+    for index, row in enumerate(rows):
+        # Skip rows where text is empty, 'Error' or not a web page
+        if not row.text or row.text.lower() in ('error', UNSUPPORTED.lower()):
+            logging.info(f"Skipping row {row.number} due to empty or error in text.")
+            row.update(ENRICHED, ('Skipped', 'Skipped', 'No Summary', 'No Tags', 'No Justification', 'No Suggested Tags'))
+        else:
+            logging.info(f"Processing row {row.number}")
+
+            try:
+                if cache is not None:
+                    values = enrich_cached(cache, chat, row.language, row.country, row.text, call_delay, router)
+                else:
+                    values = enrich_row(chat, row.language, row.country, row.text, call_delay, router)
+                row.update(ENRICHED, values)
+                metrics.count('rows', stage='enrich')
+            except BudgetExceeded:
+                # Write the rows finished so far (queued work is dropped whole
+                # by the caller) and leave the rest for the next run
+                if buffer is None and results is None:
+                    write_rows(service, spreadsheet_id, sheet_name, rows[:index], ENRICHED)
+                raise
+            except Exception as e:
+                logging.error(f"Error processing row {row.number}: {e}")
+                metrics.count_error('enrich', e)
+                row.update(ENRICHED, (row.language, row.country, 'Error', 'Error', 'Error', 'Error'))
+
+        if results is not None:
+            results.append(sheet_name, row, ENRICHED)
+
+    if results is not None:
+        return len(rows)
+
+    # Write data back for the current batch
+    if buffer is not None:
+        write_rows(service, spreadsheet_id, sheet_name, rows, ENRICHED, buffer, key)
+        return len(rows)
+
+    try:
+        write_rows(service, spreadsheet_id, sheet_name, rows, ENRICHED)
+        logging.info(f"Batch {batch_start}-{batch_end} processed successfully.")
+    except Exception as e:
+        logging.error(f"Error writing data to spreadsheet for batch {batch_start}-{batch_end}: {e}")
+        metrics.count_error('sheets.write', e)
+
+    return len(rows)
@@ -0,0 +1,229 @@
+import math
+import os
+from urllib.parse import urlparse
+
+import hosts
+import tuning
+from fingerprints import STATE_DB, FingerprintStore, url_hash
+from pipeline import MAX_ANSWER_TOKENS, UNSUPPORTED, needs_recheck, normalize_url, prompt
+from results_log import RESULTS_LOG, pending_rows
+from routing import cost, count_tokens, default_router
+from rows import read_rows
+from shared_cache import enrich_key
+
+# Run planner (the --plan option of the scripts): estimates what a run over
+# a range of rows would do before it is started. It reads only the columns
+# the stage reads, in large chunks, and looks at what earlier runs left
+# behind instead of calling any upstream:
+#
+# - tuning.json: the batch size, concurrency and delays the run starts with,
+#   and the latency it last measured per download or chat call;
+# - host-stats.json: the usual download time of every host;
+# - the fingerprint table (STATE_DB): rows already scraped or enriched at
+#   their current link, which script-ingest-changes.py would skip;
+# - the results log: enrichment rows finished but not yet written to the
+#   sheet;
+# - the shared cache (script-collections.py): links and texts done before.
+#
+# Tokens are counted locally on the stored text (see routing.count_tokens).
+# Answers are counted at their MAX_ANSWER_TOKENS, so token counts and cost
+# are upper bounds. Wall time is the larger of the time the calls take one
+# after another at the tuned delays and the time OPENAI_RPM and OPENAI_TPM
+# allow for them.
+
+PLAN_READ_ROWS = 5000  # Rows per Sheets read while planning
+DEFAULT_FETCH_SECONDS = 1.5  # Download time of a host and stage without measurements
+DEFAULT_CALL_SECONDS = 2.0  # Chat call time before tuning.json has a measured latency
+SHEETS_CALL_SECONDS = 0.5  # One Sheets read or write
+SHEETS_REQUESTS_PER_MINUTE = 60  # Sheets API quota per user
+OPENAI_RPM = int(os.getenv('OPENAI_RPM', 0))  # Requests per minute of the API key; 0: not limited
+OPENAI_TPM = int(os.getenv('OPENAI_TPM', 0))  # Tokens per minute of the API key; 0: not limited
+
+
+# Rows start..end read PLAN_READ_ROWS at a time
+def read_range(service, spreadsheet_id, sheet_name, fields, start_row, end_row):
+    for chunk_start in range(start_row, end_row + 1, PLAN_READ_ROWS):
+        chunk_end = min(chunk_start + PLAN_READ_ROWS - 1, end_row)
+        yield from read_rows(service, spreadsheet_id, sheet_name, fields, chunk_start, chunk_end)
+
+
+# {row: (url_hash, scraped_revision, enriched_revision)}, without creating STATE_DB
+def load_fingerprints(path=STATE_DB):
+    if not os.path.exists(path):
+        return {}
+    store = FingerprintStore(path)
+    try:
+        return store.load()
+    finally:
+        store.close()
+
+
+# Seconds spent on batches other than the upstream calls: a Sheets read and
+# write per batch and the pause between batches
+def batch_overhead(rows, tuner):
+    batches = math.ceil(rows / tuner.get('batch_size')) if rows > 0 else 0
+    seconds = batches * 2 * SHEETS_CALL_SECONDS + max(0, batches - 1) * tuner.get('batch_delay')
+    # The Sheets quota caps the batches per minute however fast they are
+    return batches, max(seconds, batches * 2 * 60 / SHEETS_REQUESTS_PER_MINUTE)
+
+
+# Plan of a scrape ('scrape', script-1-batch.py) or double-check
+# ('double-check', script-1-double-check.py) run over rows start..end
+def plan_scrape(service, spreadsheet_id, sheet_name, start_row, end_row, stage='scrape', max_text_length=25000,
+                cache=None, pinned=None):
+    fields = ('link',) if stage == 'scrape' else ('link', 'text')
+    fingerprints = load_fingerprints()
+    host_stats = hosts.load()
+    tuner = tuning.Controller(stage, pinned=pinned)
+    fallback = tuner.best_latency or DEFAULT_FETCH_SECONDS
+
+    plan = {'stage': stage, 'rows': 0, 'no_link': 0, 'fetch': 0, 'retry': 0, 'valid': 0, 'cached': 0,
+            'already_scraped': 0, 'fetch_seconds': 0.0}
+    for row in read_range(service, spreadsheet_id, sheet_name, fields, start_row, end_row):
+        plan['rows'] += 1
+        if stage == 'double-check' and not needs_recheck(row.text):
+            plan['valid'] += 1
+            continue
+        if not row.link:
+            plan['no_link'] += 1
+            continue
+        if stage == 'scrape':
+            saved = fingerprints.get(row.number)
+            if saved and saved[0] == url_hash(row.link) and saved[1] is not None:
+                plan['already_scraped'] += 1
+        url = normalize_url(row.link)
+        if stage == 'scrape' and cache is not None and cache.has('scraped', url, max_text_length):
+            plan['cached'] += 1
+            continue
+        plan['fetch' if stage == 'scrape' else 'retry'] += 1
+        stats = host_stats.get(urlparse(url).hostname or '')
+        if stats is not None and len(stats.latencies) >= hosts.MIN_SAMPLES:
+            plan['fetch_seconds'] += stats.percentile(0.5)
+        else:
+            plan['fetch_seconds'] += fallback
+
+    plan['batches'], overhead = batch_overhead(end_row - start_row + 1, tuner)
+    parallel = max(1, min(tuner.get('concurrency'), tuner.get('batch_size')))
+    plan['settings'] = dict(tuner.values)
+    plan['api_calls'] = {'fetch': plan['fetch'] + plan['retry'],
+                         'sheets': plan['batches'] * 2}
+    plan['wall_seconds'] = plan['fetch_seconds'] / parallel + overhead
+    return plan
+
+
+# Plan of an enrichment run (script-2-batch.py) over rows start..end
+def plan_enrich(service, spreadsheet_id, sheet_name, start_row, end_row, router=None, cache=None,
+                results_log=RESULTS_LOG):
+    router = router or default_router()
+    routes = router.routes
+    fingerprints = load_fingerprints()
+    pending = pending_rows(results_log)
+    tuner = tuning.Controller('enrich')
+    call_seconds = tuner.best_latency or DEFAULT_CALL_SECONDS
+    # Tokens of each prompt without the text, per task and model
+    overheads = {}
+
+    plan = {'stage': 'enrich', 'rows': 0, 'skip': 0, 'enrich': 0, 'cached': 0, 'already_enriched': 0,
+            'pending_in_log': 0, 'calls': {}, 'local_calls': 0, 'prompt_tokens': {}, 'completion_tokens': {},
+            'call_seconds': 0.0}
+    for row in read_range(service, spreadsheet_id, sheet_name, ('language', 'country', 'text', 'summary'),
+                          start_row, end_row):
+        plan['rows'] += 1
+        # The same rows enrich_batch skips
+        if not row.text or row.text.lower() in ('error', UNSUPPORTED.lower()):
+            plan['skip'] += 1
+            continue
+        if (sheet_name, row.number) in pending:
+            plan['pending_in_log'] += 1
+        saved = fingerprints.get(row.number)
+        if (saved and saved[2] is not None) or (row.summary and row.summary not in ('Error', 'No Summary')):
+            plan['already_enriched'] += 1
+        if cache is not None and cache.has('enriched', enrich_key(row.language, row.country, row.text, routes)):
+            plan['cached'] += 1
+            continue
+        plan['enrich'] += 1
+
+        tasks = ['summary', 'tags', 'suggested_tags']
+        if row.country.lower() == 'unknown' or not row.country.strip():
+            tasks.insert(0, 'country')
+        if row.language.lower() == 'unknown' or not row.language.strip():
+            tasks.insert(0, 'language')
+        text_tokens = {}
+        for task in tasks:
+            model = routes[task]
+            if model == 'skip':
+                continue
+            if model == 'local':
+                plan['local_calls'] += 1
+                continue
+            if model not in text_tokens:
+                text_tokens[model] = count_tokens(row.text, model)
+            if (task, model) not in overheads:
+                overheads[(task, model)] = count_tokens(prompt(task, ''), model)
+            plan['calls'][model] = plan['calls'].get(model, 0) + 1
+            plan['prompt_tokens'][model] = plan['prompt_tokens'].get(model, 0) + \
+                text_tokens[model] + overheads[(task, model)]
+            plan['completion_tokens'][model] = plan['completion_tokens'].get(model, 0) + MAX_ANSWER_TOKENS[task]
+            plan['call_seconds'] += call_seconds + tuner.get('call_delay')
+
+    calls = sum(plan['calls'].values())
+    tokens = sum(plan['prompt_tokens'].values()) + sum(plan['completion_tokens'].values())
+    plan['cost_usd'] = sum(cost(model, {'prompt_tokens': plan['prompt_tokens'][model],
+                                        'completion_tokens': plan['completion_tokens'][model]})
+                           for model in plan['calls'])
+    plan['budget_usd'] = router.budget
+    plan['batches'], overhead = batch_overhead(end_row - start_row + 1, tuner)
+    plan['settings'] = dict(tuner.values)
+    plan['api_calls'] = {'chat': calls, 'sheets': plan['batches']}
+    # The flusher writes the results log in the background, so only reads hold up the batches
+    sequential = plan['call_seconds'] + overhead / 2
+    limits = [sequential]
+    if OPENAI_RPM:
+        limits.append(calls / OPENAI_RPM * 60)
+    if OPENAI_TPM:
+        limits.append(tokens / OPENAI_TPM * 60)
+    plan['wall_seconds'] = max(limits)
+    plan['rate_limited'] = plan['wall_seconds'] > sequential
+    return plan
+
+
+def format_duration(seconds):
+    if seconds < 60:
+        return f'{seconds:.0f}s'
+    if seconds < 3600:
+        return f'{seconds / 60:.1f} min'
+    return f'{seconds / 3600:.1f} h'
+
+
+def print_plan(plan, start_row, end_row, elapsed=None):
+    print(f"Plan for {plan['stage']}, rows {start_row} to {end_row} ({plan['rows']} with data, "
+          f"{plan['batches']} batches with {plan['settings']})")
+    if plan['stage'] == 'enrich':
+        print(f"  enrich {plan['enrich']} rows, skip {plan['skip']} without usable text, "
+              f"{plan['cached']} from the shared cache")
+        if plan['already_enriched']:
+            print(f"  {plan['already_enriched']} of them were enriched before and are redone "
+                  f"(script-ingest-changes.py would skip them)")
+        if plan['pending_in_log']:
+            print(f"  {plan['pending_in_log']} finished rows are waiting in the results log and are written first")
+        for model, calls in sorted(plan['calls'].items()):
+            print(f"  {model}: {calls} calls, {plan['prompt_tokens'][model]:,} prompt tokens, "
+                  f"at most {plan['completion_tokens'][model]:,} answer tokens")
+        if plan['local_calls']:
+            print(f"  {plan['local_calls']} tasks answered locally")
+        budget = f" (budget ${plan['budget_usd']:.2f})" if plan['budget_usd'] else ''
+        print(f"  cost: at most ${plan['cost_usd']:.2f}{budget}")
+        if plan['budget_usd'] and plan['cost_usd'] > plan['budget_usd']:
+            print("  the budget runs out before the end: later rows use the degraded routes or are left for later")
+    else:
+        action = 'fetch' if plan['stage'] == 'scrape' else 'retry'
+        print(f"  {action} {plan[action]} rows, {plan['no_link']} without a link, {plan['cached']} from the shared cache"
+              + (f", {plan['valid']} with valid text" if plan['stage'] == 'double-check' else ''))
+        if plan['already_scraped']:
+            print(f"  {plan['already_scraped']} rows were scraped before at the same link and are fetched again "
+                  f"(script-ingest-changes.py would skip them)")
+    calls = ', '.join(f'{count} {kind}' for kind, count in plan['api_calls'].items())
+    limited = ' (held back by OPENAI_RPM/OPENAI_TPM)' if plan.get('rate_limited') else ''
+    print(f"  API calls: {calls}; estimated wall time {format_duration(plan['wall_seconds'])}{limited}")
+    if elapsed is not None:
+        print(f"Planned in {elapsed:.1f}s; nothing was fetched, sent or written.")
@@ -0,0 +1,117 @@
+import logging
+import os
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+# Sampling profiler for the extraction hot path (HTML parsing, get_text,
+# langdetect, country lookup). While a thread is inside profiling.stage(),
+# its stack is sampled every few milliseconds and tagged with the stage name
+# and the page-size bucket. The output is a collapsed-stack file that
+# flamegraph.pl, speedscope or inferno can render directly:
+#
+#   parse;1-5MB;pipeline.py:extract_page;pipeline.py:parse_html;html/parser.py:feed;html/parser.py:goahead;... 42
+#
+# Only code inside a stage is sampled, so network waits do not show up.
+
+# Upper bounds (bytes) of the page-size buckets
+SIZE_BUCKETS = [
+    (100 * 1024, '<100KB'),
+    (1024 * 1024, '100KB-1MB'),
+    (5 * 1024 * 1024, '1-5MB'),
+]
+
+_profiler = None
+
+
+# Name of the page-size bucket a page of the given size falls into
+def size_bucket(size):
+    for limit, name in SIZE_BUCKETS:
+        if size < limit:
+            return name
+    return '>5MB'
+
+
+class SamplingProfiler:
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.labels = {}  # thread id -> (stage, bucket)
+        self.samples = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id, labels in list(self.labels.items()):
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self.samples[labels + (self.collapse(frame),)] += 1
+
+    # Turn a frame into 'file:function;file:function' from the outermost call inwards
+    @staticmethod
+    def collapse(frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            path = code.co_filename
+            # Keep the package directory so library frames stay recognisable
+            name = os.path.join(os.path.basename(os.path.dirname(path)), os.path.basename(path))
+            stack.append(f'{name}:{code.co_name}')
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for (stage, bucket, stack), count in sorted(self.samples.items()):
+                f.write(f'{stage};{bucket};{stack} {count}\n')
+
+    # Samples per stage and bucket, for a quick look without a flamegraph
+    def totals(self):
+        totals = Counter()
+        for (stage, bucket, _), count in self.samples.items():
+            totals[(stage, bucket)] += count
+        return totals
+
+
+# Start sampling; returns the profiler so callers can inspect it
+def start(interval=0.005):
+    global _profiler
+    _profiler = SamplingProfiler(interval)
+    _profiler.thread.start()
+    return _profiler
+
+
+# Stop sampling and write the collapsed stacks to path
+def stop(path):
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is None:
+        return
+    profiler.stopped.set()
+    profiler.thread.join()
+    profiler.write(path)
+    interval_ms = profiler.interval * 1000
+    for (stage, bucket), count in sorted(profiler.totals().items()):
+        logging.info(f"Profile {stage:<12} {bucket:<10} ~{count * interval_ms / 1000:.1f} s")
+    logging.info(f"Collapsed stacks written to {path}")
+
+
+# Tag the enclosed block with a stage and page size; a no-op unless profiling
+@contextmanager
+def stage(name, page_size):
+    profiler = _profiler
+    if profiler is None:
+        yield
+        return
+    thread_id = threading.get_ident()
+    previous = profiler.labels.get(thread_id)
+    profiler.labels[thread_id] = (name, size_bucket(page_size))
+    try:
+        yield
+    finally:
+        if previous is None:
+            profiler.labels.pop(thread_id, None)
+        else:
+            profiler.labels[thread_id] = previous
@@ -0,0 +1,140 @@
+import json
+import logging
+import os
+import threading
+import time
+
+import metrics
+from rows import Row, write_rows
+from sheets import WriteBackBuffer
+
+# Append-only log of finished enrichment rows. enrich_batch appends every
+# row as soon as its calls are done, and a Flusher copies new log lines to
+# the sheet in one batchUpdate every FLUSH_SECONDS. A failed row, a failed
+# write or a crash therefore loses no finished work: the next flush (or
+# script-flush-results.py) writes whatever is in the log.
+#
+# The flusher keeps its position in <log>.offset and only moves it after a
+# successful write, so lines are written at least once; rewriting a row
+# with the same values is harmless.
+
+RESULTS_LOG = os.getenv('RESULTS_LOG', 'enrich-results.jsonl')
+FLUSH_SECONDS = int(os.getenv('RESULTS_FLUSH_SECONDS', 30))
+
+
+class ResultsLog:
+    def __init__(self, path=RESULTS_LOG):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, 'a', encoding='utf-8')
+
+    # Record the given fields of a finished row
+    def append(self, sheet_name, row, fields):
+        line = json.dumps({'sheet': sheet_name, 'row': row.number, 'fields': list(fields),
+                           'values': [getattr(row, field) for field in fields], 'ts': round(time.time(), 3)})
+        with self.lock:
+            self.file.write(line + '\n')
+            self.file.flush()
+        metrics.count('results_logged')
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+# (sheet, row) of the rows in the log that no flush has written yet
+def pending_rows(path=RESULTS_LOG):
+    try:
+        with open(path + '.offset') as f:
+            offset = int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        offset = 0
+    try:
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return set()
+    lines = data[:data.rfind(b'\n') + 1].splitlines()
+    return {(entry['sheet'], entry['row']) for entry in map(json.loads, lines)}
+
+
+class Flusher:
+    def __init__(self, service, spreadsheet_id, path=RESULTS_LOG, interval=FLUSH_SECONDS):
+        self.service = service
+        self.spreadsheet_id = spreadsheet_id
+        self.path = path
+        self.offset_path = path + '.offset'
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def _offset(self):
+        try:
+            with open(self.offset_path) as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _save_offset(self, offset):
+        tmp_path = self.offset_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(str(offset))
+        os.replace(tmp_path, self.offset_path)
+
+    # Write the log lines added since the last flush; returns the number of rows
+    def flush(self):
+        with self.lock:
+            offset = self._offset()
+            try:
+                with open(self.path, 'rb') as f:
+                    f.seek(offset)
+                    data = f.read()
+            except FileNotFoundError:
+                return 0
+            # A line still being written has no newline yet; leave it for next time
+            end = data.rfind(b'\n') + 1
+            if end == 0:
+                return 0
+
+            # Latest values per sheet, row and set of fields
+            latest = {}
+            for line in data[:end].splitlines():
+                entry = json.loads(line)
+                latest[(entry['sheet'], entry['row'], tuple(entry['fields']))] = entry['values']
+
+            buffer = WriteBackBuffer(self.service, self.spreadsheet_id)
+            groups = {}
+            for (sheet_name, number, fields), values in sorted(latest.items()):
+                row = Row(number)
+                row.update(fields, values)
+                groups.setdefault((sheet_name, fields), []).append(row)
+            for (sheet_name, fields), rows in groups.items():
+                write_rows(self.service, self.spreadsheet_id, sheet_name, rows, fields, buffer)
+            buffer.flush()
+
+            self._save_offset(offset + end)
+            metrics.count('results_flushed', len(latest))
+            return len(latest)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                # The lines stay in the log and are retried on the next flush
+                logging.error(f"Error flushing results to the spreadsheet: {e}")
+                metrics.count_error('results.flush', e)
+
+    # Flush in a background thread every interval seconds
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # Stop the background thread and write what is left
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        return self.flush()
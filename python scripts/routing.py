@@ -0,0 +1,142 @@
+import logging
+import os
+import threading
+from functools import lru_cache
+
+import metrics
+
+# Routing of the enrichment tasks (pipeline.enrich_row) and the run budget.
+# Every task goes to a chat model, to a local function ('local', e.g.
+# langdetect for the language) or is skipped ('skip', a placeholder is
+# written). Routes are set with ENRICH_ROUTES:
+#
+#   ENRICH_ROUTES="country=skip,summary=gpt-4o-mini" python script-2-batch.py
+#
+# The cost of every call is counted per task and model (cost_usd in the run
+# summary). With ENRICH_BUDGET_USD set, the run degrades to
+# DEGRADED_ROUTES once DEGRADE_AT of the budget is spent and stops with
+# BudgetExceeded when all of it is spent.
+
+DEFAULT_MODEL = 'gpt-3.5-turbo'
+TASKS = ('language', 'country', 'summary', 'tags', 'suggested_tags')
+
+# Tasks pipeline.LOCAL_TASKS can answer without a model
+LOCAL_TASKS = ('language',)
+
+# The language task only runs for rows where langdetect already returned
+# 'unknown' while scraping, so routing it to 'local' (langdetect again)
+# would only repeat that answer; the model is the one that can correct it
+DEFAULT_ROUTES = {
+    'language': DEFAULT_MODEL,
+    'country': DEFAULT_MODEL,
+    'summary': DEFAULT_MODEL,
+    'tags': DEFAULT_MODEL,
+    'suggested_tags': DEFAULT_MODEL,
+}
+
+# Near the end of the budget only the summary and the predefined tags keep
+# going to a model
+DEFAULT_DEGRADED_ROUTES = {
+    'language': 'skip',
+    'country': 'skip',
+    'suggested_tags': 'skip',
+}
+
+# USD per 1000 prompt and completion tokens; update when the pricing changes
+PRICES = {
+    'gpt-3.5-turbo': (0.0005, 0.0015),
+    'gpt-4o-mini': (0.00015, 0.0006),
+    'gpt-4o': (0.0025, 0.01),
+}
+
+BUDGET_USD = float(os.getenv('ENRICH_BUDGET_USD', 0))  # 0: no budget
+DEGRADE_AT = float(os.getenv('ENRICH_DEGRADE_AT', 0.8))
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+# "task=target,task=target" -> {task: target}
+def parse_routes(text):
+    routes = {}
+    for item in filter(None, (part.strip() for part in text.split(','))):
+        task, _, target = item.partition('=')
+        if task not in TASKS or not target:
+            raise ValueError(f"Invalid route {item!r}; expected one of {TASKS} = model, local or skip")
+        if target == 'local' and task not in LOCAL_TASKS:
+            raise ValueError(f"Invalid route {item!r}; only {', '.join(LOCAL_TASKS)} can be answered locally")
+        routes[task] = target
+    return routes
+
+
+def cost(model, usage):
+    prompt_price, completion_price = PRICES.get(model, PRICES[DEFAULT_MODEL])
+    return (usage.get('prompt_tokens', 0) * prompt_price + usage.get('completion_tokens', 0) * completion_price) / 1000
+
+
+# The tiktoken encoder of a model, or None without tiktoken. tiktoken is
+# imported here rather than with the module so that scripts which never
+# count tokens don't pay for loading it; the encoder is built once per model
+@lru_cache(maxsize=None)
+def _encoding(model):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding('cl100k_base')
+
+
+# Tokens of a text for a model, counted locally: with tiktoken when it is
+# installed, otherwise estimated at four characters per token
+def count_tokens(text, model=DEFAULT_MODEL):
+    encoding = _encoding(model)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+class Router:
+    def __init__(self, routes=None, budget=BUDGET_USD, degraded_routes=None, degrade_at=DEGRADE_AT):
+        self.routes = {**DEFAULT_ROUTES, **(routes or {})}
+        self.degraded_routes = {**self.routes, **DEFAULT_DEGRADED_ROUTES, **(degraded_routes or {})}
+        self.budget = budget
+        self.degrade_at = degrade_at
+        self.spent = 0.0
+        self.lock = threading.Lock()
+        self.degraded = False
+
+    # Where the next call of a task goes: a model name, 'local' or 'skip'
+    def route(self, task):
+        with self.lock:
+            if self.budget:
+                if self.spent >= self.budget:
+                    raise BudgetExceeded(f"Spent ${self.spent:.4f} of the ${self.budget:.2f} budget")
+                if not self.degraded and self.spent >= self.degrade_at * self.budget:
+                    self.degraded = True
+                    logging.warning(f"Spent ${self.spent:.4f} of the ${self.budget:.2f} budget; "
+                                    f"switching to {self.degraded_routes}.")
+            routes = self.degraded_routes if self.degraded else self.routes
+        return routes[task]
+
+    # Record the usage of one model call
+    def charge(self, task, model, usage):
+        amount = cost(model, usage)
+        with self.lock:
+            self.spent += amount
+        metrics.count('cost_usd', amount, task=task, model=model)
+
+
+_default = None
+
+
+# Router configured from the environment, shared by the whole run
+def default_router():
+    global _default
+    if _default is None:
+        _default = Router(parse_routes(os.getenv('ENRICH_ROUTES', '')),
+                          degraded_routes=parse_routes(os.getenv('ENRICH_DEGRADED_ROUTES', '')))
+    return _default
@@ -0,0 +1,158 @@
+from dataclasses import dataclass
+
+import metrics
+
+# Row model shared by all stages. A Row holds the cells of one sheet row by
+# field name; COLUMNS maps the fields to their column letters, and the
+# functions below are the only place that turns Sheets ranges into Rows and
+# Rows back into ranges. Rows use __slots__, so a batch keeps one small
+# object per row and the cell strings are shared with the API response.
+
+COLUMNS = {
+    'date': 'A',  # Date the link was added
+    'link': 'B',
+    # Scrape (script-1-batch.py, script-1-double-check.py)
+    'language': 'H',
+    'country': 'I',
+    'text': 'J',
+    # Enrichment (script-2-batch.py)
+    'ai_language': 'K',
+    'ai_country': 'L',
+    'summary': 'M',
+    'tags': 'N',
+    'justifications': 'O',
+    'suggested_tags': 'P',
+}
+
+SCRAPED = ('language', 'country', 'text')
+ENRICHED = ('ai_language', 'ai_country', 'summary', 'tags', 'justifications', 'suggested_tags')
+
+
+@dataclass(slots=True)
+class Row:
+    number: int  # Row number in the sheet
+    date: str = ''
+    link: str = ''
+    language: str = ''
+    country: str = ''
+    text: str = ''
+    ai_language: str = ''
+    ai_country: str = ''
+    summary: str = ''
+    tags: str = ''
+    justifications: str = ''
+    suggested_tags: str = ''
+
+    def update(self, fields, values):
+        for field, value in zip(fields, values):
+            setattr(self, field, value)
+
+
+# Check if text is 'Error', 'unknown', or empty
+def needs_recheck(text):
+    return text.lower() in ['error', 'unknown', ''] or not text.strip()
+
+
+def _column_number(field):
+    return ord(COLUMNS[field]) - ord('A')
+
+
+# A1 range covering the columns of the given fields for rows start..end
+def sheet_range(sheet_name, fields, start_row, end_row):
+    columns = sorted(COLUMNS[field] for field in fields)
+    return f'{sheet_name}!{columns[0]}{start_row}:{columns[-1]}{end_row}'
+
+
+# The fields split into runs of adjacent columns, in column order
+def column_runs(fields):
+    runs = []
+    for field in sorted(set(fields), key=_column_number):
+        if runs and _column_number(field) == _column_number(runs[-1][-1]) + 1:
+            runs[-1].append(field)
+        else:
+            runs.append([field])
+    return runs
+
+
+# Read the given fields of rows start..end; the sheet returns nothing for
+# trailing empty rows, so the list can be shorter than the range. Fields in
+# one run of adjacent columns are read with one range; otherwise every run
+# is its own range of a batchGet, so the columns between them (the page
+# text above all) are not downloaded
+def read_rows(service, spreadsheet_id, sheet_name, fields, start_row, end_row):
+    runs = column_runs(fields)
+    with metrics.span('sheets.read'):
+        if len(runs) == 1:
+            result = service.spreadsheets().values().get(
+                spreadsheetId=spreadsheet_id,
+                range=sheet_range(sheet_name, runs[0], start_row, end_row)
+            ).execute()
+            value_ranges = [result]
+        else:
+            result = service.spreadsheets().values().batchGet(
+                spreadsheetId=spreadsheet_id,
+                ranges=[sheet_range(sheet_name, run, start_row, end_row) for run in runs]
+            ).execute()
+            value_ranges = result.get('valueRanges', [])
+
+    rows = []
+    for run, value_range in zip(runs, value_ranges):
+        for index, values in enumerate(value_range.get('values', [])):
+            if index == len(rows):
+                rows.append(Row(start_row + index))
+            rows[index].update(run, values)
+    return rows
+
+
+# Turn rows into (range, values) pairs for the given fields, one pair per run
+# of consecutive rows; the fields must be adjacent columns
+def to_ranges(sheet_name, rows, fields):
+    numbers = sorted(_column_number(field) for field in fields)
+    if numbers != list(range(numbers[0], numbers[0] + len(numbers))):
+        raise ValueError(f"Fields {fields} are not adjacent columns")
+    fields = sorted(fields, key=_column_number)
+
+    ranges = []
+    run = []
+    for row in rows:
+        if run and row.number != run[-1].number + 1:
+            ranges.append(run)
+            run = []
+        run.append(row)
+    if run:
+        ranges.append(run)
+    return [
+        (sheet_range(sheet_name, fields, run[0].number, run[-1].number),
+         [[getattr(row, field) for field in fields] for row in run])
+        for run in ranges
+    ]
+
+
+# Write the given fields of rows to the sheet in one call, or queue them on
+# a sheets.WriteBackBuffer under key when one is given
+def write_rows(service, spreadsheet_id, sheet_name, rows, fields, buffer=None, key=None):
+    ranges = to_ranges(sheet_name, rows, fields)
+    if buffer is not None:
+        for update_range, values in ranges:
+            buffer.add(update_range, values, key)
+        return
+    if not ranges:
+        return
+
+    with metrics.span('sheets.write'):
+        if len(ranges) == 1:
+            update_range, values = ranges[0]
+            service.spreadsheets().values().update(
+                spreadsheetId=spreadsheet_id,
+                range=update_range,
+                valueInputOption='RAW',
+                body={'values': values}
+            ).execute()
+        else:
+            service.spreadsheets().values().batchUpdate(
+                spreadsheetId=spreadsheet_id,
+                body={
+                    'valueInputOption': 'RAW',
+                    'data': [{'range': update_range, 'values': values} for update_range, values in ranges]
+                }
+            ).execute()
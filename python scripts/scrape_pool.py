@@ -0,0 +1,152 @@
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+import hosts
+import metrics
+from pipeline import extract_page, fetch_page
+
+# Scrape stage with downloads and extraction decoupled: a thread pool fetches
+# raw page bodies and hands them to a pool of worker processes that parse,
+# extract the text, detect the language and look up the country. Parsing is
+# CPU-bound, so throughput scales with cores instead of one GIL-bound thread.
+#
+#   with ScrapeStage(fetch_workers=16, extract_workers=4) as stage:
+#       scrape_batch(service, SPREADSHEET_ID, start, end, stage=stage)
+#
+# At most max_pending pages are downloaded or waiting for a worker at any
+# time, so fast fetchers cannot pile up page bodies in memory. The number of
+# concurrent downloads can be changed between batches (set_fetch_workers,
+# used by tuning.Controller), up to MAX_FETCH_WORKERS.
+
+FETCH_WORKERS = int(os.getenv('FETCH_WORKERS', 8))
+EXTRACT_WORKERS = int(os.getenv('EXTRACT_WORKERS', os.cpu_count() or 1))
+MAX_FETCH_WORKERS = 64
+
+
+# Semaphore whose size can change while it is in use
+class Limit:
+    def __init__(self, size):
+        self.size = size
+        self.active = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.active >= self.size:
+                self.condition.wait()
+            self.active += 1
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify()
+
+    def resize(self, size):
+        with self.condition:
+            self.size = size
+            self.condition.notify_all()
+
+
+def init_worker():
+    metrics.disable_trace()
+
+
+# Runs in a worker process; the spans recorded there are sent back with the result
+def extract_in_worker(page, max_text_length):
+    metrics.reset()
+    try:
+        values, error = extract_page(page, max_text_length), None
+    except Exception as e:
+        values, error = None, e
+    return values, error, metrics.export()
+
+
+class ScrapeStage:
+    def __init__(self, fetch_workers=FETCH_WORKERS, extract_workers=EXTRACT_WORKERS, max_pending=None, timeout=10):
+        self.timeout = timeout
+        self.extract_workers = extract_workers
+        self.max_pending = max_pending
+        # Threads are only started as downloads need them, fetching bounds how many run
+        self.max_fetch_workers = max(fetch_workers, MAX_FETCH_WORKERS)
+        self.fetch_pool = ThreadPoolExecutor(self.max_fetch_workers, thread_name_prefix='fetch')
+        self.fetching = Limit(fetch_workers)
+        # With no worker processes the fetch threads extract pages themselves
+        self.extract_pool = None
+        if extract_workers > 0:
+            self.extract_pool = ProcessPoolExecutor(extract_workers, initializer=init_worker)
+        self.slots = Limit(max_pending or fetch_workers + 2 * max(extract_workers, 1))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # Change the number of concurrent downloads from the next URL on
+    def set_fetch_workers(self, fetch_workers):
+        fetch_workers = max(1, min(int(fetch_workers), self.max_fetch_workers))
+        self.fetching.resize(fetch_workers)
+        if self.max_pending is None:
+            self.slots.resize(fetch_workers + 2 * max(self.extract_workers, 1))
+
+    def close(self):
+        self.fetch_pool.shutdown()
+        if self.extract_pool is not None:
+            self.extract_pool.shutdown()
+        # Keep the per-host timeouts and breakers for the next run
+        hosts.save()
+
+    # Scrape the URLs and return their results in order; a failed URL gets
+    # its exception as result (see pipeline.scraped_values)
+    def scrape(self, urls, max_text_length):
+        futures = [self.submit(url, max_text_length) for url in urls]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return results
+
+    # Start fetching one URL; blocks while max_pending pages are in flight
+    def submit(self, url, max_text_length):
+        self.slots.acquire()
+        result = Future()
+
+        def done(values=None, error=None):
+            self.slots.release()
+            if error is not None:
+                result.set_exception(error)
+            else:
+                result.set_result(values)
+
+        def extracted(extract_future):
+            try:
+                values, error, recorded = extract_future.result()
+                metrics.merge(recorded)
+            except Exception as e:
+                values, error = None, e
+            done(values, error)
+
+        def fetched(fetch_future):
+            self.fetching.release()
+            try:
+                page = fetch_future.result()
+            except Exception as e:
+                done(error=e)
+                return
+            if self.extract_pool is None:
+                try:
+                    done(extract_page(page, max_text_length))
+                except Exception as e:
+                    done(error=e)
+                return
+            try:
+                self.extract_pool.submit(extract_in_worker, page, max_text_length).add_done_callback(extracted)
+            except Exception as e:
+                done(error=e)
+
+        self.fetching.acquire()
+        self.fetch_pool.submit(fetch_page, url, self.timeout, max_text_length).add_done_callback(fetched)
+        return result
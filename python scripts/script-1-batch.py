@@ -2,15 +2,16 @@ import os
 from dotenv import load_dotenv
 load_dotenv()
 
-from googleapiclient.discovery import build
-from google.oauth2 import service_account
-import requests
-from bs4 import BeautifulSoup
-from langdetect import detect
-from langdetect.lang_detect_exception import LangDetectException
-from urllib.parse import urlparse
+import argparse
 import logging
-import time
+
+import metrics
+import profiling
+import tuning
+from pipeline import get_total_rows, preload, scrape_batch
+from planner import plan_scrape, print_plan
+from scrape_pool import EXTRACT_WORKERS, ScrapeStage
+from sheets import build_service
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -23,142 +24,77 @@ SPREADSHEET_ID = os.getenv('SPREADSHEET_ID')
 # Define the scopes
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
 
-# Authenticate and build the service
-creds = service_account.Credentials.from_service_account_file(
-    SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-service = build('sheets', 'v4', credentials=creds)
-
 # Parameters
-BATCH_SIZE = 50  # Adjust based on your rate limits and needs
 START_ROW = 880    # Starting row (excluding headers)
-
-# Read total number of rows in 'Sheet1'
-sheet_metadata = service.spreadsheets().get(spreadsheetId=SPREADSHEET_ID).execute()
-sheets = sheet_metadata.get('sheets', '')
-for s in sheets:
-    if s.get("properties", {}).get("title", "") == "Sheet1":
-        total_rows = s.get("properties", {}).get("gridProperties", {}).get("rowCount", 0)
-        break
-else:
-    logging.error("Sheet 'Sheet1' not found.")
-    total_rows = START_ROW - 1  # Set total_rows to avoid processing if sheet not found
-
-# Function to identify country from webpage metadata
-def get_country_from_metadata(soup):
-    # Attempt to find country in meta tags
-    country = 'Unknown'  # Default value
-    # List of possible meta tag attributes that might contain country information
-    meta_tags = [
-        {'name': 'geo.country'},
-        {'property': 'og:country-name'},
-        {'name': 'country'},
-        {'name': 'dcterms.coverage'},
-        {'name': 'ICBM'},
-        {'name': 'geo.position'},
-        {'name': 'geo.placename'},
-    ]
-    for tag_attrs in meta_tags:
-        meta = soup.find('meta', attrs=tag_attrs)
-        if meta and 'content' in meta.attrs:
-            country = meta['content'].strip()
-            break
-    return country
-
-# Process data in batches
-for batch_start in range(START_ROW, total_rows + 1, BATCH_SIZE):
-    batch_end = min(batch_start + BATCH_SIZE - 1, total_rows)
-    range_name = f'Sheet1!B{batch_start}:B{batch_end}'  # Reading only column B (URLs)
-    
-    # Read data for the current batch
-    result = service.spreadsheets().values().get(
-        spreadsheetId=SPREADSHEET_ID,
-        range=range_name
-    ).execute()
-    rows = result.get('values', [])
-
-    if not rows:
-        logging.info(f"No data found in rows {batch_start} to {batch_end}.")
-        continue
-
-    updated_rows = []
-
-    for index, row in enumerate(rows):
-        actual_row = batch_start + index  # The actual row number in the sheet
-        url = row[0] if len(row) > 0 else ''
-        
-        if not url:
-            updated_rows.append(['No URL', 'No Language', 'No Country', 'No Text'])
-            continue
-
-        logging.info(f"Processing row {actual_row}")
-
-        # Ensure the URL has a scheme
-        parsed_url = urlparse(url)
-        if not parsed_url.scheme:
-            url = 'http://' + url
-
-        try:
-            # Define headers to mimic a browser
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko)'
-                              ' Chrome/98.0.4758.102 Safari/537.36'
-            }
-
-            # Fetch the webpage content with headers
-            response = requests.get(url, headers=headers, timeout=10)
-            response.raise_for_status()
-            soup = BeautifulSoup(response.content, 'html.parser')
-            text = soup.get_text(separator=' ', strip=True)
-
-            # Limit text length if needed
-            max_text_length = 25000  # Adjust as needed
-            text_to_store = text[:max_text_length]
-
-            # Detect language using langdetect
-            if text_to_store.strip():
-                try:
-                    language = detect(text_to_store)
-                except LangDetectException:
-                    language = 'unknown'
-            else:
-                language = 'unknown'
-
-            # Identify country from metadata
-            country = get_country_from_metadata(soup)
-
-            # Append the data to the list
-            updated_rows.append([language, country, text_to_store])
-
-        except requests.exceptions.RequestException as e:
-            logging.error(f"HTTP error for URL {url}: {e}")
-            updated_rows.append(['Error', 'Error', 'Error'])
-        except Exception as e:
-            logging.error(f"Error processing row {actual_row}: {e}")
-            updated_rows.append(['Error', 'Error', 'Error'])
-
-        # Optional: Delay between requests to avoid overloading servers
-        # time.sleep(0.1)  # Adjust the delay as needed
-
-    # Write data back for the current batch
-    update_range = f'Sheet1!H{batch_start}:J{batch_start + len(updated_rows) - 1}'
-
-    # Prepare the data to write
-    body = {
-        'values': updated_rows
-    }
+SHEET_NAME = 'Sheet1'  # Name of your sheet
+MAX_TEXT_LENGTH = 25000  # Adjust as needed
+
+
+def main():
+    # Command line options
+    parser = argparse.ArgumentParser(description='Scrape the URLs in column B into columns H to J.')
+    parser.add_argument('--profile', nargs='?', const='scrape-profile.folded', metavar='FILE',
+                        help='Sample the extraction hot path and write collapsed stacks to FILE')
+    parser.add_argument('--fetch-workers', type=int,
+                        help='Concurrent downloads (default: tuned from earlier runs, see tuning.py)')
+    parser.add_argument('--extract-workers', type=int, default=EXTRACT_WORKERS,
+                        help='Worker processes for parsing (0 parses in the download threads)')
+    parser.add_argument('--plan', action='store_true',
+                        help='Only estimate the rows, API calls, tokens and time of the run (see planner.py)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Only start up (imports, credentials, service) and report how long it took')
+    args = parser.parse_args()
+
+    # Authenticate and build the service
+    service = build_service(SERVICE_ACCOUNT_FILE, SCOPES)
+
+    if args.dry_run:
+        preload('scrape')
+        metrics.report()
+        print(f"Dry run: cold start took {metrics.uptime():.2f}s; no rows were processed.")
+        return
+
+    # Read total number of rows in 'Sheet1'
+    total_rows = get_total_rows(service, SPREADSHEET_ID, SHEET_NAME, START_ROW)
+
+    if args.plan:
+        plan = plan_scrape(service, SPREADSHEET_ID, SHEET_NAME, START_ROW, total_rows, 'scrape', MAX_TEXT_LENGTH,
+                           pinned={'concurrency': args.fetch_workers})
+        print_plan(plan, START_ROW, total_rows, metrics.uptime())
+        return
+
+    # Time DNS lookups separately from downloads
+    metrics.time_dns()
+
+    # Batch size, concurrent downloads and the pause between batches adapt to
+    # the error and latency of each batch, starting from the last run's values
+    tuner = tuning.Controller('scrape', pinned={'concurrency': args.fetch_workers})
+
+    # The profiler samples this process, so profiled runs scrape one page at a time here
+    stage = None
+    if args.profile:
+        profiling.start()
+    else:
+        stage = ScrapeStage(tuner.get('concurrency'), args.extract_workers)
 
     try:
-        service.spreadsheets().values().update(
-            spreadsheetId=SPREADSHEET_ID,
-            range=update_range,
-            valueInputOption='RAW',
-            body=body
-        ).execute()
-        logging.info(f"Batch {batch_start}-{batch_end} processed successfully.")
-    except Exception as e:
-        logging.error(f"Error writing data to spreadsheet for batch {batch_start}-{batch_end}: {e}")
-
-    # Optional: Delay between batches to respect rate limits
-    time.sleep(5)  # Adjust the delay as needed
-
-print("All batches processed.")
+        # Process data in batches
+        for batch_start, batch_end in tuner.batches(START_ROW, total_rows):
+            if stage is not None:
+                stage.set_fetch_workers(tuner.get('concurrency'))
+            scrape_batch(service, SPREADSHEET_ID, batch_start, batch_end, SHEET_NAME, MAX_TEXT_LENGTH, stage)
+    finally:
+        if stage is not None:
+            stage.close()
+        tuner.save()
+
+    if args.profile:
+        profiling.stop(args.profile)
+
+    metrics.report()
+    print("All batches processed.")
+
+
+# Worker processes import this file again, so only run from the command line
+if __name__ == '__main__':
+    main()
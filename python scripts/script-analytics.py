@@ -0,0 +1,74 @@
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+import argparse
+import logging
+
+import metrics
+from analytics import TagAnalytics, write_export
+from pipeline import get_total_rows
+from rows import read_rows
+from sheets import build_service
+
+# Tag counts by country and month, tag co-occurrence and growth trends over
+# the enriched sheet (see analytics.py), written as one JSON file for the
+# website:
+#
+#   python script-analytics.py                          # writes analytics.json
+#   python script-analytics.py --output site/analytics.json --top 20
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+# Path to your service account key file
+SERVICE_ACCOUNT_FILE = os.getenv('SERVICE_ACCOUNT_FILE')
+# ID of your spreadsheet
+SPREADSHEET_ID = os.getenv('SPREADSHEET_ID')
+
+# Define the scopes
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+
+# Parameters
+START_ROW = 2    # Starting row (excluding headers)
+SHEET_NAME = 'Sheet1'  # Name of your sheet
+READ_BATCH_SIZE = 5000  # Rows read from the sheet at a time
+FIELDS = ('date', 'ai_country', 'tags', 'suggested_tags')  # Read as separate column ranges, see rows.read_rows
+
+
+def main():
+    # Command line options
+    parser = argparse.ArgumentParser(description='Aggregate the tags of the sheet for the website.')
+    parser.add_argument('--output', default='analytics.json', help='JSON file to write')
+    parser.add_argument('--top', type=int, default=10, help='Tags to print per table')
+    args = parser.parse_args()
+
+    service = build_service(SERVICE_ACCOUNT_FILE, SCOPES)
+    total_rows = get_total_rows(service, SPREADSHEET_ID, SHEET_NAME, START_ROW)
+
+    dates, countries, tags, suggested_tags = [], [], [], []
+    for batch_start in range(START_ROW, total_rows + 1, READ_BATCH_SIZE):
+        batch_end = min(batch_start + READ_BATCH_SIZE - 1, total_rows)
+        for row in read_rows(service, SPREADSHEET_ID, SHEET_NAME, FIELDS, batch_start, batch_end):
+            dates.append(row.date)
+            countries.append(row.ai_country)
+            tags.append(row.tags)
+            suggested_tags.append(row.suggested_tags)
+
+    analytics = TagAnalytics(dates, countries, tags, suggested_tags)
+    write_export(analytics, args.output)
+
+    print(f"{analytics.size} rows, {len(analytics.countries)} countries, {len(analytics.months)} months.")
+    for kind in analytics.tags:
+        print(f"Top {kind}:")
+        for tag, count in analytics.counts(kind, args.top).items():
+            print(f"  {count:>7}  {tag}")
+        print(f"Fastest growing {kind} (last 3 months against the 3 before):")
+        for trend in analytics.trends(kind)[:args.top]:
+            print(f"  {trend['growth']:>+8.2f}  {trend['tag']} ({trend['previous']} -> {trend['recent']})")
+    metrics.report()
+    print(f"Analytics written to {args.output}.")
+
+
+if __name__ == '__main__':
+    main()
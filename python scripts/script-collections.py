@@ -0,0 +1,202 @@
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import tuning
+from collection_config import COLLECTIONS_FILE, load_collections
+from pipeline import double_check_batch, enrich_batch, get_total_rows, preload, scrape_batch
+from planner import plan_enrich, plan_scrape, print_plan
+from results_log import Flusher, ResultsLog
+from routing import BudgetExceeded
+from scrape_pool import EXTRACT_WORKERS, FETCH_WORKERS, ScrapeStage
+from shared_cache import CACHE_DB, SharedCache
+from sheets import build_service
+
+# Runs the pipeline stages for every collection in COLLECTIONS_FILE (see
+# collection_config.py) in parallel, one thread per collection. The
+# collections share one download pool, one set of host statistics, one
+# enrichment budget and the result caches of shared_cache.py, so a link
+# that is in two collections is downloaded, extracted and summarized once.
+# Each collection writes to its own sheet. The collections also share one
+# tuning.Controller per stage: they use the same upstreams, so a 429 slows
+# the stage down for all of them once, and the settings are saved once.
+#
+#   python script-collections.py                            # all stages, all collections
+#   python script-collections.py --stages enrich --only biomaterials
+#   python script-collections.py --list                     # show the collections
+#   python script-collections.py --plan                     # estimate calls, tokens and time
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+# Set your OpenAI API key
+OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+# Path to your service account key file
+SERVICE_ACCOUNT_FILE = os.getenv('SERVICE_ACCOUNT_FILE')
+
+# Define the scopes
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+
+# Parameters
+STAGES = ('scrape', 'double-check', 'enrich')  # In the order they run
+MAX_TEXT_LENGTHS = {'scrape': 25000, 'double-check': 10000}
+
+
+# Run the stages over the rows of one collection with the shared tuners;
+# returns {stage: rows}
+def run_collection(collection, stages, scrape_stage, cache, chat, tuners):
+    # The Sheets client is not thread-safe, so every collection builds its own
+    service = build_service(SERVICE_ACCOUNT_FILE, SCOPES)
+    processed = {}
+    for stage_name in stages:
+        total_rows = get_total_rows(service, collection.spreadsheet_id, collection.sheet, collection.start_row)
+        tuner = tuners[stage_name]
+        results = flusher = None
+        if stage_name == 'enrich':
+            results = ResultsLog(collection.results_log)
+            flusher = Flusher(service, collection.spreadsheet_id, collection.results_log)
+            flusher.flush()
+            flusher.start()
+        logging.info(f"[{collection.name}] {stage_name}: rows {collection.start_row} to {total_rows}.")
+        count = 0
+        try:
+            for batch_start, batch_end in tuner.batches(collection.start_row, total_rows):
+                if stage_name == 'scrape':
+                    count += scrape_batch(service, collection.spreadsheet_id, batch_start, batch_end,
+                                          collection.sheet, MAX_TEXT_LENGTHS['scrape'], scrape_stage, cache=cache)
+                elif stage_name == 'double-check':
+                    count += double_check_batch(service, collection.spreadsheet_id, batch_start, batch_end,
+                                                collection.sheet, MAX_TEXT_LENGTHS['double-check'], scrape_stage)
+                else:
+                    try:
+                        count += enrich_batch(service, chat, collection.spreadsheet_id, batch_start, batch_end,
+                                              collection.sheet, call_delay=tuner.get('call_delay'), results=results,
+                                              cache=cache)
+                    except BudgetExceeded as e:
+                        logging.warning(f"[{collection.name}] {e}; stopping at row {batch_start}.")
+                        break
+        finally:
+            if results is not None:
+                results.close()
+                flusher.stop()
+        processed[stage_name] = count
+    return processed
+
+
+# Print the plan of every stage for the rows of one collection (see planner.py)
+def plan_collection(collection, stages, cache, fetch_workers):
+    service = build_service(SERVICE_ACCOUNT_FILE, SCOPES)
+    total_rows = get_total_rows(service, collection.spreadsheet_id, collection.sheet, collection.start_row)
+    for stage_name in stages:
+        if stage_name == 'enrich':
+            plan = plan_enrich(service, collection.spreadsheet_id, collection.sheet, collection.start_row, total_rows,
+                               cache=cache, results_log=collection.results_log)
+        else:
+            plan = plan_scrape(service, collection.spreadsheet_id, collection.sheet, collection.start_row, total_rows,
+                               stage_name, MAX_TEXT_LENGTHS[stage_name], cache=cache,
+                               pinned={'concurrency': fetch_workers})
+        print(f"[{collection.name}] ", end='')
+        print_plan(plan, collection.start_row, total_rows)
+
+
+# Run a collection, logging a failure instead of stopping the others
+def run_safely(collection, *args):
+    try:
+        return run_collection(collection, *args)
+    except Exception as e:
+        logging.error(f"[{collection.name}] stopped: {e}")
+        metrics.count_error('collections', e)
+        return None
+
+
+def main():
+    # Command line options
+    parser = argparse.ArgumentParser(description='Run the pipeline for every collection in parallel.')
+    parser.add_argument('--config', default=COLLECTIONS_FILE, help='JSON file declaring the collections')
+    parser.add_argument('--only', help='Comma-separated collection names (default: all)')
+    parser.add_argument('--stages', default='scrape,double-check,enrich', help='Comma-separated stages to run')
+    parser.add_argument('--cache', default=CACHE_DB, help='SQLite file holding the shared scrape and enrichment cache')
+    parser.add_argument('--list', action='store_true', help='Only show the collections and their sheets')
+    parser.add_argument('--fetch-workers', type=int, default=FETCH_WORKERS,
+                        help='Concurrent downloads, shared by all collections')
+    parser.add_argument('--extract-workers', type=int, default=EXTRACT_WORKERS,
+                        help='Worker processes for parsing (0 parses in the download threads)')
+    parser.add_argument('--plan', action='store_true',
+                        help='Only estimate the rows, API calls, tokens and time of the run (see planner.py)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Only start up (imports, credentials, service) and report how long it took')
+    args = parser.parse_args()
+    stages = [stage for stage in STAGES if stage in args.stages.split(',')]
+
+    collections = load_collections(args.config)
+    if args.only:
+        names = args.only.split(',')
+        unknown = set(names) - {collection.name for collection in collections}
+        if unknown:
+            parser.error(f"Unknown collections: {', '.join(sorted(unknown))}")
+        collections = [collection for collection in collections if collection.name in names]
+
+    if args.list:
+        for collection in collections:
+            print(f"{collection.name:<20} {collection.spreadsheet_id}  {collection.sheet}  "
+                  f"from row {collection.start_row}  log {collection.results_log}")
+        return
+
+    if args.dry_run:
+        build_service(SERVICE_ACCOUNT_FILE, SCOPES)
+        preload(*stages)
+        metrics.report()
+        print(f"Dry run: cold start took {metrics.uptime():.2f}s; no rows were processed.")
+        return
+
+    if args.plan:
+        # Links shared by collections are counted in each of them; the run fetches them once
+        cache = SharedCache(args.cache) if os.path.exists(args.cache) else None
+        for collection in collections:
+            plan_collection(collection, stages, cache, args.fetch_workers)
+        if cache is not None:
+            cache.close()
+        print(f"Planned in {metrics.uptime():.1f}s; nothing was fetched, sent or written.")
+        return
+
+    chat = None
+    if 'enrich' in stages:
+        import openai
+        openai.api_key = OPENAI_API_KEY
+        chat = openai.ChatCompletion.create
+
+    cache = SharedCache(args.cache)
+    scrape_stage = None
+    if {'scrape', 'double-check'} & set(stages):
+        metrics.time_dns()
+        scrape_stage = ScrapeStage(args.fetch_workers, args.extract_workers)
+    # Downloads are shared by all collections, so only the batch size and delays are tuned here
+    tuners = {stage: tuning.Controller(stage, pinned={'concurrency': scrape_stage.fetching.size}
+                                       if stage in MAX_TEXT_LENGTHS else None)
+              for stage in stages}
+    try:
+        with ThreadPoolExecutor(len(collections), thread_name_prefix='collection') as pool:
+            summaries = list(pool.map(
+                lambda collection: run_safely(collection, stages, scrape_stage, cache, chat, tuners), collections))
+    finally:
+        if scrape_stage is not None:
+            scrape_stage.close()
+        cache.close()
+        for tuner in tuners.values():
+            tuner.save()
+
+    metrics.report()
+    for collection, processed in zip(collections, summaries):
+        outcome = 'failed (see the log)' if processed is None else \
+            ', '.join(f'{stage} {rows} rows' for stage, rows in processed.items())
+        print(f"{collection.name}: {outcome}")
+
+
+# Worker processes import this file again, so only run from the command line
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+import argparse
+import json
+import logging
+
+import numpy as np
+
+import metrics
+from embeddings import EMBED_INDEX, EmbeddingIndex, get_embedder, kmeans, write_index
+from pipeline import get_total_rows
+from rows import read_rows
+from sheets import build_service
+
+# Embedding index over the sheet (see embeddings.py):
+#
+#   python script-embed.py build                     # embed the summaries (column M)
+#   python script-embed.py similar --row 1234        # projects related to a row
+#   python script-embed.py query "mycelium leather"  # rows closest to a phrase
+#   python script-embed.py cluster --k 12 --output clusters.json
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+# Path to your service account key file
+SERVICE_ACCOUNT_FILE = os.getenv('SERVICE_ACCOUNT_FILE')
+# ID of your spreadsheet
+SPREADSHEET_ID = os.getenv('SPREADSHEET_ID')
+
+# Define the scopes
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+
+# Parameters
+START_ROW = 2    # Starting row (excluding headers)
+SHEET_NAME = 'Sheet1'  # Name of your sheet
+READ_BATCH_SIZE = 1000  # Rows read from the sheet at a time
+EMBED_BATCH_SIZE = 256
+
+# Cell values that are placeholders rather than content
+PLACEHOLDERS = {'', 'no summary', 'no text', 'error', 'skipped', 'unsupported', 'unknown'}
+
+
+def build(args):
+    service = build_service(SERVICE_ACCOUNT_FILE, SCOPES)
+    total_rows = get_total_rows(service, SPREADSHEET_ID, SHEET_NAME, START_ROW)
+    embedder = get_embedder(args.model)
+
+    row_numbers, chunks, texts = [], [], []
+    for batch_start in range(START_ROW, total_rows + 1, READ_BATCH_SIZE):
+        batch_end = min(batch_start + READ_BATCH_SIZE - 1, total_rows)
+        for row in read_rows(service, SPREADSHEET_ID, SHEET_NAME, (args.field,), batch_start, batch_end):
+            value = getattr(row, args.field).strip()
+            if value.lower() in PLACEHOLDERS:
+                continue
+            row_numbers.append(row.number)
+            texts.append(value)
+            if len(texts) == EMBED_BATCH_SIZE:
+                with metrics.span('embeddings.encode'):
+                    chunks.append(embedder.encode(texts))
+                texts = []
+    if texts:
+        with metrics.span('embeddings.encode'):
+            chunks.append(embedder.encode(texts))
+
+    if not row_numbers:
+        print(f"No {args.field} values to embed.")
+        return
+    write_index(args.index, embedder.name, row_numbers, np.concatenate(chunks))
+    metrics.report()
+    print(f"Embedded {len(row_numbers)} rows ({args.field}) into {args.index}.")
+
+
+def print_hits(rows, scores):
+    for row, score in zip(rows, scores):
+        print(f"  row {row:>7}  {score:.3f}")
+
+
+def similar(args):
+    index = EmbeddingIndex(args.index)
+    if args.row not in index.position:
+        args.parser.error(f"Row {args.row} is not in the embedding index")
+    rows, scores = index.search(index.vector(args.row), args.k + 1)
+    keep = rows[0] != args.row
+    print(f"Rows most similar to row {args.row}:")
+    print_hits(rows[0][keep][:args.k], scores[0][keep][:args.k])
+
+
+def query(args):
+    index = EmbeddingIndex(args.index)
+    embedder = get_embedder(index.meta['model'])
+    rows, scores = index.search(embedder.encode([args.text]), args.k)
+    print(f"Rows closest to {args.text!r}:")
+    print_hits(rows[0], scores[0])
+
+
+def cluster(args):
+    index = EmbeddingIndex(args.index)
+    labels, centroids = kmeans(index.vectors, args.k)
+
+    # The rows nearest each centroid show what a cluster is about
+    examples, _ = index.search(centroids, 5)
+    sizes = np.bincount(labels, minlength=args.k)
+    for number in np.argsort(-sizes):
+        print(f"Cluster {number:>3}: {sizes[number]:>6} rows, e.g. rows {', '.join(map(str, examples[number]))}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({str(row): int(label) for row, label in zip(index.rows, labels)}, f)
+        print(f"Cluster of every row written to {args.output}.")
+    metrics.report()
+
+
+def main():
+    # Command line options
+    parser = argparse.ArgumentParser(description='Embed summaries and search or cluster them.')
+    parser.add_argument('--index', default=EMBED_INDEX, help='Index directory')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = commands.add_parser('build', help='Embed a column of the sheet into a new index')
+    build_parser.add_argument('--field', choices=['summary', 'text'], default='summary')
+    build_parser.add_argument('--model', help='Embedding model (default: EMBED_MODEL)')
+    build_parser.set_defaults(run=build)
+
+    similar_parser = commands.add_parser('similar', help='Rows most similar to a row')
+    similar_parser.add_argument('--row', type=int, required=True)
+    similar_parser.add_argument('--k', type=int, default=10)
+    similar_parser.set_defaults(run=similar, parser=similar_parser)
+
+    query_parser = commands.add_parser('query', help='Rows closest to a piece of text')
+    query_parser.add_argument('text')
+    query_parser.add_argument('--k', type=int, default=10)
+    query_parser.set_defaults(run=query)
+
+    cluster_parser = commands.add_parser('cluster', help='Group the rows into k themes')
+    cluster_parser.add_argument('--k', type=int, default=12)
+    cluster_parser.add_argument('--output', help='JSON file mapping each row to its cluster')
+    cluster_parser.set_defaults(run=cluster)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+import argparse
+import logging
+import sys
+import time
+
+import metrics
+from results_log import FLUSH_SECONDS, RESULTS_LOG, Flusher
+from sheets import build_service
+
+# Write the enrichment results log (see results_log.py) to the sheet. Run it
+# after a crash, or with --watch next to the enrichment as a separate flusher:
+#
+#   python script-flush-results.py
+#   python script-flush-results.py --watch
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+# Path to your service account key file
+SERVICE_ACCOUNT_FILE = os.getenv('SERVICE_ACCOUNT_FILE')
+# ID of your spreadsheet
+SPREADSHEET_ID = os.getenv('SPREADSHEET_ID')
+
+# Define the scopes
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+
+FLUSH_ATTEMPTS = 4  # Failed flushes in a row before a run without --watch gives up
+MAX_BACKOFF_SECONDS = 600  # Longest pause after failed flushes
+
+
+def main():
+    # Command line options
+    parser = argparse.ArgumentParser(description='Write logged enrichment results to the spreadsheet.')
+    parser.add_argument('--log', default=RESULTS_LOG, help='Results log file')
+    parser.add_argument('--watch', action='store_true', help='Keep flushing every --interval seconds')
+    parser.add_argument('--interval', type=int, default=FLUSH_SECONDS)
+    args = parser.parse_args()
+
+    # Authenticate and build the service
+    service = build_service(SERVICE_ACCOUNT_FILE, SCOPES)
+    flusher = Flusher(service, SPREADSHEET_ID, args.log, args.interval)
+
+    failures = 0
+    while True:
+        try:
+            written = flusher.flush()
+            failures = 0
+            if written:
+                logging.info(f"{written} rows written from {args.log}.")
+        except Exception as e:
+            # The lines stay in the log and are retried, as in Flusher.run
+            failures += 1
+            logging.error(f"Error flushing results to the spreadsheet (attempt {failures}): {e}")
+            metrics.count_error('results.flush', e)
+            if not args.watch and failures >= FLUSH_ATTEMPTS:
+                metrics.report()
+                sys.exit(1)
+        if not args.watch and not failures:
+            break
+        # Back off while the sheet keeps failing
+        time.sleep(min(2 ** failures * 5, MAX_BACKOFF_SECONDS) if failures else args.interval)
+
+    metrics.report()
+
+
+if __name__ == '__main__':
+    main()
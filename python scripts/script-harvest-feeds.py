@@ -0,0 +1,172 @@
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+import argparse
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from feeds import FEEDS_FILE, FeedStore, canonical_url, harvest, read_feed_list, scraped_values
+from fingerprints import STATE_DB, FingerprintStore, url_hash
+from pipeline import get_total_rows, normalize_url, preload
+from rows import SCRAPED, Row, read_rows, write_rows
+from sheets import WriteBackBuffer, build_service
+
+# Feed ingest: polls the RSS/Atom feeds and sitemaps in FEEDS_FILE (see
+# feeds.py) and appends the links not yet in column B as new rows, with the
+# publication date in column A. Items whose feed description is long enough
+# get columns H to J from it and are marked as scraped in the fingerprint
+# table, so script-ingest-changes.py only enriches them instead of
+# downloading the page. Before script-ingest-changes.py has set the
+# baseline of the table, the rows are left for its --adopt run instead.
+# Rows already in the sheet without a date get the date from the feed.
+#
+#   python script-harvest-feeds.py              # append new links
+#   python script-harvest-feeds.py --list       # show what would be added
+#   python script-ingest-changes.py             # then scrape and enrich them
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+# Path to your service account key file
+SERVICE_ACCOUNT_FILE = os.getenv('SERVICE_ACCOUNT_FILE')
+# ID of your spreadsheet
+SPREADSHEET_ID = os.getenv('SPREADSHEET_ID')
+
+# Define the scopes
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+
+# Parameters
+START_ROW = 2    # Starting row (excluding headers)
+SHEET_NAME = 'Sheet1'  # Name of your sheet
+FEED_WORKERS = 8  # Feeds fetched at the same time
+MIN_DESCRIPTION_LENGTH = 500  # Shorter feed descriptions leave the page to be scraped
+
+
+# Harvest a feed, logging failures instead of stopping the other feeds
+def harvest_feed(url, validators):
+    try:
+        return harvest(url, validators)
+    except Exception as e:
+        logging.error(f"Error harvesting feed {url}: {e}")
+        metrics.count_error('feeds', e)
+        return [], {}
+
+
+# Split harvested items into links new to the sheet and existing rows
+# that are missing their date
+def plan_items(rows, items):
+    known = {}
+    for row in rows:
+        if row.link.strip():
+            known.setdefault(canonical_url(normalize_url(row.link)), row)
+
+    new_items, dated_rows = [], []
+    for item in items:
+        key = canonical_url(item.url)
+        row = known.get(key)
+        if row is None:
+            known[key] = item
+            new_items.append(item)
+        elif isinstance(row, Row) and not row.date.strip() and item.date:
+            row.date = item.date
+            dated_rows.append(row)
+    # Oldest first, undated items last, so new rows keep the sheet in date order
+    new_items.sort(key=lambda item: item.date or '9999')
+    return new_items, dated_rows
+
+
+def main():
+    # Command line options
+    parser = argparse.ArgumentParser(description='Add the new links of RSS/Atom feeds and sitemaps to the sheet.')
+    parser.add_argument('feeds', nargs='*', help=f'Feed or sitemap URLs (default: the URLs in {FEEDS_FILE})')
+    parser.add_argument('--list', action='store_true', help='Only show which links would be added')
+    parser.add_argument('--state', default=STATE_DB, help='SQLite file holding the feed validators and fingerprints')
+    parser.add_argument('--min-description', type=int, default=MIN_DESCRIPTION_LENGTH,
+                        help='Feed descriptions at least this long are used instead of scraping the page')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Only start up (imports, credentials, service) and report how long it took')
+    args = parser.parse_args()
+
+    # Authenticate and build the service
+    service = build_service(SERVICE_ACCOUNT_FILE, SCOPES)
+
+    if args.dry_run:
+        preload('harvest')
+        metrics.report()
+        print(f"Dry run: cold start took {metrics.uptime():.2f}s; no rows were processed.")
+        return
+
+    feed_urls = args.feeds or read_feed_list()
+    feed_store = FeedStore(args.state)
+    # --list must not save validators, or the next real run would get 304s
+    validators = {} if args.list else feed_store.load()
+    with ThreadPoolExecutor(FEED_WORKERS) as pool:
+        results = list(pool.map(lambda url: harvest_feed(url, validators), feed_urls))
+    items = [item for feed_items, _ in results for item in feed_items]
+    states = {url: state for _, feed_states in results for url, state in feed_states.items()}
+
+    total_rows = get_total_rows(service, SPREADSHEET_ID, SHEET_NAME, START_ROW)
+    rows = read_rows(service, SPREADSHEET_ID, SHEET_NAME, ('date', 'link'), START_ROW, total_rows)
+    new_items, dated_rows = plan_items(rows, items)
+    logging.info(f"{len(feed_urls)} feeds, {len(states)} changed, {len(items)} items: "
+                 f"{len(new_items)} new links, {len(dated_rows)} existing rows to date.")
+
+    if args.list:
+        for item in new_items:
+            print(f"{item.date or '?':>10}  {item.url}  {item.title[:60]}")
+        feed_store.close()
+        return
+
+    buffer = WriteBackBuffer(service, SPREADSHEET_ID)
+    if dated_rows:
+        write_rows(service, SPREADSHEET_ID, SHEET_NAME, dated_rows, ('date',), buffer)
+
+    described = []
+    if new_items:
+        with metrics.span('sheets.write'):
+            result = service.spreadsheets().values().append(
+                spreadsheetId=SPREADSHEET_ID,
+                range=f'{SHEET_NAME}!A{START_ROW}:B',
+                valueInputOption='RAW',
+                insertDataOption='INSERT_ROWS',
+                body={'values': [[item.date, item.url] for item in new_items]}
+            ).execute()
+        first_row = int(re.search(r'!\D+(\d+)', result['updates']['updatedRange']).group(1))
+        numbers = range(first_row, first_row + len(new_items))
+
+        for number, item in zip(numbers, new_items):
+            values = scraped_values(item, args.min_description)
+            if values is not None:
+                row = Row(number)
+                row.update(SCRAPED, values)
+                described.append(row)
+        if described:
+            write_rows(service, SPREADSHEET_ID, SHEET_NAME, described, SCRAPED, buffer)
+    buffer.flush()
+
+    if new_items:
+        # Rows filled from their feed count as scraped for script-ingest-changes.py
+        store = FingerprintStore(args.state)
+        if store.baseline() is None:
+            logging.info("The fingerprint table has no baseline yet; the new rows are left for "
+                         "script-ingest-changes.py --adopt.")
+        else:
+            revision = store.start_run()
+            store.update_hashes({number: url_hash(item.url) for number, item in zip(numbers, new_items)})
+            store.mark([row.number for row in described], 'scraped', revision)
+            store.finish_run(revision, len(new_items))
+        store.close()
+
+    # Only now that the rows are in the sheet; a failed run fetches the feeds in full again
+    feed_store.save(states)
+    feed_store.close()
+    metrics.report()
+    print(f"Added {len(new_items)} links ({len(described)} with text from their feed) "
+          f"and dated {len(dated_rows)} rows.")
+
+
+if __name__ == '__main__':
+    main()
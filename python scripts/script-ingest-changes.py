@@ -0,0 +1,280 @@
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+import argparse
+import logging
+import time
+
+import metrics
+from fingerprints import STATE_DB, FingerprintStore, url_hash
+from pipeline import enrich_batch, needs_recheck, preload, scrape_batch
+from planner import read_range
+from routing import BudgetExceeded
+from scrape_pool import EXTRACT_WORKERS, FETCH_WORKERS, ScrapeStage
+from sheets import WriteBackBuffer, build_service
+
+# Change-detection ingest: reads only column B, compares it with the local
+# fingerprint table (STATE_DB) and sends just the new or edited rows through
+# dedupe, scraping and enrichment. Rows that only moved (for example after
+# script-0.py removed duplicates above them) keep their results.
+#
+#   python script-ingest-changes.py              # scrape and enrich changes
+#   python script-ingest-changes.py --list       # show what would be processed
+#   python script-ingest-changes.py --stages scrape
+#
+# Until a run has set the baseline of the fingerprint table, every row
+# would count as new and be scraped and enriched again. The first run needs
+# --adopt (record the rows whose text and enrichment are already filled in
+# as done, then process the rest) or --full (process everything); either
+# records the baseline in STATE_DB.
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+# Set your OpenAI API key
+OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+# Path to your service account key file
+SERVICE_ACCOUNT_FILE = os.getenv('SERVICE_ACCOUNT_FILE')
+# ID of your spreadsheet
+SPREADSHEET_ID = os.getenv('SPREADSHEET_ID')
+
+# Define the scopes
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+
+# Parameters
+START_ROW = 2    # Starting row (excluding headers)
+SHEET_NAME = 'Sheet1'  # Name of your sheet
+SCRAPE_BATCH_SIZE = 50
+ENRICH_BATCH_SIZE = 10
+MAX_TEXT_LENGTH = 25000  # Adjust as needed
+FLUSH_ROWS = 500  # Rows buffered before writing to the sheet
+FINAL_FLUSH_ATTEMPTS = 4  # Tries of the last write of a stage, with growing pauses
+
+
+# Work out which rows need scraping or enrichment from a fresh read of column B
+def plan_changes(links, fingerprints, stages):
+    hashes = {}
+    duplicates = []
+    first_row_of = {}
+    for offset, row in enumerate(links):
+        row_number = START_ROW + offset
+        url = row[0].strip() if row else ''
+        if not url:
+            continue
+        hash_ = url_hash(url)
+        if hash_ in first_row_of:
+            logging.info(f"Duplicate link found and skipped in row {row_number}: {url}")
+            duplicates.append(row_number)
+            continue
+        first_row_of[hash_] = row_number
+        hashes[row_number] = hash_
+
+    # URLs processed before at a row that now holds something else have moved
+    moved_from = {
+        hash_: (scraped, enriched)
+        for row, (hash_, scraped, enriched) in fingerprints.items()
+        if scraped is not None and hashes.get(row) != hash_
+    }
+
+    to_scrape, to_enrich, moves = [], [], {}
+    for row_number, hash_ in hashes.items():
+        old = fingerprints.get(row_number)
+        if old and old[0] == hash_:
+            scraped, enriched = old[1], old[2]
+        elif hash_ in moved_from:
+            scraped, enriched = moved_from[hash_]
+            moves[row_number] = (scraped, enriched)
+        else:
+            scraped = enriched = None
+        if scraped is None:
+            # Rows can only be enriched once their text has been scraped
+            if 'scrape' in stages:
+                to_scrape.append(row_number)
+                if 'enrich' in stages:
+                    to_enrich.append(row_number)
+        elif enriched is None and 'enrich' in stages:
+            to_enrich.append(row_number)
+
+    return hashes, duplicates, moves, to_scrape, to_enrich
+
+
+# Record the rows the sheet already holds results for as scraped and
+# enriched in a new revision; rows that have a fingerprint are left alone.
+# Returns the number of rows adopted per stage
+def adopt_rows(service, store, hashes, last_row):
+    known = store.load()
+    scraped, enriched = [], []
+    fields = ('text', 'summary')
+    for row in read_range(service, SPREADSHEET_ID, SHEET_NAME, fields, START_ROW, last_row):
+        if row.number not in hashes or row.number in known or needs_recheck(row.text):
+            continue
+        scraped.append(row.number)
+        if row.summary and row.summary != 'Error':
+            enriched.append(row.number)
+    store.update_hashes({number: hashes[number] for number in scraped})
+    revision = store.start_run()
+    store.mark(scraped, 'scraped', revision)
+    store.mark(enriched, 'enriched', revision)
+    store.finish_run(revision, 0)
+    return len(scraped), len(enriched)
+
+
+# Group sorted row numbers into (start, end) ranges of consecutive rows
+def contiguous_ranges(rows, max_size):
+    ranges = []
+    for row in sorted(rows):
+        if ranges and row == ranges[-1][1] + 1 and row - ranges[-1][0] < max_size:
+            ranges[-1][1] = row
+        else:
+            ranges.append([row, row])
+    return [tuple(r) for r in ranges]
+
+
+# Run a batch function over the ranges, writing through the buffer and
+# recording the rows that reached the sheet in the fingerprint table.
+# Returns the rows written. A failed batch is skipped and a failed write
+# leaves its rows queued for the next flush; rows still unwritten at the
+# end stay unmarked, so the next run processes them again
+def run_ranges(ranges, run_batch, buffer, store, stage_name, revision):
+    written = set()
+
+    def flush(attempts=1):
+        for attempt in range(attempts):
+            try:
+                keys = buffer.flush()
+            except Exception as e:
+                logging.error(f"Error writing {buffer.pending_rows} rows to the spreadsheet: {e}")
+                metrics.count_error('sheets.write', e)
+                if attempt + 1 < attempts:
+                    time.sleep(2 ** attempt * 5)
+                continue
+            for start, end in keys:
+                rows = range(start, end + 1)
+                store.mark(rows, stage_name, revision)
+                written.update(rows)
+            return
+
+    for start, end in ranges:
+        try:
+            run_batch(start, end, (start, end))
+        except BudgetExceeded as e:
+            # The unfinished range stays unmarked and is picked up next run
+            logging.warning(f"{e}; stopping at row {start}.")
+            buffer.discard((start, end))
+            break
+        except Exception as e:
+            # A failed batch (e.g. a Sheets error or 429 on its read) stays
+            # unmarked like above; the rows done so far are still written
+            logging.error(f"Error processing rows {start} to {end}: {e}")
+            metrics.count_error(stage_name, e)
+            buffer.discard((start, end))
+            continue
+        if buffer.pending_rows >= FLUSH_ROWS:
+            flush()
+    flush(FINAL_FLUSH_ATTEMPTS)
+    return written
+
+
+def main():
+    # Command line options
+    parser = argparse.ArgumentParser(description='Process only the rows added or edited since the last run.')
+    parser.add_argument('--stages', default='scrape,enrich', help='Comma-separated stages to run')
+    parser.add_argument('--list', action='store_true', help='Only show which rows would be processed')
+    parser.add_argument('--state', default=STATE_DB, help='SQLite file holding the fingerprints')
+    parser.add_argument('--adopt', action='store_true',
+                        help='First record the rows whose text and enrichment are already in the sheet as done')
+    parser.add_argument('--full', action='store_true',
+                        help='Allow a first run (no baseline yet) to process every row')
+    parser.add_argument('--fetch-workers', type=int, default=FETCH_WORKERS, help='Concurrent downloads')
+    parser.add_argument('--extract-workers', type=int, default=EXTRACT_WORKERS,
+                        help='Worker processes for parsing (0 parses in the download threads)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Only start up (imports, credentials, service) and report how long it took')
+    args = parser.parse_args()
+    stages = args.stages.split(',')
+
+    # Authenticate and build the service
+    service = build_service(SERVICE_ACCOUNT_FILE, SCOPES)
+
+    if args.dry_run:
+        preload(*[stage for stage in ('scrape', 'enrich') if stage in stages])
+        metrics.report()
+        print(f"Dry run: cold start took {metrics.uptime():.2f}s; no rows were processed.")
+        return
+
+    # Read only column B (URLs)
+    with metrics.span('sheets.read'):
+        result = service.spreadsheets().values().get(
+            spreadsheetId=SPREADSHEET_ID,
+            range=f'{SHEET_NAME}!B{START_ROW}:B'
+        ).execute()
+    links = result.get('values', [])
+    last_row = START_ROW + len(links) - 1
+
+    store = FingerprintStore(args.state)
+    fingerprints = store.load()
+    if args.adopt and not args.list:
+        hashes = plan_changes(links, fingerprints, stages)[0]
+        scraped, enriched = adopt_rows(service, store, hashes, last_row)
+        store.set_baseline('adopt')
+        logging.info(f"Adopted {scraped} rows as scraped and {enriched} as enriched.")
+        fingerprints = store.load()
+    elif args.full and not args.list:
+        store.set_baseline('full')
+    elif store.baseline() is None and not args.list:
+        store.close()
+        parser.error("The fingerprint table has no baseline, so every row without a fingerprint would be scraped "
+                     "and enriched again. Use --adopt to record the rows already done in the sheet, or --full to "
+                     "process them all.")
+    hashes, duplicates, moves, to_scrape, to_enrich = plan_changes(links, fingerprints, stages)
+    logging.info(f"{len(links)} rows read (high-water mark was {store.high_water_mark()}): "
+                 f"{len(to_scrape)} to scrape, {len(to_enrich)} to enrich, {len(moves)} moved, "
+                 f"{len(duplicates)} duplicates.")
+
+    if args.list:
+        print(f"Rows to scrape: {contiguous_ranges(to_scrape, SCRAPE_BATCH_SIZE)}")
+        print(f"Rows to enrich: {contiguous_ranges(to_enrich, ENRICH_BATCH_SIZE)}")
+        store.close()
+        return
+
+    revision = store.start_run()
+    store.update_hashes(hashes)
+    store.copy_revisions(moves)
+    store.truncate(last_row)
+    buffer = WriteBackBuffer(service, SPREADSHEET_ID)
+
+    if to_scrape:
+        metrics.time_dns()
+        scrape_ranges = contiguous_ranges(to_scrape, SCRAPE_BATCH_SIZE)
+        with ScrapeStage(args.fetch_workers, args.extract_workers) as stage:
+            scraped = run_ranges(
+                scrape_ranges,
+                lambda start, end, key: scrape_batch(service, SPREADSHEET_ID, start, end, SHEET_NAME,
+                                                     MAX_TEXT_LENGTH, stage, buffer, key),
+                buffer, store, 'scraped', revision)
+        # Rows whose text never reached the sheet cannot be enriched yet
+        unwritten = set(to_scrape) - scraped
+        if unwritten:
+            for key in scrape_ranges:
+                buffer.discard(key)
+            to_enrich = [row for row in to_enrich if row not in unwritten]
+
+    if to_enrich:
+        import openai
+        openai.api_key = OPENAI_API_KEY
+        run_ranges(
+            contiguous_ranges(to_enrich, ENRICH_BATCH_SIZE),
+            lambda start, end, key: enrich_batch(service, openai.ChatCompletion.create, SPREADSHEET_ID, start, end,
+                                                 SHEET_NAME, buffer=buffer, key=key),
+            buffer, store, 'enriched', revision)
+
+    store.finish_run(revision, len(set(to_scrape) | set(to_enrich)))
+    store.close()
+    metrics.report()
+    print(f"Ingest run {revision} completed.")
+
+
+# Worker processes import this file again, so only run from the command line
+if __name__ == '__main__':
+    main()
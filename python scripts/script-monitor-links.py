@@ -0,0 +1,142 @@
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+import argparse
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import hosts
+import metrics
+from fingerprints import STATE_DB, FingerprintStore, url_hash
+from liveness import MONITOR_METHOD, RANGE_BYTES, REQUEUE_REASONS, LinkStore, changes, check_link
+from pipeline import normalize_url, preload
+from sheets import build_service
+
+# Link monitor: checks every link in column B with one small conditional
+# request (see liveness.py) instead of downloading it, records its status,
+# redirect target and content changes in STATE_DB, and requeues only the
+# rows whose page changed in the fingerprint table, so the next
+# script-ingest-changes.py run scrapes and enriches just those.
+#
+#   python script-monitor-links.py                    # check all links
+#   python script-monitor-links.py --older-than 168   # only links not checked this week
+#   python script-monitor-links.py --list             # show changes, keep nothing
+#   python script-monitor-links.py --dead             # links that stopped answering
+#   python script-ingest-changes.py                   # then refresh the changed rows
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+# Path to your service account key file
+SERVICE_ACCOUNT_FILE = os.getenv('SERVICE_ACCOUNT_FILE')
+# ID of your spreadsheet
+SPREADSHEET_ID = os.getenv('SPREADSHEET_ID')
+
+# Define the scopes
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+
+# Parameters
+START_ROW = 2    # Starting row (excluding headers)
+SHEET_NAME = 'Sheet1'  # Name of your sheet
+MONITOR_WORKERS = 32  # Links checked at the same time
+
+
+def print_dead(store):
+    for url, status, error, checked_at in store.dead():
+        print(f"{status:>4}  {time.strftime('%Y-%m-%d', time.localtime(checked_at))}  {url}")
+
+
+def main():
+    # Command line options
+    parser = argparse.ArgumentParser(description='Check the links in the sheet and requeue the pages that changed.')
+    parser.add_argument('--method', choices=('range', 'head'), default=MONITOR_METHOD,
+                        help='Ranged GET (detects content changes) or HEAD (validators only)')
+    parser.add_argument('--range-bytes', type=int, default=RANGE_BYTES,
+                        help='Bytes read per page with --method range; changes past them go unnoticed')
+    parser.add_argument('--older-than', type=float, default=0,
+                        help='Only check links not checked in this many hours')
+    parser.add_argument('--limit', type=int, help='Check at most this many links')
+    parser.add_argument('--workers', type=int, default=MONITOR_WORKERS, help='Concurrent requests')
+    parser.add_argument('--list', action='store_true', help='Only show what changed; nothing is saved or requeued')
+    parser.add_argument('--dead', action='store_true', help='List the links found dead so far and exit')
+    parser.add_argument('--state', default=STATE_DB, help='SQLite file holding the link states and fingerprints')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Only start up (imports, credentials, service) and report how long it took')
+    args = parser.parse_args()
+
+    link_store = LinkStore(args.state)
+    if args.dead:
+        print_dead(link_store)
+        link_store.close()
+        return
+
+    # Authenticate and build the service
+    service = build_service(SERVICE_ACCOUNT_FILE, SCOPES)
+
+    if args.dry_run:
+        preload('monitor')
+        metrics.report()
+        print(f"Dry run: cold start took {metrics.uptime():.2f}s; no rows were processed.")
+        return
+
+    # Read only column B (URLs)
+    with metrics.span('sheets.read'):
+        result = service.spreadsheets().values().get(
+            spreadsheetId=SPREADSHEET_ID,
+            range=f'{SHEET_NAME}!B{START_ROW}:B'
+        ).execute()
+    rows_of = {}
+    for offset, row in enumerate(result.get('values', [])):
+        link = row[0].strip() if row else ''
+        if link:
+            rows_of.setdefault(normalize_url(link), []).append((START_ROW + offset, link))
+
+    previous = link_store.load()
+    recent = link_store.checked_since(args.older_than * 3600) if args.older_than else set()
+    urls = [url for url in rows_of if url not in recent][:args.limit]
+    logging.info(f"{len(rows_of)} links in the sheet, {len(urls)} to check.")
+
+    metrics.time_dns()
+    with ThreadPoolExecutor(args.workers) as pool:
+        checks = list(pool.map(lambda url: check_link(url, previous.get(url), args.method, args.range_bytes), urls))
+    metrics.count('links_checked', len(checks))
+    results = [(check, changes(previous.get(check.url), check)) for check in checks]
+    changed = [(check, reasons) for check, reasons in results if reasons]
+    requeue = {number: link for check, reasons in changed if set(reasons) & set(REQUEUE_REASONS)
+               for number, link in rows_of[check.url]}
+
+    if args.list:
+        for check, reasons in changed:
+            rows = ', '.join(str(number) for number, _ in rows_of[check.url])
+            target = f' -> {check.final_url}' if check.final_url else ''
+            print(f"{','.join(reasons):<16}  rows {rows}  {check.url}{target}")
+        link_store.close()
+        return
+
+    link_store.save(results)
+    link_store.close()
+    hosts.save()
+    if requeue:
+        # Only rows the ingest has recorded; new fingerprints would make the
+        # table look like it covers rows it has never seen
+        store = FingerprintStore(args.state)
+        known = store.load()
+        unknown = [number for number in requeue if number not in known]
+        if unknown:
+            logging.info(f"{len(unknown)} changed rows have no fingerprint and are left to "
+                         f"script-ingest-changes.py: {sorted(unknown)[:20]}")
+        requeue = {number: link for number, link in requeue.items() if number in known}
+        store.update_hashes({number: url_hash(link) for number, link in requeue.items()})
+        store.requeue(requeue)
+        store.close()
+
+    metrics.report()
+    dead = sum('dead' in reasons for _, reasons in changed)
+    print(f"Checked {len(checks)} links: {len(changed)} changed ({dead} went dead); "
+          f"{len(requeue)} rows requeued for script-ingest-changes.py.")
+
+
+if __name__ == '__main__':
+    main()
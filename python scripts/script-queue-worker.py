@@ -0,0 +1,215 @@
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+import argparse
+import logging
+import socket
+import time
+
+import metrics
+from pipeline import double_check_batch, enrich_batch, get_total_rows, preload, scrape_batch
+from routing import BudgetExceeded
+from scrape_pool import EXTRACT_WORKERS, FETCH_WORKERS, ScrapeStage
+from sheets import WriteBackBuffer, build_service
+from work_queue import QUEUE_DB, LeaseKeeper, WorkQueue
+
+# Work-queue mode for the scrape, double-check and enrichment stages. Row
+# ranges are stored as leased tasks in a SQLite file (QUEUE_DB); start as many
+# workers as you like, on this machine or on others sharing the file:
+#
+#   python script-queue-worker.py enqueue --stage scrape --start-row 880
+#   python script-queue-worker.py work --stage scrape      # on every machine
+#   python script-queue-worker.py status
+#
+# Each worker writes its results through a write-back buffer and marks its
+# tasks done only after they are in the sheet; tasks of a crashed worker are
+# picked up again once their lease expires.
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+# Set your OpenAI API key
+OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+# Path to your service account key file
+SERVICE_ACCOUNT_FILE = os.getenv('SERVICE_ACCOUNT_FILE')
+# ID of your spreadsheet
+SPREADSHEET_ID = os.getenv('SPREADSHEET_ID')
+
+# Define the scopes
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+
+# Parameters
+SHEET_NAME = 'Sheet1'  # Name of your sheet
+BATCH_SIZES = {'scrape': 50, 'double-check': 50, 'enrich': 10}
+MAX_TEXT_LENGTHS = {'scrape': 25000, 'double-check': 10000}
+POLL_SECONDS = 30  # Wait before looking again when other workers hold the remaining tasks
+
+
+def enqueue(args):
+    service = build_service(SERVICE_ACCOUNT_FILE, SCOPES)
+    total_rows = get_total_rows(service, SPREADSHEET_ID, SHEET_NAME, args.start_row)
+    end_row = min(args.end_row or total_rows, total_rows)
+    batch_size = args.batch_size or BATCH_SIZES[args.stage]
+    queue = WorkQueue(args.queue)
+    added = queue.enqueue_ranges(args.stage, args.start_row, end_row, batch_size)
+    queue.close()
+    print(f"Queued {added} {args.stage} tasks for rows {args.start_row} to {end_row}.")
+
+
+def status(args):
+    queue = WorkQueue(args.queue)
+    for row in queue.progress(args.stage):
+        exhausted = f" ({row['exhausted']} out of attempts)" if row['exhausted'] else ''
+        print(f"{row['stage']:<13} {row['status']:<8} {row['tasks']:>6}{exhausted}")
+    queue.close()
+
+
+# Run one claimed task and queue its results on the buffer under the task id
+def make_runner(args, service, stage):
+    if args.stage == 'scrape':
+        return lambda task, buffer: scrape_batch(
+            service, SPREADSHEET_ID, task.start_row, task.end_row, SHEET_NAME, MAX_TEXT_LENGTHS['scrape'],
+            stage, buffer, task.id)
+    if args.stage == 'double-check':
+        return lambda task, buffer: double_check_batch(
+            service, SPREADSHEET_ID, task.start_row, task.end_row, SHEET_NAME, MAX_TEXT_LENGTHS['double-check'],
+            stage, buffer, task.id)
+
+    import openai
+    openai.api_key = OPENAI_API_KEY
+    return lambda task, buffer: enrich_batch(
+        service, openai.ChatCompletion.create, SPREADSHEET_ID, task.start_row, task.end_row, SHEET_NAME,
+        buffer=buffer, key=task.id)
+
+
+# Write the buffered results and mark their tasks done; tasks whose lease
+# was lost in the meantime are dropped so only the new owner writes them
+def flush(queue, keeper, buffer, held, worker_id):
+    for task in list(held):
+        if task.id in keeper.lost:
+            buffer.discard(task.id)
+            keeper.drop(task.id)
+            held.remove(task)
+    try:
+        buffer.flush()
+    except Exception as e:
+        logging.error(f"Error writing data to spreadsheet for tasks {[task.id for task in held]}: {e}")
+        metrics.count_error('sheets.write', e)
+        for task in held:
+            buffer.discard(task.id)
+            keeper.drop(task.id)
+            queue.release(task.id, worker_id)
+        held.clear()
+        return
+    for task in held:
+        queue.complete(task.id, worker_id)
+        keeper.drop(task.id)
+    logging.info(f"Tasks {[(task.start_row, task.end_row) for task in held]} done.")
+    held.clear()
+
+
+def work(args):
+    service = build_service(SERVICE_ACCOUNT_FILE, SCOPES)
+    if args.dry_run:
+        preload(args.stage)
+        metrics.report()
+        print(f"Dry run: cold start took {metrics.uptime():.2f}s; no tasks were claimed.")
+        return
+
+    worker_id = args.worker_id or f'{socket.gethostname()}-{os.getpid()}'
+    queue = WorkQueue(args.queue)
+    keeper = LeaseKeeper(queue, worker_id)
+    buffer = WriteBackBuffer(service, SPREADSHEET_ID)
+    stage = None
+    if args.stage != 'enrich':
+        metrics.time_dns()
+        stage = ScrapeStage(args.fetch_workers, args.extract_workers)
+    run_task = make_runner(args, service, stage)
+    held = []
+
+    logging.info(f"Worker {worker_id} processing {args.stage} tasks from {args.queue}.")
+    try:
+        while True:
+            task = queue.claim(args.stage, worker_id)
+            if task is None:
+                if held:
+                    flush(queue, keeper, buffer, held, worker_id)
+                    continue
+                if not queue.has_open_tasks(args.stage):
+                    break
+                # Remaining tasks are leased by other workers; wait in case one of them dies
+                time.sleep(POLL_SECONDS)
+                continue
+
+            keeper.hold(task.id)
+            logging.info(f"Claimed rows {task.start_row}-{task.end_row} (attempt {task.attempts}).")
+            try:
+                run_task(task, buffer)
+            except BudgetExceeded as e:
+                logging.warning(f"{e}; giving rows {task.start_row}-{task.end_row} back and stopping.")
+                buffer.discard(task.id)
+                keeper.drop(task.id)
+                queue.release(task.id, worker_id)
+                if held:
+                    flush(queue, keeper, buffer, held, worker_id)
+                break
+            except Exception as e:
+                logging.error(f"Error processing rows {task.start_row}-{task.end_row}: {e}")
+                metrics.count_error(args.stage, e)
+                buffer.discard(task.id)
+                keeper.drop(task.id)
+                queue.release(task.id, worker_id)
+                continue
+            held.append(task)
+
+            if len(held) >= args.flush_every:
+                flush(queue, keeper, buffer, held, worker_id)
+    finally:
+        # Give unfinished tasks back right away instead of waiting for the lease
+        for task in held:
+            queue.release(task.id, worker_id)
+        keeper.stop()
+        if stage is not None:
+            stage.close()
+        queue.close()
+
+    metrics.report()
+    print(f"No {args.stage} tasks left.")
+
+
+def main():
+    # Command line options
+    parser = argparse.ArgumentParser(description='Run pipeline stages from a shared lease-based work queue.')
+    parser.add_argument('--queue', default=QUEUE_DB, help='SQLite queue file shared by all workers')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    enqueue_parser = commands.add_parser('enqueue', help='Split a row range into tasks')
+    enqueue_parser.add_argument('--stage', choices=sorted(BATCH_SIZES), required=True)
+    enqueue_parser.add_argument('--start-row', type=int, default=2)
+    enqueue_parser.add_argument('--end-row', type=int, help='Last row (default: last row of the sheet)')
+    enqueue_parser.add_argument('--batch-size', type=int, help='Rows per task')
+    enqueue_parser.set_defaults(run=enqueue)
+
+    work_parser = commands.add_parser('work', help='Claim and process tasks until none are left')
+    work_parser.add_argument('--stage', choices=sorted(BATCH_SIZES), required=True)
+    work_parser.add_argument('--worker-id', help='Name of this worker (default: host-pid)')
+    work_parser.add_argument('--flush-every', type=int, default=1, help='Tasks to buffer before writing to the sheet')
+    work_parser.add_argument('--fetch-workers', type=int, default=FETCH_WORKERS, help='Concurrent downloads')
+    work_parser.add_argument('--extract-workers', type=int, default=EXTRACT_WORKERS,
+                             help='Worker processes for parsing (0 parses in the download threads)')
+    work_parser.add_argument('--dry-run', action='store_true',
+                             help='Only start up (imports, credentials, service) and report how long it took')
+    work_parser.set_defaults(run=work)
+
+    status_parser = commands.add_parser('status', help='Show task counts per stage and status')
+    status_parser.add_argument('--stage', choices=sorted(BATCH_SIZES))
+    status_parser.set_defaults(run=status)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+# Worker processes import this file again, so only run from the command line
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+import argparse
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice, repeat
+
+import metrics
+from archive import ARCHIVE_DIR, ArchiveReader
+from pipeline import extract_page, get_total_rows, normalize_url, scraped_values
+from rows import SCRAPED, read_rows, write_rows
+from scrape_pool import EXTRACT_WORKERS, extract_in_worker, init_worker
+from sheets import WriteBackBuffer, build_service
+
+# Re-run extraction over the page archive (see archive.py) instead of the
+# web, e.g. after changing MAX_TEXT_LENGTH or the tags the parser skips:
+#
+#   python script-reextract.py --no-write          # time extraction only
+#   python script-reextract.py --start-row 2       # rewrite columns H to J
+#
+# Rows whose link was never archived are left as they are.
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+# Path to your service account key file
+SERVICE_ACCOUNT_FILE = os.getenv('SERVICE_ACCOUNT_FILE')
+# ID of your spreadsheet
+SPREADSHEET_ID = os.getenv('SPREADSHEET_ID')
+
+# Define the scopes
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+
+# Parameters
+BATCH_SIZE = 200  # Rows read from the sheet at a time
+SHEET_NAME = 'Sheet1'  # Name of your sheet
+MAX_TEXT_LENGTH = 25000  # Adjust as needed
+FLUSH_ROWS = 1000  # Rows buffered before writing to the sheet
+
+
+# Extract a list of pages in the worker pool, or in this process without one
+def extract_pages(pool, pages, max_text_length):
+    if pool is None:
+        for page in pages:
+            try:
+                yield extract_page(page, max_text_length)
+            except Exception as e:
+                yield e
+        return
+    for values, error, recorded in pool.map(extract_in_worker, pages, repeat(max_text_length), chunksize=8):
+        metrics.merge(recorded)
+        yield error if error is not None else values
+
+
+# Extract every archived page without touching the sheet and report the rate
+def time_extraction(reader, pool, max_text_length):
+    start = time.perf_counter()
+    pages = reader.pages()
+    count = 0
+    # Hand the pages over in batches so the archive is never loaded at once
+    while batch := list(islice(pages, BATCH_SIZE)):
+        for result in extract_pages(pool, batch, max_text_length):
+            count += 1
+            if isinstance(result, Exception):
+                metrics.count_error('reextract', result)
+    elapsed = time.perf_counter() - start
+    print(f"Re-extracted {count} archived pages in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.1f} pages/s).")
+
+
+def rewrite_sheet(reader, pool, max_text_length, start_row):
+    service = build_service(SERVICE_ACCOUNT_FILE, SCOPES)
+    buffer = WriteBackBuffer(service, SPREADSHEET_ID)
+    total_rows = get_total_rows(service, SPREADSHEET_ID, SHEET_NAME, start_row)
+
+    for batch_start in range(start_row, total_rows + 1, BATCH_SIZE):
+        batch_end = min(batch_start + BATCH_SIZE - 1, total_rows)
+        rows, urls, pages = [], [], []
+        for row in read_rows(service, SPREADSHEET_ID, SHEET_NAME, ('link',), batch_start, batch_end):
+            if not row.link:
+                continue
+            url = normalize_url(row.link)
+            page = reader.get(url)
+            if page is None:
+                metrics.count('not_archived')
+                continue
+            rows.append(row)
+            urls.append(url)
+            pages.append(page)
+
+        for row, url, result in zip(rows, urls, extract_pages(pool, pages, max_text_length)):
+            row.update(SCRAPED, scraped_values('reextract', row.number, url, result))
+        write_rows(service, SPREADSHEET_ID, SHEET_NAME, rows, SCRAPED, buffer)
+        if buffer.pending_rows >= FLUSH_ROWS:
+            buffer.flush()
+        logging.info(f"Rows {batch_start}-{batch_end}: {len(rows)} re-extracted from the archive.")
+    buffer.flush()
+
+
+def main():
+    # Command line options
+    parser = argparse.ArgumentParser(description='Re-extract columns H to J from archived pages.')
+    parser.add_argument('--archive', default=ARCHIVE_DIR or 'page-archive', help='Page archive directory')
+    parser.add_argument('--max-text-length', type=int, default=MAX_TEXT_LENGTH)
+    parser.add_argument('--start-row', type=int, default=2)
+    parser.add_argument('--no-write', action='store_true', help='Only time the extraction of every archived page')
+    parser.add_argument('--extract-workers', type=int, default=EXTRACT_WORKERS,
+                        help='Worker processes for parsing (0 parses in this process)')
+    args = parser.parse_args()
+
+    reader = ArchiveReader(args.archive)
+    pool = None
+    if args.extract_workers > 0:
+        pool = ProcessPoolExecutor(args.extract_workers, initializer=init_worker)
+    try:
+        if args.no_write:
+            time_extraction(reader, pool, args.max_text_length)
+        else:
+            rewrite_sheet(reader, pool, args.max_text_length, args.start_row)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        reader.close()
+
+    metrics.report()
+
+
+# Worker processes import this file again, so only run from the command line
+if __name__ == '__main__':
+    main()
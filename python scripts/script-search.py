@@ -0,0 +1,181 @@
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+import argparse
+import json
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import metrics
+from pipeline import get_total_rows
+from rows import read_rows
+from search_index import PAGE_SIZE, SEARCH_DB, SearchIndex, build_index, etag
+from sheets import build_service
+
+# Search service for the website (see search_index.py):
+#
+#   python script-search.py build                  # index the sheet into search.db
+#   python script-search.py serve --port 8000      # JSON endpoints for visualization.js
+#   python script-search.py query mycelium --country Brazil
+#
+# Endpoints (all GET, JSON, cacheable with ETag / If-None-Match):
+#   /api/rows?q=&country=&category=&from=&to=&page=1&per_page=50
+#   /api/countries?q=&category=&from=&to=    rows per country, for the map
+#   /api/categories                           rows per predefined tag
+#   /api/info                                 row count and date range
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+# Path to your service account key file
+SERVICE_ACCOUNT_FILE = os.getenv('SERVICE_ACCOUNT_FILE')
+# ID of your spreadsheet
+SPREADSHEET_ID = os.getenv('SPREADSHEET_ID')
+
+# Define the scopes
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+
+# Parameters
+START_ROW = 2    # Starting row (excluding headers)
+SHEET_NAME = 'Sheet1'  # Name of your sheet
+READ_BATCH_SIZE = 1000  # Rows read from the sheet at a time
+FIELDS = ('date', 'link', 'language', 'country', 'text', 'ai_language', 'ai_country', 'summary', 'tags',
+          'suggested_tags')
+MAX_AGE = 60  # Seconds browsers and proxies may reuse a response
+
+# Query string parameters of every endpoint, with their types
+ENDPOINTS = {
+    'rows': {'q': str, 'country': str, 'category': str, 'from': str, 'to': str, 'page': int, 'per_page': int},
+    'countries': {'q': str, 'category': str, 'from': str, 'to': str},
+    'categories': {},
+    'info': {},
+}
+# Query string names that are Python keywords
+ARGUMENTS = {'from': 'date_from', 'to': 'date_to'}
+
+
+def sheet_rows(service):
+    total_rows = get_total_rows(service, SPREADSHEET_ID, SHEET_NAME, START_ROW)
+    for batch_start in range(START_ROW, total_rows + 1, READ_BATCH_SIZE):
+        batch_end = min(batch_start + READ_BATCH_SIZE - 1, total_rows)
+        yield from read_rows(service, SPREADSHEET_ID, SHEET_NAME, FIELDS, batch_start, batch_end)
+
+
+def build(args):
+    service = build_service(SERVICE_ACCOUNT_FILE, SCOPES)
+    count = build_index(sheet_rows(service), args.index)
+    metrics.report()
+    print(f"Indexed {count} rows into {args.index}.")
+
+
+# Endpoint parameters from a query string; unknown or empty ones are left out
+def parse_params(name, query):
+    params = {}
+    for key, kind in ENDPOINTS[name].items():
+        value = query.get(key, [''])[0].strip()
+        if value:
+            params[ARGUMENTS.get(key, key)] = kind(value)
+    return params
+
+
+class SearchHandler(BaseHTTPRequestHandler):
+    index = None  # Set by serve()
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+    def send_json(self, status, body, headers=()):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8') if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        for header, value in headers:
+            self.send_header(header, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        name = url.path.removeprefix('/api/').strip('/')
+        if not url.path.startswith('/api/') or name not in ENDPOINTS:
+            self.send_json(404, {'error': f'Unknown endpoint {url.path}'})
+            return
+        try:
+            params = parse_params(name, parse_qs(url.query))
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+
+        try:
+            generation, result = self.index.cached(name, params)
+        except Exception as e:
+            # A missing index answers 503 until 'build' has run; anything
+            # else (a locked file, a query FTS5 rejects) is a 500
+            logging.error(f"Error answering {self.path}: {e}")
+            metrics.count_error('search', e)
+            missing = not os.path.exists(self.index.path)
+            self.send_json(503 if missing else 500,
+                           {'error': 'The search index is not built yet' if missing else str(e)})
+            return
+        tag = etag(generation, name, params)
+        headers = [('ETag', tag), ('Cache-Control', f'public, max-age={MAX_AGE}')]
+        if self.headers.get('If-None-Match') == tag:
+            metrics.count('search_not_modified')
+            self.send_json(304, None, headers)
+            return
+        self.send_json(200, result, headers)
+
+
+def serve(args):
+    SearchHandler.index = SearchIndex(args.index)
+    server = ThreadingHTTPServer((args.host, args.port), SearchHandler)
+    print(f"Serving {args.index} on http://{args.host}:{args.port}/api/ (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    metrics.report()
+
+
+def query(args):
+    index = SearchIndex(args.index)
+    params = {'q': args.text, 'country': args.country or '', 'category': args.category or '',
+              'page': args.page, 'per_page': args.per_page}
+    _, result = index.cached('rows', params)
+    print(f"{result['total']} rows match (page {result['page']} of {result['pages']}):")
+    for row in result['rows']:
+        print(f"  row {row['row']:>7}  {row['date'] or '?':>10}  {row['country'][:20]:<20}  {row['summary'][:80]}")
+
+
+def main():
+    # Command line options
+    parser = argparse.ArgumentParser(description='Full-text search index and query service for the website.')
+    parser.add_argument('--index', default=SEARCH_DB, help='SQLite index file')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = commands.add_parser('build', help='Index the sheet (replaces the old index)')
+    build_parser.set_defaults(run=build)
+
+    serve_parser = commands.add_parser('serve', help='Serve the JSON endpoints')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8000)
+    serve_parser.set_defaults(run=serve)
+
+    query_parser = commands.add_parser('query', help='Search the index from the command line')
+    query_parser.add_argument('text', nargs='?', default='')
+    query_parser.add_argument('--country')
+    query_parser.add_argument('--category')
+    query_parser.add_argument('--page', type=int, default=1)
+    query_parser.add_argument('--per-page', type=int, default=PAGE_SIZE)
+    query_parser.set_defaults(run=query)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
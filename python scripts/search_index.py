@@ -0,0 +1,209 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+from analytics import UNKNOWN, day_of, normalize_tag
+
+# Full-text search index of the sheet for the website (see
+# script-search.py). One SQLite file holds the rows shown in the table, an
+# FTS5 index over summaries, tags and extracted text, and the predefined
+# tags of every row, so the query endpoints can filter by keyword, country,
+# category and date range and return one page at a time. The index is
+# rebuilt into a new file that replaces the old one, so the server never
+# sees a half-written index.
+
+SEARCH_DB = os.getenv('SEARCH_DB', 'search.db')
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+CACHE_SIZE = 512  # Query results kept in memory per index generation
+
+SCHEMA = '''
+    CREATE TABLE entries (
+        row INTEGER PRIMARY KEY,
+        date TEXT NOT NULL,
+        link TEXT NOT NULL,
+        country TEXT NOT NULL,
+        language TEXT NOT NULL,
+        summary TEXT NOT NULL,
+        tags TEXT NOT NULL
+    );
+    CREATE INDEX entries_date ON entries (date);
+    CREATE INDEX entries_country_date ON entries (country, date);
+    CREATE TABLE entry_tags (
+        tag TEXT NOT NULL,
+        row INTEGER NOT NULL,
+        PRIMARY KEY (tag, row)
+    ) WITHOUT ROWID;
+    -- Contentless: the text is only needed to find rows, not to show them
+    CREATE VIRTUAL TABLE entries_fts USING fts5(
+        summary, tags, suggested_tags, text, content='', tokenize='unicode61 remove_diacritics 2'
+    );
+    CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+'''
+
+# Weights of the summary, tags, suggested_tags and text columns in the ranking
+RANK = 'bm25(entries_fts, 4.0, 2.0, 2.0, 1.0)'
+
+
+def _value(value):
+    return '' if value.strip().lower() in UNKNOWN else value.strip()
+
+
+# Write the rows (rows.Row with date, link, country, ai_country, language,
+# summary, tags, suggested_tags and text) as a new index at path
+def build_index(rows, path=SEARCH_DB):
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    db = sqlite3.connect(tmp_path)
+    count = 0
+    with metrics.span('search.build'), db:
+        db.executescript(SCHEMA)
+        for row in rows:
+            if not row.link.strip():
+                continue
+            tags = [tag for tag in {normalize_tag(tag) for tag in row.tags.split(',')} if tag]
+            db.execute('INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)', (
+                row.number, day_of(row.date) or row.date.strip(), row.link.strip(),
+                _value(row.ai_country) or _value(row.country) or 'Unknown',
+                _value(row.ai_language) or _value(row.language), _value(row.summary), ', '.join(sorted(tags))))
+            db.executemany('INSERT INTO entry_tags VALUES (?, ?)', [(tag, row.number) for tag in tags])
+            db.execute('INSERT INTO entries_fts (rowid, summary, tags, suggested_tags, text) VALUES (?, ?, ?, ?, ?)',
+                       (row.number, _value(row.summary), ', '.join(tags), _value(row.suggested_tags),
+                        _value(row.text)))
+            count += 1
+        db.execute('INSERT INTO meta VALUES (?, ?)', ('built_at', time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())))
+    db.execute("INSERT INTO entries_fts (entries_fts) VALUES ('optimize')")
+    db.commit()
+    db.close()
+    os.replace(tmp_path, path)
+    return count
+
+
+# Words of a search box as an FTS5 query: every word must match, the last
+# one also as a prefix so results appear while typing
+def fts_query(text):
+    words = re.findall(r'\w+', text.lower())
+    if not words:
+        return ''
+    return ' '.join(f'"{word}"' for word in words) + '*'
+
+
+class SearchIndex:
+    def __init__(self, path=SEARCH_DB, cache_size=CACHE_SIZE):
+        self.path = path
+        self.cache_size = cache_size
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.cache_generation = None
+
+    # Changes whenever the index file is replaced by a rebuild
+    @property
+    def generation(self):
+        stat = os.stat(self.path)
+        return f'{stat.st_ino:x}-{stat.st_mtime_ns:x}'
+
+    # Read-only connection of this thread, reopened after a rebuild
+    def _db(self, generation):
+        if getattr(self.local, 'generation', None) != generation:
+            if getattr(self.local, 'db', None) is not None:
+                self.local.db.close()
+            self.local.db = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True)
+            self.local.generation = generation
+        return self.local.db
+
+    # Result of an endpoint for the given parameters, from the cache when the
+    # same query ran on the same index before: (generation, result)
+    def cached(self, name, params):
+        generation = self.generation
+        key = (name, tuple(sorted(params.items())))
+        with self.lock:
+            if self.cache_generation != generation:
+                self.cache.clear()
+                self.cache_generation = generation
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                metrics.count('search_cache_hits')
+                return generation, self.cache[key]
+        with metrics.span('search.query', endpoint=name):
+            result = getattr(self, name)(self._db(generation), **params)
+        with self.lock:
+            if self.cache_generation == generation:
+                self.cache[key] = result
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return generation, result
+
+    # SQL condition and parameters for the filters shared by the endpoints
+    @staticmethod
+    def _where(q='', country='', category='', date_from='', date_to=''):
+        conditions, params = [], []
+        if fts_query(q):
+            conditions.append('e.row IN (SELECT rowid FROM entries_fts WHERE entries_fts MATCH ?)')
+            params.append(fts_query(q))
+        if country:
+            conditions.append('e.country = ?')
+            params.append(country)
+        if category:
+            conditions.append('e.row IN (SELECT row FROM entry_tags WHERE tag = ?)')
+            params.append(normalize_tag(category))
+        if date_from:
+            conditions.append("e.date >= ? AND e.date != ''")
+            params.append(date_from)
+        if date_to:
+            conditions.append("e.date <= ? AND e.date != ''")
+            params.append(date_to)
+        return ' AND '.join(conditions) or '1', params
+
+    # One page of matching rows, best matches first for a keyword search and
+    # newest first otherwise
+    def rows(self, db, q='', country='', category='', date_from='', date_to='', page=1, per_page=PAGE_SIZE):
+        page, per_page = max(1, page), min(max(1, per_page), MAX_PAGE_SIZE)
+        where, params = self._where(q, country, category, date_from, date_to)
+        total = db.execute(f'SELECT COUNT(*) FROM entries e WHERE {where}', params).fetchone()[0]
+        if fts_query(q):
+            # Rank the text matches once, then join the other filters to them
+            where, params = self._where('', country, category, date_from, date_to)
+            sql = (f'WITH f AS MATERIALIZED (SELECT rowid, {RANK} AS rank FROM entries_fts WHERE entries_fts MATCH ?) '
+                   f'SELECT e.row, e.date, e.country, e.link, e.summary, e.tags FROM f JOIN entries e ON e.row = f.rowid '
+                   f'WHERE {where} ORDER BY f.rank LIMIT ? OFFSET ?')
+            params = [fts_query(q)] + params
+        else:
+            sql = (f'SELECT e.row, e.date, e.country, e.link, e.summary, e.tags FROM entries e '
+                   f'WHERE {where} ORDER BY e.date DESC, e.row DESC LIMIT ? OFFSET ?')
+        found = db.execute(sql, params + [per_page, (page - 1) * per_page]).fetchall()
+        return {
+            'total': total, 'page': page, 'per_page': per_page, 'pages': (total + per_page - 1) // per_page,
+            'rows': [dict(zip(('row', 'date', 'country', 'link', 'summary', 'tags'), values)) for values in found],
+        }
+
+    # Matching rows per country, for the map
+    def countries(self, db, q='', category='', date_from='', date_to=''):
+        where, params = self._where(q, '', category, date_from, date_to)
+        return [{'country': country, 'count': count} for country, count in db.execute(
+            f'SELECT e.country, COUNT(*) FROM entries e WHERE {where} GROUP BY e.country ORDER BY 2 DESC', params)]
+
+    # Rows per predefined tag
+    def categories(self, db):
+        return [{'category': tag, 'count': count} for tag, count in db.execute(
+            'SELECT tag, COUNT(*) FROM entry_tags GROUP BY tag ORDER BY 2 DESC')]
+
+    # Size and date range of the corpus
+    def info(self, db):
+        rows, earliest, latest = db.execute(
+            "SELECT COUNT(*), MIN(NULLIF(date, '')), MAX(NULLIF(date, '')) FROM entries").fetchone()
+        built_at = db.execute("SELECT value FROM meta WHERE key = 'built_at'").fetchone()
+        return {'rows': rows, 'earliest': earliest, 'latest': latest, 'built_at': built_at[0] if built_at else None}
+
+
+# ETag of an endpoint response: the index generation and the parameters
+def etag(generation, name, params):
+    digest = hashlib.sha1(json.dumps([name, sorted(params.items())]).encode('utf-8')).hexdigest()[:16]
+    return f'"{generation}-{digest}"'
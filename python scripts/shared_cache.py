@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+from rows import needs_recheck
+
+# Results shared between collections (see script-collections.py) and runs,
+# in one SQLite file (CACHE_DB):
+#
+# - scraped: [language, country, text] per URL, so a link that is in two
+#   collections is downloaded and extracted once. Entries older than
+#   SCRAPE_CACHE_MAX_AGE are fetched again, since pages change. Texts the
+#   double-check would retry (empty, 'unknown', see pipeline.needs_recheck)
+#   are not kept, and the double-check stage does not read the cache;
+# - enriched: the values for columns K to P per input (language, country,
+#   text and routes), so the same text is only sent to the model once.
+#
+# Collections run in parallel threads, so a URL or text that one thread is
+# working on is not started again by another: the second thread waits for
+# the first one's result (single flight). Failed results are not cached.
+
+CACHE_DB = os.getenv('CACHE_DB', 'shared-cache.db')
+SCRAPE_CACHE_MAX_AGE = int(os.getenv('SCRAPE_CACHE_MAX_AGE', 7 * 24 * 3600))  # seconds
+
+
+def enrich_key(language, country, text, routes):
+    data = json.dumps([language, country, text, sorted(routes.items())], ensure_ascii=False)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+class SharedCache:
+    def __init__(self, path=CACHE_DB, max_age=SCRAPE_CACHE_MAX_AGE):
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.in_flight = {}  # (table, key) -> threading.Event
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS scraped (
+                url TEXT PRIMARY KEY,
+                max_text_length INTEGER NOT NULL,
+                vals TEXT NOT NULL,
+                stored_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS enriched (
+                key TEXT PRIMARY KEY,
+                vals TEXT NOT NULL,
+                stored_at REAL NOT NULL
+            );
+        ''')
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    # Cached values or None; call with the lock held
+    def _get(self, table, key, max_text_length=None):
+        if table == 'scraped':
+            row = self.db.execute('SELECT vals, max_text_length, stored_at FROM scraped WHERE url = ?',
+                                  (key,)).fetchone()
+            # A text cut shorter than asked for, or too old, is fetched again
+            if row is None or row[1] < max_text_length or time.time() - row[2] > self.max_age:
+                return None
+            language, country, text = json.loads(row[0])
+            return [language, country, text[:max_text_length]]
+        row = self.db.execute('SELECT vals FROM enriched WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    # Whether a key is cached, without claiming it (see planner.py)
+    def has(self, table, key, max_text_length=None):
+        with self.lock:
+            return self._get(table, key, max_text_length) is not None
+
+    def _put(self, table, key, values, max_text_length=None):
+        data = json.dumps(values, ensure_ascii=False)
+        with self.lock, self.db:
+            if table == 'scraped':
+                self.db.execute('INSERT OR REPLACE INTO scraped VALUES (?, ?, ?, ?)',
+                                (key, max_text_length, data, time.time()))
+            else:
+                self.db.execute('INSERT OR REPLACE INTO enriched VALUES (?, ?, ?)', (key, data, time.time()))
+
+    # Look up keys: returns ({key: values} of hits, keys this thread must
+    # compute, {key: event} of keys another thread is computing)
+    def _claim(self, table, keys, max_text_length=None):
+        hits, mine, waiting = {}, [], {}
+        with self.lock:
+            for key in dict.fromkeys(keys):
+                values = self._get(table, key, max_text_length)
+                if values is not None:
+                    hits[key] = values
+                elif (table, key) in self.in_flight:
+                    waiting[key] = self.in_flight[(table, key)]
+                else:
+                    self.in_flight[(table, key)] = threading.Event()
+                    mine.append(key)
+        metrics.count('cache_hits', len(hits), cache=table)
+        metrics.count('cache_misses', len(mine), cache=table)
+        metrics.count('cache_waits', len(waiting), cache=table)
+        return hits, mine, waiting
+
+    def _release(self, table, keys):
+        with self.lock:
+            for key in keys:
+                self.in_flight.pop((table, key)).set()
+
+    # Scrape results for urls in order, computing only the URLs not cached
+    # with scrape(missing_urls) -> results (exceptions for failed URLs)
+    def scrape(self, urls, max_text_length, scrape):
+        results, mine, waiting = self._claim('scraped', urls, max_text_length)
+        try:
+            for url, result in zip(mine, scrape(mine) if mine else []):
+                results[url] = result
+                if not isinstance(result, Exception) and not needs_recheck(result[2]):
+                    self._put('scraped', url, result, max_text_length)
+        finally:
+            self._release('scraped', mine)
+        for url, event in waiting.items():
+            event.wait()
+            with self.lock:
+                results[url] = self._get('scraped', url, max_text_length)
+            if results[url] is None:
+                # The other thread failed; try once more here
+                results[url] = scrape([url])[0]
+        return [results[url] for url in urls]
+
+    # Enrichment values for one input, from the cache or from enrich();
+    # results for which store(values) is false are not kept
+    def enrich(self, key, enrich, store=lambda values: True):
+        hits, mine, waiting = self._claim('enriched', [key])
+        if key in hits:
+            return hits[key]
+        if key in waiting:
+            waiting[key].wait()
+            with self.lock:
+                values = self._get('enriched', key)
+            return values if values is not None else enrich()
+        try:
+            values = enrich()
+            if store(values):
+                self._put('enriched', key, values)
+            return values
+        finally:
+            self._release('enriched', mine)
@@ -0,0 +1,140 @@
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+import metrics
+
+# Helpers around the Google Sheets values API shared by the scripts.
+#
+# The Google client libraries are slow to import and build('sheets', 'v4')
+# parses (or downloads) the discovery document on every start, so
+# build_service() imports them on first use, keeps the discovery document
+# in CACHE_DIR and reuses the access token of the service account until it
+# expires. Frequent small runs then start without waiting on either.
+
+CACHE_DIR = os.getenv('SHEETS_CACHE_DIR', '.cache')
+DISCOVERY_URL = 'https://sheets.googleapis.com/$discovery/rest?version=v4'
+DISCOVERY_MAX_AGE = int(os.getenv('SHEETS_DISCOVERY_MAX_AGE', 7 * 24 * 3600))  # seconds
+
+_credentials = {}
+
+
+# Write a file atomically so a crashed run never leaves a partial cache entry
+def _write_cache(path, text, mode=0o644):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with os.fdopen(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode), 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+# Discovery document of the Sheets API, downloaded once and reused until it
+# is older than DISCOVERY_MAX_AGE
+def discovery_document():
+    path = os.path.join(CACHE_DIR, 'sheets-v4-discovery.json')
+    try:
+        if time.time() - os.path.getmtime(path) < DISCOVERY_MAX_AGE:
+            with open(path) as f:
+                return f.read()
+    except OSError:
+        pass
+
+    import requests
+    response = requests.get(DISCOVERY_URL, timeout=30)
+    response.raise_for_status()
+    _write_cache(path, response.text)
+    return response.text
+
+
+# Service account credentials with a valid access token. The token is kept
+# in CACHE_DIR (readable only by the owner) and reused by later runs
+def get_credentials(service_account_file, scopes):
+    key = (service_account_file, tuple(scopes))
+    if key in _credentials and _credentials[key].valid:
+        return _credentials[key]
+
+    from google.auth.transport.requests import Request
+    from google.oauth2 import service_account
+    creds = service_account.Credentials.from_service_account_file(service_account_file, scopes=scopes)
+
+    token_path = os.path.join(CACHE_DIR, 'sheets-token.json')
+    try:
+        with open(token_path) as f:
+            cached = json.load(f)
+        if cached['account'] == creds.service_account_email and cached['scopes'] == list(scopes):
+            creds.token = cached['token']
+            creds.expiry = datetime.fromisoformat(cached['expiry'])
+    except (OSError, ValueError, KeyError):
+        pass
+
+    if not creds.valid:
+        creds.refresh(Request())
+        _write_cache(token_path, json.dumps({
+            'account': creds.service_account_email,
+            'scopes': list(scopes),
+            'token': creds.token,
+            'expiry': creds.expiry.isoformat(),
+        }), mode=0o600)
+
+    _credentials[key] = creds
+    return creds
+
+
+# Authenticate and build the Sheets service from the cached pieces
+def build_service(service_account_file, scopes):
+    with metrics.span('startup.credentials'):
+        creds = get_credentials(service_account_file, scopes)
+    with metrics.span('startup.discovery'):
+        from googleapiclient.discovery import build_from_document
+        return build_from_document(discovery_document(), credentials=creds)
+
+
+# Write-back buffer: collects the values of many ranges (from one or more
+# tasks) and sends them in a single values().batchUpdate call on flush()
+class WriteBackBuffer:
+    def __init__(self, service, spreadsheet_id):
+        self.service = service
+        self.spreadsheet_id = spreadsheet_id
+        self.entries = []  # (key, range, values)
+        self.lock = threading.Lock()
+
+    def add(self, update_range, values, key=None):
+        with self.lock:
+            self.entries.append((key, update_range, values))
+
+    # Drop everything queued under a key (e.g. a task whose lease was lost)
+    def discard(self, key):
+        with self.lock:
+            self.entries = [entry for entry in self.entries if entry[0] != key]
+
+    @property
+    def pending_rows(self):
+        with self.lock:
+            return sum(len(values) for _, _, values in self.entries)
+
+    # Send all queued ranges; returns the keys that were written. On error the
+    # entries stay queued so the caller can retry or give the work back
+    def flush(self):
+        with self.lock:
+            entries = list(self.entries)
+        if not entries:
+            return set()
+
+        body = {
+            'valueInputOption': 'RAW',
+            'data': [{'range': update_range, 'values': values} for _, update_range, values in entries]
+        }
+        with metrics.span('sheets.write'):
+            self.service.spreadsheets().values().batchUpdate(
+                spreadsheetId=self.spreadsheet_id,
+                body=body
+            ).execute()
+        logging.info(f"Wrote {len(entries)} ranges to the spreadsheet.")
+
+        written = {id(entry) for entry in entries}
+        with self.lock:
+            self.entries = [entry for entry in self.entries if id(entry) not in written]
+        return {key for key, _, _ in entries}
@@ -0,0 +1,91 @@
+import os
+import runpy
+import sys
+
+import pytest
+
+SCRIPTS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SCRIPTS)
+
+import fakes  # noqa: E402
+import feeds  # noqa: E402
+import sheets  # noqa: E402
+from feeds import Item  # noqa: E402
+from fingerprints import FingerprintStore  # noqa: E402
+
+# script-harvest-feeds.py followed by script-ingest-changes.py against the
+# fake Sheets service: harvesting must not give the ingest a fingerprint
+# table that looks like a baseline (see fingerprints.py)
+
+DESCRIPTION = 'A living wall of mycelium grown on discarded textiles, week by week. ' * 10
+FEED_ITEM = Item('https://example.org/new-project', '2026-10-01', 'New project', DESCRIPTION)
+
+
+def sheet():
+    return {'Sheet1': {
+        1: ['Date', 'Link'],
+        2: ['2026-09-01', 'https://example.org/a', '', '', '', '', '', 'en', 'Unknown', 'Text of a', '', '', 'Summary a'],
+        3: ['2026-09-02', 'https://example.org/b', '', '', '', '', '', 'en', 'Unknown', 'Text of b', '', '', 'Summary b'],
+    }}
+
+
+@pytest.fixture
+def service(monkeypatch):
+    service = fakes.FakeSheetsService(sheet())
+    monkeypatch.setattr(sheets, 'build_service', lambda *args: service)
+    monkeypatch.setattr(feeds, 'harvest', lambda url, validators: ([FEED_ITEM], {}))
+    return service
+
+
+def run(monkeypatch, script, *args):
+    monkeypatch.setattr(sys, 'argv', [script, *args])
+    runpy.run_path(os.path.join(SCRIPTS, script), run_name='__main__')
+
+
+def test_ingest_after_harvest_is_refused_without_baseline(service, monkeypatch, tmp_path):
+    state = str(tmp_path / 'state.db')
+    run(monkeypatch, 'script-harvest-feeds.py', 'https://example.org/feed', '--state', state)
+    assert service.sheets['Sheet1'][4][1] == FEED_ITEM.url
+
+    store = FingerprintStore(state)
+    assert store.load() == {}
+    store.close()
+
+    before = {number: list(cells) for number, cells in service.sheets['Sheet1'].items()}
+    with pytest.raises(SystemExit) as refused:
+        run(monkeypatch, 'script-ingest-changes.py', '--state', state)
+    assert refused.value.code == 2
+    assert service.sheets['Sheet1'] == before
+
+
+def test_harvest_after_adopt_records_the_new_rows(service, monkeypatch, tmp_path, capsys):
+    state = str(tmp_path / 'state.db')
+    run(monkeypatch, 'script-ingest-changes.py', '--state', state, '--adopt', '--stages', 'scrape')
+    run(monkeypatch, 'script-harvest-feeds.py', 'https://example.org/feed', '--state', state)
+
+    store = FingerprintStore(state)
+    assert store.baseline() == 'adopt'
+    assert sorted(store.load()) == [2, 3, 4]
+    store.close()
+
+    capsys.readouterr()
+    run(monkeypatch, 'script-ingest-changes.py', '--state', state, '--list')
+    assert 'Rows to scrape: []' in capsys.readouterr().out
+
+
+def test_failed_batch_keeps_the_rows_done_so_far(tmp_path):
+    ingest = runpy.run_path(os.path.join(SCRIPTS, 'script-ingest-changes.py'))
+    service = fakes.FakeSheetsService(sheet())
+    buffer = sheets.WriteBackBuffer(service, 'sheet')
+    store = FingerprintStore(str(tmp_path / 'state.db'))
+    store.update_hashes({2: 'a', 3: 'b', 4: 'c'})
+
+    def run_batch(start, end, key):
+        if start == 3:
+            raise fakes.HttpError(429, 'Quota exceeded')
+        buffer.add(f'Sheet1!J{start}:J{end}', [['new text']] * (end - start + 1), key)
+
+    written = ingest['run_ranges']([(2, 2), (3, 3), (4, 4)], run_batch, buffer, store, 'scraped', 1)
+    assert written == {2, 4}
+    assert {row: marks[1] for row, marks in store.load().items()} == {2: 1, 3: None, 4: 1}
+    store.close()
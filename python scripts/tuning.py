@@ -0,0 +1,203 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+import metrics
+
+# Run-time tuning of batch size, concurrency and delays per stage, so runs
+# start from what earlier runs learned instead of hard-coded guesses.
+#
+#   tuner = tuning.Controller('scrape')
+#   for batch_start, batch_end in tuner.batches(START_ROW, total_rows):
+#       stage.set_fetch_workers(tuner.get('concurrency'))
+#       scrape_batch(service, SPREADSHEET_ID, batch_start, batch_end, ...)
+#   tuner.save()
+#
+# After every batch the controller looks at what the batch cost: 429s and
+# other rate-limit errors (neither the Sheets nor the OpenAI client exposes
+# the remaining quota, so running out of it shows up as these), transient
+# errors (timeouts, dropped connections, 5xx) per row, and the mean latency
+# of the stage's requests against the best latency seen. A congested batch
+# halves the batch size and concurrency and doubles the delays; a clean one
+# adds one step to the sizes and takes one step off the delays (AIMD, as TCP
+# does with its window).
+# Settings are saved per stage in TUNING_FILE; an empty TUNING_FILE keeps
+# them in memory only and AUTO_TUNE=0 keeps the defaults.
+#
+# The errors and latencies come from the process-wide metrics, so a process
+# running the same stage in several threads (script-collections.py) shares
+# one controller per stage. Each batch is charged with what happened since
+# the previous batch of any thread ended, so an error slows the stage down
+# once, not once for every batch that was running at the time.
+
+TUNING_FILE = os.getenv('TUNING_FILE', 'tuning.json')
+AUTO_TUNE = bool(int(os.getenv('AUTO_TUNE', 1)))
+ERROR_RATE = 0.2  # Transient errors per row above which a batch counts as congested
+LATENCY_FACTOR = 2.0  # Mean latency above this multiple of the best seen counts as congested
+DECREASE = 0.5
+LATENCY_DRIFT = 1.02  # The best latency is forgotten slowly, so a lucky batch does not set it for good
+
+# Errors that say the upstream is overloaded rather than that a row is bad
+TRANSIENT_ERRORS = {
+    'Timeout', 'ConnectTimeout', 'ReadTimeout', 'ConnectionError', 'ChunkedEncodingError', 'HostUnavailable',
+    'APIConnectionError', 'ServiceUnavailableError', 'APIError', 'TimeoutError',
+}
+
+# kind 'size' grows additively and shrinks multiplicatively; kind 'delay'
+# the other way round
+Tunable = namedtuple('Tunable', 'default minimum maximum step kind')
+
+STAGES = {
+    'scrape': {
+        'batch_size': Tunable(50, 10, 500, 10, 'size'),
+        'concurrency': Tunable(8, 1, 64, 2, 'size'),
+        'batch_delay': Tunable(5.0, 0.0, 60.0, 1.0, 'delay'),
+    },
+    'double-check': {
+        'batch_size': Tunable(50, 10, 500, 10, 'size'),
+        'concurrency': Tunable(8, 1, 64, 2, 'size'),
+        'batch_delay': Tunable(5.0, 0.0, 60.0, 1.0, 'delay'),
+    },
+    'enrich': {
+        'batch_size': Tunable(10, 1, 100, 2, 'size'),
+        'call_delay': Tunable(1.0, 0.0, 30.0, 0.25, 'delay'),
+        'batch_delay': Tunable(5.0, 0.0, 60.0, 1.0, 'delay'),
+    },
+}
+
+# Spans timing the upstream requests of each stage, by exact name: child
+# spans such as download.body time part of the same request again
+LATENCY_SPANS = {
+    'scrape': ('download',),
+    'double-check': ('download',),
+    'enrich': ('openai.language', 'openai.country', 'openai.summary', 'openai.tags', 'openai.suggested_tags',
+               'openai.chat'),
+}
+
+_file_lock = threading.Lock()
+
+
+def load(path=None):
+    path = TUNING_FILE if path is None else path
+    if not path:
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+# Error and latency totals of the stage in the metrics recorded so far
+def _totals(stage, error_stages, latency_spans):
+    data = metrics.snapshot()
+    rate_limited = transient = 0
+    for counter in data['counters']:
+        labels = counter['labels']
+        if counter['name'] == 'rate_limited' and labels.get('stage') in error_stages:
+            rate_limited += counter['value']
+        elif counter['name'] == 'errors' and labels.get('stage') in error_stages \
+                and labels.get('error') in TRANSIENT_ERRORS:
+            transient += counter['value']
+    seconds = calls = 0
+    for name, stats in data['spans'].items():
+        if name in latency_spans:
+            seconds += stats['total_seconds']
+            calls += stats['count']
+    return rate_limited, transient, seconds, calls
+
+
+class Controller:
+    def __init__(self, stage, pinned=None, path=None, enabled=AUTO_TUNE):
+        self.stage = stage
+        self.path = TUNING_FILE if path is None else path
+        self.enabled = enabled
+        self.tunables = STAGES[stage]
+        saved = load(self.path).get(stage, {}) if enabled else {}
+        self.values = {}
+        for name, tunable in self.tunables.items():
+            value = saved.get(name, tunable.default)
+            self.values[name] = min(tunable.maximum, max(tunable.minimum, type(tunable.default)(value)))
+        # Values set on the command line are never changed
+        self.pinned = {name: value for name, value in (pinned or {}).items() if value is not None}
+        self.values.update(self.pinned)
+        self.best_latency = saved.get('best_latency')
+        self.error_stages = {stage, 'sheets.write', 'sheets.read'}
+        self.lock = threading.Lock()
+        self.last_totals = _totals(stage, self.error_stages, LATENCY_SPANS[stage])
+        if saved:
+            logging.info(f"Starting {stage} with the tuned settings {self.values}.")
+
+    def get(self, name):
+        return self.values[name]
+
+    # Apply the result of one batch of rows
+    def observe(self, rows, rate_limited, transient, latency):
+        reasons = []
+        if rate_limited:
+            reasons.append(f'{rate_limited:g} rate-limited')
+        if rows and transient / rows > ERROR_RATE:
+            reasons.append(f'{transient:g} transient errors in {rows} rows')
+        if latency is not None:
+            if self.best_latency and latency > LATENCY_FACTOR * self.best_latency:
+                reasons.append(f'latency {latency:.2f}s against {self.best_latency:.2f}s')
+            self.best_latency = min((self.best_latency or latency) * LATENCY_DRIFT, latency)
+
+        if not self.enabled:
+            return
+        before = dict(self.values)
+        for name, tunable in self.tunables.items():
+            if name in self.pinned:
+                continue
+            value = self.values[name]
+            if tunable.kind == 'size':
+                value = value * DECREASE if reasons else value + tunable.step
+            else:
+                value = max(value / DECREASE, tunable.step) if reasons else value - tunable.step
+            value = min(tunable.maximum, max(tunable.minimum, value))
+            self.values[name] = type(tunable.default)(round(value, 3))
+        if reasons:
+            metrics.count('tuning_backoffs', stage=self.stage)
+            logging.warning(f"{self.stage} congested ({', '.join(reasons)}); backing off to {self.values}.")
+        elif self.values != before:
+            logging.info(f"{self.stage} settings now {self.values}.")
+
+    # Observe a finished batch of rows with the errors and latency recorded
+    # since the previous batch was observed
+    def observe_batch(self, rows):
+        with self.lock:
+            totals = _totals(self.stage, self.error_stages, LATENCY_SPANS[self.stage])
+            rate_limited, transient, seconds, calls = (b - a for a, b in zip(self.last_totals, totals))
+            self.last_totals = totals
+            self.observe(rows, rate_limited, transient, seconds / calls if calls else None)
+
+    # (batch_start, batch_end) ranges from start to end sized by the current
+    # batch_size; each batch is observed when the loop body returns, then
+    # the batch delay is slept. Several threads can run batches of one
+    # controller at the same time
+    def batches(self, start, end):
+        batch_start = start
+        while batch_start <= end:
+            batch_end = min(batch_start + int(self.values['batch_size']) - 1, end)
+            yield batch_start, batch_end
+            self.observe_batch(batch_end - batch_start + 1)
+            batch_start = batch_end + 1
+            if batch_start <= end:
+                time.sleep(self.values['batch_delay'])
+
+    # Keep the learned settings for the next run
+    def save(self):
+        if not self.path or not self.enabled:
+            return
+        with _file_lock:
+            data = load(self.path)
+            saved = data.setdefault(self.stage, {})
+            saved.update({name: value for name, value in self.values.items() if name not in self.pinned})
+            saved.update(best_latency=self.best_latency, updated_at=round(time.time()))
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp_path, self.path)
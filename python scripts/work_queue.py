@@ -0,0 +1,166 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+# Lease-based work queue stored in a SQLite file. Row ranges become tasks;
+# workers on one or several machines (sharing the file) claim a task, renew
+# its lease while they work and mark it done once its results are written.
+# A worker that crashes stops renewing, its lease expires and the task is
+# handed to the next worker, so no two live workers hold the same rows.
+#
+# On a network share keep SQLite's default rollback journal (no WAL), which
+# relies only on file locks.
+
+QUEUE_DB = os.getenv('QUEUE_DB', 'work-queue.db')
+LEASE_SECONDS = int(os.getenv('QUEUE_LEASE_SECONDS', 300))
+MAX_ATTEMPTS = int(os.getenv('QUEUE_MAX_ATTEMPTS', 5))
+
+Task = namedtuple('Task', 'id stage start_row end_row attempts')
+
+
+class WorkQueue:
+    def __init__(self, path=QUEUE_DB, lease_seconds=LEASE_SECONDS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.lock = threading.Lock()
+        # isolation_level=None: transactions are opened explicitly below
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.db.execute('''CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY,
+            stage TEXT NOT NULL,
+            start_row INTEGER NOT NULL,
+            end_row INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            owner TEXT,
+            lease_until REAL NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            updated_at REAL NOT NULL DEFAULT 0,
+            UNIQUE (stage, start_row)
+        )''')
+
+    def close(self):
+        self.db.close()
+
+    # Split rows start_row..total_rows into tasks of batch_size rows
+    def enqueue_ranges(self, stage, start_row, total_rows, batch_size):
+        tasks = [
+            (stage, batch_start, min(batch_start + batch_size - 1, total_rows), time.time())
+            for batch_start in range(start_row, total_rows + 1, batch_size)
+        ]
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            before = self.db.total_changes
+            self.db.executemany(
+                'INSERT OR IGNORE INTO tasks (stage, start_row, end_row, updated_at) VALUES (?, ?, ?, ?)', tasks)
+            added = self.db.total_changes - before
+            self.db.execute('COMMIT')
+        return added
+
+    # Lease the next free task of a stage: pending, or leased by a worker
+    # whose lease has expired. Returns None when nothing can be claimed now
+    def claim(self, stage, worker_id):
+        now = time.time()
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.db.execute(
+                    '''SELECT id, stage, start_row, end_row, attempts FROM tasks
+                       WHERE stage = ? AND attempts < ?
+                         AND (status = 'pending' OR (status = 'leased' AND lease_until < ?))
+                       ORDER BY start_row LIMIT 1''',
+                    (stage, MAX_ATTEMPTS, now)).fetchone()
+                if row is None:
+                    return None
+                self.db.execute(
+                    '''UPDATE tasks SET status = 'leased', owner = ?, lease_until = ?,
+                       attempts = attempts + 1, updated_at = ? WHERE id = ?''',
+                    (worker_id, now + self.lease_seconds, now, row[0]))
+                return Task(row[0], row[1], row[2], row[3], row[4] + 1)
+            finally:
+                self.db.execute('COMMIT')
+
+    # Extend the lease; False means it expired and another worker may own the task
+    def renew(self, task_id, worker_id):
+        now = time.time()
+        with self.lock:
+            cursor = self.db.execute(
+                '''UPDATE tasks SET lease_until = ?, updated_at = ?
+                   WHERE id = ? AND owner = ? AND status = 'leased' AND lease_until >= ?''',
+                (now + self.lease_seconds, now, task_id, worker_id, now))
+        return cursor.rowcount == 1
+
+    def complete(self, task_id, worker_id):
+        with self.lock:
+            cursor = self.db.execute(
+                "UPDATE tasks SET status = 'done', updated_at = ? WHERE id = ? AND owner = ? AND status = 'leased'",
+                (time.time(), task_id, worker_id))
+        return cursor.rowcount == 1
+
+    # Give a task back so another worker can pick it up
+    def release(self, task_id, worker_id):
+        with self.lock:
+            self.db.execute(
+                "UPDATE tasks SET status = 'pending', owner = NULL, lease_until = 0, updated_at = ? "
+                "WHERE id = ? AND owner = ? AND status = 'leased'",
+                (time.time(), task_id, worker_id))
+
+    # Number of tasks per status for a stage (or all stages)
+    def progress(self, stage=None):
+        query = 'SELECT stage, status, COUNT(*), SUM(attempts >= ?) FROM tasks'
+        params = [MAX_ATTEMPTS]
+        if stage:
+            query += ' WHERE stage = ?'
+            params.append(stage)
+        with self.lock:
+            rows = self.db.execute(query + ' GROUP BY stage, status', params).fetchall()
+        return [{'stage': s, 'status': status, 'tasks': n, 'exhausted': exhausted or 0}
+                for s, status, n, exhausted in rows]
+
+    # True while a stage still has tasks that are not done (and not exhausted)
+    def has_open_tasks(self, stage):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT COUNT(*) FROM tasks WHERE stage = ? AND status != 'done' AND attempts < ?",
+                (stage, MAX_ATTEMPTS)).fetchone()
+        return row[0] > 0
+
+
+# Background thread renewing the leases of every task a worker holds. Tasks
+# whose lease could not be renewed end up in .lost and must not be written
+class LeaseKeeper:
+    def __init__(self, queue, worker_id, interval=None):
+        self.queue = queue
+        self.worker_id = worker_id
+        self.interval = interval or max(1, queue.lease_seconds / 3)
+        self.held = set()
+        self.lost = set()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def hold(self, task_id):
+        with self.lock:
+            self.held.add(task_id)
+
+    def drop(self, task_id):
+        with self.lock:
+            self.held.discard(task_id)
+            self.lost.discard(task_id)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            with self.lock:
+                held = list(self.held - self.lost)
+            for task_id in held:
+                if not self.queue.renew(task_id, self.worker_id):
+                    logging.warning(f"Lease on task {task_id} lost; its results will be discarded.")
+                    with self.lock:
+                        self.lost.add(task_id)
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
@@ -1,14 +1,42 @@
-// Fetch the CSV data and initialize the visualization
+// Fetch the data and initialize the visualization
 document.addEventListener('DOMContentLoaded', function () {
     // Define the colors from the CSS variables
     const mapFillColor = getComputedStyle(document.documentElement).getPropertyValue('--bs-turquoise');
     const mapStrokeColor = getComputedStyle(document.documentElement).getPropertyValue('--bs-deep-purple');
     const circleFillColor = getComputedStyle(document.documentElement).getPropertyValue('--bs-pink');
 
-    // Load CSV and process the map and table
-    loadCSVData();
+    // Search service (python scripts/script-search.py serve), set with data-api on the script tag.
+    // Without it the published CSV is loaded in full and paged in the browser
+    const apiURL = (document.querySelector('script[data-api]') || { dataset: {} }).dataset.api || '';
+    const pageSize = 50;
 
-    let allData;  // Store all CSV data globally
+    // Current table query
+    const query = { q: '', country: '', page: 1 };
+
+    let allData;  // Store all CSV data globally (CSV mode only)
+    let rowsByCountry;  // CSV rows grouped by country (CSV mode only)
+    let latestRequest = 0;  // Only the answer to the newest table query is shown
+
+    // Load the data and process the map and table
+    if (apiURL) {
+        loadAPIData();
+    } else {
+        loadCSVData();
+    }
+    setupControls();
+
+    async function fetchJSON(endpoint, params = {}) {
+        const search = new URLSearchParams(Object.entries(params).filter(([, value]) => value !== '' && value != null));
+        const response = await fetch(`${apiURL}/${endpoint}?${search}`);
+        return response.json();
+    }
+
+    async function loadAPIData() {
+        const [countries, info] = await Promise.all([fetchJSON('countries'), fetchJSON('info')]);
+        plotMap(countries);
+        displayEntryInfo(info.rows, info.earliest, info.latest);
+        loadPage();
+    }
 
     async function loadCSVData() {
         const csvURL = 'https://docs.google.com/spreadsheets/d/e/2PACX-1vQMswqogf1_bjVku0iKgJrsWuuUzghX7NmVoDq5UPAEMDAbBka74UmrWhbdRD7xy5JY2k-z1QhdwlGu/pub?gid=1264427414&single=true&output=csv';
@@ -21,15 +49,18 @@ document.addEventListener('DOMContentLoaded', function () {
             skipEmptyLines: true,
             complete: function (results) {
                 allData = results.data;  // Store data for later use
-                plotMap(allData);  // Pass full data to the map plotter
-                populateTable(allData);  // Populate table initially with all data
-                displayEntryInfo(allData);  // Display summary info
+                // Group once, so clicking a country is a lookup instead of a scan of all rows
+                rowsByCountry = d3.group(allData, d => d['country']);
+                plotMap(Array.from(rowsByCountry, ([key, value]) => ({ country: key, count: value.length })));
+                const dates = allData.map(row => row.date).filter(date => date);
+                displayEntryInfo(allData.length, d3.min(dates), d3.max(dates));  // Display summary info
+                loadPage();  // Show the first page of the table
             }
         });
     }
 
-    // Plot the map using D3.js
-    function plotMap(data) {
+    // Plot the map using D3.js; countryData is [{country, count}]
+    function plotMap(countryData) {
         const aspectRatio = 960 / 600;  // Define the aspect ratio (width/height)
 
         const svg = d3.select("#map")
@@ -71,38 +102,24 @@ document.addEventListener('DOMContentLoaded', function () {
                 .attr("stroke", mapStrokeColor)
                 .attr("stroke-width", 1);
 
-            // Group data by country from CSV
-            const countryLinks = d3.group(data, d => d['country']);
-
-            // Prepare data to map the number of links per country
-            const countryData = Array.from(countryLinks, ([key, value]) => ({
-                country: key,
-                count: value.length,
-                links: value.map(d => ({ date: d['date'], link: d['link'], summary: d['summary'] })) // Use link data
-            }));
+            // Position of every country on the map, computed once per country
+            const featuresByName = new Map(geoData.features.map(f => [f.properties.name, f]));
+            const position = country => {
+                const countryFeature = featuresByName.get(country);
+                return countryFeature ? projection(d3.geoCentroid(countryFeature)) : null;
+            };
+            const placed = countryData
+                .map(d => ({ ...d, coordinates: position(d.country) }))
+                .filter(d => d.coordinates);
 
             // Plot circles for each country based on the count of BioArt links
             svg.selectAll("circle")
-                .data(countryData)
+                .data(placed)
                 .enter()
                 .append("circle")
                 .attr("class", "circle")
-                .attr("cx", d => {
-                    const countryFeature = geoData.features.find(f => f.properties.name === d.country);
-                    if (countryFeature) {
-                        const coordinates = projection(d3.geoCentroid(countryFeature));
-                        return coordinates ? coordinates[0] : null;
-                    }
-                    return null;
-                })
-                .attr("cy", d => {
-                    const countryFeature = geoData.features.find(f => f.properties.name === d.country);
-                    if (countryFeature) {
-                        const coordinates = projection(d3.geoCentroid(countryFeature));
-                        return coordinates ? coordinates[1] : null;
-                    }
-                    return null;
-                })
+                .attr("cx", d => d.coordinates[0])
+                .attr("cy", d => d.coordinates[1])
                 .attr("r", d => d.count > 0 ? Math.sqrt(d.count) * 5 : 0) // Circle radius based on the count
                 .attr("fill", circleFillColor)
                 .attr("stroke", "white")
@@ -126,48 +143,98 @@ document.addEventListener('DOMContentLoaded', function () {
         });
     }
 
-    // Populate the table with CSV data initially
-    function populateTable(data) {
-        const tableBody = document.querySelector('#data-table tbody');
-        tableBody.innerHTML = ''; // Clear existing rows
-        data.forEach(row => {
-            const newRow = `<tr>
-              <td>${row.date}</td>
-              <td>${row.country}</td>
-              <td><a href="${row.link}" target="_blank">Link</a></td>
-              <td>${row.summary}</td>
-          </tr>`;
-            tableBody.innerHTML += newRow;
+    // Search box, pager and the button that clears the country filter
+    function setupControls() {
+        let typingTimer;
+        document.querySelector('#search-box').addEventListener('input', function (event) {
+            // Wait for a pause in typing instead of querying on every key
+            clearTimeout(typingTimer);
+            typingTimer = setTimeout(() => {
+                query.q = event.target.value.trim();
+                query.page = 1;
+                loadPage();
+            }, 250);
         });
+        document.querySelector('#prev-page').addEventListener('click', () => {
+            query.page -= 1;
+            loadPage();
+        });
+        document.querySelector('#next-page').addEventListener('click', () => {
+            query.page += 1;
+            loadPage();
+        });
+        document.querySelector('#clear-country').addEventListener('click', () => updateTable(''));
     }
 
     // Update the table with country-specific data when a circle is clicked
     function updateTable(country) {
+        query.country = country;
+        query.page = 1;
+        loadPage();
+    }
+
+    // Load the current page of the table: one request to the search service, or a slice of the CSV rows
+    async function loadPage() {
+        let rows, total;
+        if (apiURL) {
+            const request = ++latestRequest;
+            const result = await fetchJSON('rows', { ...query, per_page: pageSize });
+            if (request !== latestRequest) return;
+            rows = result.rows;
+            total = result.total;
+        } else {
+            if (!allData) return;
+            let matching = query.country ? (rowsByCountry.get(query.country) || []) : allData;
+            if (query.q) {
+                const words = query.q.toLowerCase();
+                matching = matching.filter(row => (row.summary || '').toLowerCase().includes(words));
+            }
+            total = matching.length;
+            rows = matching.slice((query.page - 1) * pageSize, query.page * pageSize);
+        }
+        populateTable(rows);
+        updatePager(total);
+    }
+
+    // Populate the table with one page of rows, building them off-document and inserting them at once
+    function populateTable(data) {
         const tableBody = document.querySelector('#data-table tbody');
-        tableBody.innerHTML = ''; // Clear current table
-
-        // Filter the global data to get the rows for the clicked country
-        const countryData = allData.filter(row => row.country === country);
-
-        // Populate the table with the filtered country data
-        countryData.forEach(row => {
-            const newRow = `<tr>
-              <td>${row.date}</td>
-              <td>${row.country}</td>
-              <td><a href="${row.link}" target="_blank">Link</a></td>
-              <td>${row.summary}</td>
-          </tr>`;
-            tableBody.innerHTML += newRow;
+        const fragment = document.createDocumentFragment();
+        data.forEach(row => {
+            const newRow = document.createElement('tr');
+            [row.date, row.country].forEach(value => {
+                const cell = document.createElement('td');
+                cell.textContent = value || '';
+                newRow.appendChild(cell);
+            });
+            const linkCell = document.createElement('td');
+            const link = document.createElement('a');
+            link.href = row.link;
+            link.target = '_blank';
+            link.textContent = 'Link';
+            linkCell.appendChild(link);
+            newRow.appendChild(linkCell);
+            const summaryCell = document.createElement('td');
+            summaryCell.textContent = row.summary || '';
+            newRow.appendChild(summaryCell);
+            fragment.appendChild(newRow);
         });
+        tableBody.replaceChildren(fragment);
+    }
+
+    // Page position, filter and the state of the pager buttons
+    function updatePager(total) {
+        const pages = Math.max(1, Math.ceil(total / pageSize));
+        const filter = query.country ? ` in ${query.country}` : '';
+        document.querySelector('#page-info').textContent = `Page ${query.page} of ${pages} (${total} entries${filter})`;
+        document.querySelector('#prev-page').disabled = query.page <= 1;
+        document.querySelector('#next-page').disabled = query.page >= pages;
+        document.querySelector('#clear-country').hidden = !query.country;
     }
 
     // Display the number of entries and date range
-    function displayEntryInfo(data) {
+    function displayEntryInfo(numRows, earliestDate, latestDate) {
         const dateRange = document.querySelector('#map-section h2');
-        const numRows = data.length;
-        const earliestDate = data.reduce((min, row) => row.date < min ? row.date : min, data[0].date);
-        const latestDate = data.reduce((max, row) => row.date > max ? row.date : max, data[0].date);
-
         dateRange.textContent = `${numRows} entries in BioArt from ${earliestDate} to ${latestDate}`;
     }
 });